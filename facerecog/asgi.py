@@ -5,6 +5,8 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+Run with: uvicorn facerecog.asgi:application --host 0.0.0.0 --port 8080
 """
 
 import os
@@ -12,5 +14,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "facerecog.settings")
+# Serve recognise/ and check/ with the async views (see RECOGNISE_ASYNC_VIEWS)
+os.environ.setdefault("RECOGNISE_ASYNC_VIEWS", "1")
 
 application = get_asgi_application()
@@ -159,9 +159,179 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10 MB
 
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')  # Or any other root you configured
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", os.path.join(BASE_DIR, 'media'))  # Or any other root you configured
 MEDIA_URL = '/media/'
 
 
 
-#testdeploy
\ No newline at end of file
+#testdeploy
+
+# -------------------- EMBEDDING GALLERY --------------------
+# In-memory cache of per-company embedding matrices used by recognise/.
+EMBEDDING_GALLERY_MAX_BYTES = int(os.getenv("EMBEDDING_GALLERY_MAX_BYTES", 256 * 1024 * 1024))
+# How often a cached company is checked against disk for registrations made by other workers.
+EMBEDDING_GALLERY_REVALIDATE_SECONDS = float(os.getenv("EMBEDDING_GALLERY_REVALIDATE_SECONDS", 30))
+# Storage precision of new template stores: "float32", "float16" or "int8" (per-row scale).
+# Existing folders keep theirs until `manage.py migrate_embeddings --compact`.
+# Compare memory and accuracy with `manage.py report_precision`.
+EMBEDDING_STORE_PRECISION = os.getenv("EMBEDDING_STORE_PRECISION", "float32")
+
+
+# -------------------- MATCHING --------------------
+# Templates further than this cosine distance from the probe are ignored.
+MATCH_MAX_DISTANCE = float(os.getenv("MATCH_MAX_DISTANCE", 0.5))
+# Minimum sum of squared similarities over the remaining templates to verify,
+# for a person with MATCH_REFERENCE_TEMPLATES templates. People with fewer
+# templates need a proportionally smaller sum.
+MATCH_VERIFY_THRESHOLD = float(os.getenv("MATCH_VERIFY_THRESHOLD", 4.5))
+MATCH_REFERENCE_TEMPLATES = int(os.getenv("MATCH_REFERENCE_TEMPLATES", 15))
+# "all" scores every template with the weighted-sum rule above; "centroid" compares
+# only against each person's mean embedding; "centroid_topk" against the mean plus
+# MATCH_SUMMARY_TOP_K outlier templates. Calibrate with manage.py calibrate_matcher.
+MATCH_MODE = os.getenv("MATCH_MODE", "all")
+MATCH_SUMMARY_TOP_K = int(os.getenv("MATCH_SUMMARY_TOP_K", 2))
+MATCH_CENTROID_THRESHOLD = float(os.getenv("MATCH_CENTROID_THRESHOLD", 0.65))
+MATCH_TOPK_THRESHOLD = float(os.getenv("MATCH_TOPK_THRESHOLD", 0.65))
+
+
+# -------------------- INFERENCE --------------------
+# Concurrent recognise requests are embedded together: a batch closes once it
+# holds INFERENCE_MAX_BATCH_SIZE faces or INFERENCE_MAX_WAIT_MS after its first face.
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 16))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", 5))
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_TIMEOUT_SECONDS", 30))
+
+
+# -------------------- REGISTRATION --------------------
+# About this many frames, spread evenly over the clip, are run through detection,
+# stopping early once REGISTRATION_MAX_FACES usable face crops are collected.
+REGISTRATION_SAMPLE_FRAMES = int(os.getenv("REGISTRATION_SAMPLE_FRAMES", 16))
+REGISTRATION_MAX_FACES = int(os.getenv("REGISTRATION_MAX_FACES", 16))
+REGISTRATION_MAX_SCAN_FRAMES = int(os.getenv("REGISTRATION_MAX_SCAN_FRAMES", 300))
+# Number of diverse, good-quality templates kept per person out of those crops.
+REGISTRATION_TEMPLATE_COUNT = int(os.getenv("REGISTRATION_TEMPLATE_COUNT", 5))
+# Faces whose Laplacian variance (at 160x160) is below this are too blurry to keep at all;
+# above it, sharpness only ranks faces against the rest of the clip.
+REGISTRATION_MIN_BLUR_VARIANCE = float(os.getenv("REGISTRATION_MIN_BLUR_VARIANCE", 8))
+# Longest side of the copy of each frame given to the detector.
+REGISTRATION_DETECT_MAX_SIDE = int(os.getenv("REGISTRATION_DETECT_MAX_SIDE", 640))
+# Longest side a kept face crop is stored at (Facenet itself only needs 160).
+REGISTRATION_CROP_MAX_SIDE = int(os.getenv("REGISTRATION_CROP_MAX_SIDE", 320))
+REGISTRATION_MIN_FACE_SIZE = int(os.getenv("REGISTRATION_MIN_FACE_SIZE", 40))
+
+
+# -------------------- IDENTIFICATION (1:N) --------------------
+# Best match must reach this cosine similarity to a person's centroid/outlier rows.
+IDENTIFY_THRESHOLD = float(os.getenv("IDENTIFY_THRESHOLD", 0.65))
+# Companies with at least this many indexed rows use an IVF index instead of a full scan.
+IDENTIFY_IVF_MIN_ROWS = int(os.getenv("IDENTIFY_IVF_MIN_ROWS", 20000))
+IDENTIFY_IVF_LISTS_PER_SQRT = float(os.getenv("IDENTIFY_IVF_LISTS_PER_SQRT", 1.0))
+IDENTIFY_IVF_NPROBE = int(os.getenv("IDENTIFY_IVF_NPROBE", 32))
+# Identify indexes (per company and per server) kept in memory, least recently used evicted first.
+IDENTIFY_INDEX_MAX_BYTES = int(os.getenv("IDENTIFY_INDEX_MAX_BYTES", 128 * 1024 * 1024))
+
+
+# -------------------- ATTENDANCE LOG --------------------
+# Rows are queued and written by a background thread every ATTENDANCE_LOG_FLUSH_SECONDS
+# or ATTENDANCE_LOG_BATCH_SIZE rows, so a crash loses at most one flush interval.
+ATTENDANCE_LOG_DIR = os.getenv("ATTENDANCE_LOG_DIR", os.path.join(BASE_DIR, "logs"))
+ATTENDANCE_LOG_FLUSH_SECONDS = float(os.getenv("ATTENDANCE_LOG_FLUSH_SECONDS", 1.0))
+ATTENDANCE_LOG_BATCH_SIZE = int(os.getenv("ATTENDANCE_LOG_BATCH_SIZE", 200))
+ATTENDANCE_LOG_QUEUE_SIZE = int(os.getenv("ATTENDANCE_LOG_QUEUE_SIZE", 10000))
+ATTENDANCE_LOG_MAX_FILE_BYTES = int(os.getenv("ATTENDANCE_LOG_MAX_FILE_BYTES", 50 * 1024 * 1024))
+# Also bulk-insert each batch into the recognise_attendancelog table.
+ATTENDANCE_LOG_DB = os.getenv("ATTENDANCE_LOG_DB", "0") == "1"
+
+
+# -------------------- WARM-UP --------------------
+# Serving processes build Facenet and MediaPipe and run a dummy inference on a
+# background thread at startup; /ready returns 503 until that has finished.
+MODEL_WARMUP_ON_START = os.getenv("MODEL_WARMUP_ON_START", "1") == "1"
+
+
+# -------------------- ASYNC (ASGI) --------------------
+# facerecog.asgi turns this on: recognise/ and check/ are then async views that keep
+# slow uploads off threads and run decode + inference on a bounded thread pool.
+RECOGNISE_ASYNC_VIEWS = os.getenv("RECOGNISE_ASYNC_VIEWS", "0") == "1"
+ASYNC_INFERENCE_WORKERS = int(os.getenv("ASYNC_INFERENCE_WORKERS", 8))
+# Requests queued or running on that pool beyond this get 503 + Retry-After.
+ASYNC_INFERENCE_MAX_PENDING = int(os.getenv("ASYNC_INFERENCE_MAX_PENDING", 32))
+ASYNC_RETRY_AFTER_SECONDS = int(os.getenv("ASYNC_RETRY_AFTER_SECONDS", 2))
+
+
+# -------------------- REGISTRATION JOBS --------------------
+# Set to 1 and /form/ queues the video and answers 202 with a job id (poll
+# /form/status/<job_id>/ for embeddings_saved) instead of processing it inside the
+# request. Off by default: existing clients expect the synchronous 200 response.
+REGISTRATION_ASYNC = os.getenv("REGISTRATION_ASYNC", "0") == "1"
+# Queued jobs are run by a dispatcher inside the web process that took the upload,
+# so they run without any extra process (under gunicorn every worker starts its own
+# pool). Set to 0 where one `manage.py registration_worker` runs them instead; the
+# Dockerfile does both.
+REGISTRATION_JOBS_IN_WEB = os.getenv("REGISTRATION_JOBS_IN_WEB", "1") == "1"
+# Registration videos processed at once, each in its own process.
+REGISTRATION_JOB_WORKERS = int(os.getenv("REGISTRATION_JOB_WORKERS", 1))
+# Niceness added to those processes so recognise requests get the CPU first.
+REGISTRATION_JOB_NICE = int(os.getenv("REGISTRATION_JOB_NICE", 10))
+REGISTRATION_JOB_THREADS = int(os.getenv("REGISTRATION_JOB_THREADS", 1))
+REGISTRATION_JOB_POLL_SECONDS = float(os.getenv("REGISTRATION_JOB_POLL_SECONDS", 5))
+REGISTRATION_JOB_TIMEOUT_SECONDS = int(os.getenv("REGISTRATION_JOB_TIMEOUT_SECONDS", 600))
+
+
+# -------------------- RECOGNISE DETECTION --------------------
+# The probe photo is searched for faces at most this large (longest side); the
+# largest face is then cropped from the full image and aligned.
+RECOGNISE_DETECT_MAX_SIDE = int(os.getenv("RECOGNISE_DETECT_MAX_SIDE", 640))
+# Faces smaller than this (pixels, shorter side of the crop) count as no face.
+RECOGNISE_MIN_FACE_SIZE = int(os.getenv("RECOGNISE_MIN_FACE_SIZE", 40))
+
+
+# -------------------- PROBE IMAGE DECODING --------------------
+# Probe photos are decoded to at most this many pixels (JPEGs at 1/2, 1/4 or 1/8
+# scale straight from the header size), which bounds decode time and memory.
+RECOGNISE_MAX_DECODE_PIXELS = int(os.getenv("RECOGNISE_MAX_DECODE_PIXELS", 2_000_000))
+# Photos whose header claims more pixels than this are rejected outright.
+RECOGNISE_MAX_INPUT_PIXELS = int(os.getenv("RECOGNISE_MAX_INPUT_PIXELS", 50_000_000))
+
+
+# -------------------- PROBE CACHE --------------------
+# Embeddings of recently uploaded photos, keyed by content hash, so client
+# retries of the same photo skip Facenet. 0 entries disables the cache.
+PROBE_CACHE_MAX_ENTRIES = int(os.getenv("PROBE_CACHE_MAX_ENTRIES", 1024))
+PROBE_CACHE_TTL_SECONDS = float(os.getenv("PROBE_CACHE_TTL_SECONDS", 300))
+# Also cache the verify outcome per (photo, server, company, mobile); dropped when the company's templates change
+PROBE_CACHE_VERIFICATIONS = os.getenv("PROBE_CACHE_VERIFICATIONS", "1") == "1"
+
+
+# -------------------- REGISTRATION INDEX --------------------
+# check/ answers "not registered" from memory for this long before looking at disk again.
+REGISTRATION_INDEX_NEGATIVE_TTL_SECONDS = float(os.getenv("REGISTRATION_INDEX_NEGATIVE_TTL_SECONDS", 2))
+# Most mobiles accepted by one batch check (maidMobiles=a,b,c)
+REGISTRATION_CHECK_MAX_BATCH = int(os.getenv("REGISTRATION_CHECK_MAX_BATCH", 500))
+
+
+# -------------------- METRICS & REQUEST LOGGING --------------------
+# Per-request emoji prints in the views (errors are always printed). Turn off under load.
+REQUEST_PRINTS = os.getenv("REQUEST_PRINTS", "1") == "1"
+# One JSON line per request (endpoint, status code, latency, stage timings) on the
+# "facerecog.requests" logger; set REQUEST_LOG_LEVEL=WARNING to silence it.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {"plain": {"format": "%(message)s"}},
+    "handlers": {"console": {"class": "logging.StreamHandler", "formatter": "plain"}},
+    "loggers": {
+        "facerecog.requests": {
+            "handlers": ["console"],
+            "level": os.getenv("REQUEST_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
+
+# -------------------- BATCH VERIFY (KIOSKS) --------------------
+# verify-batch/ takes several photos and/or several faces per photo plus a list of claimed mobiles.
+BATCH_VERIFY_MAX_IMAGES = int(os.getenv("BATCH_VERIFY_MAX_IMAGES", 8))
+BATCH_VERIFY_MAX_FACES_PER_IMAGE = int(os.getenv("BATCH_VERIFY_MAX_FACES_PER_IMAGE", 10))
+BATCH_VERIFY_MAX_CLAIMS = int(os.getenv("BATCH_VERIFY_MAX_CLAIMS", 50))
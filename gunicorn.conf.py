@@ -0,0 +1,68 @@
+"""
+Gunicorn settings for the facerecog API (picked up by `gunicorn -c gunicorn.conf.py`).
+
+Workers are pinned to the cores this container may use and every worker's
+TensorFlow / OpenMP / BLAS thread pools are sized so that workers * compute
+threads does not exceed them. Each worker serves several requests at once
+on gthread request threads: they mostly wait on the Facenet micro-batcher,
+which is what lets it run one forward pass for many concurrent uploads.
+With GUNICORN_PRELOAD=1 (default) Django and the TensorFlow / DeepFace /
+MediaPipe / OpenCV modules are imported once in the master and shared
+copy-on-write by the forked workers. The Facenet model itself is built in
+each worker after fork: a TensorFlow runtime that has run (or even
+initialised) a model before fork() deadlocks in the children.
+"""
+import importlib
+import os
+
+
+def _available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# -------------------- WORKERS --------------------
+_cores = _available_cores()
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8080")
+workers = int(os.getenv("GUNICORN_WORKERS", _cores))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Compute threads each worker's TensorFlow / OpenMP / BLAS may use
+_compute_threads = int(os.getenv("GUNICORN_COMPUTE_THREADS", max(1, _cores // workers)))
+
+# Request threads per worker (gthread). Waiting requests cost no CPU, so allow a few per
+# compute thread; past INFERENCE_MAX_BATCH_SIZE they would only queue behind a full batch.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv(
+    "GUNICORN_THREADS",
+    min(max(4, 4 * _compute_threads), int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 16))),
+))
+
+for _var in ("TF_NUM_INTRAOP_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(_var, str(_compute_threads))
+os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+
+# Warm-up must run in each worker, never on a thread in the master that fork() would drop
+_warmup = os.getenv("MODEL_WARMUP_ON_START", "1") == "1"
+if preload_app:
+    os.environ["MODEL_WARMUP_ON_START"] = "0"
+
+
+# -------------------- HOOKS --------------------
+def when_ready(server):
+    if not preload_app:
+        return
+    # Imports only; nothing here may start the TensorFlow runtime before fork()
+    for module in ("tensorflow", "deepface.DeepFace", "mediapipe", "cv2"):
+        importlib.import_module(module)
+    server.log.info("ML modules imported in the master; workers build Facenet after fork")
+
+
+def post_worker_init(worker):
+    if preload_app and _warmup:
+        from recognise import warmup
+
+        warmup.start()
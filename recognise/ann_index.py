@@ -0,0 +1,299 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from register.embedding_store import company_folder, embeddings_root, open_company, store_version
+
+from .gallery import gallery
+from .matcher import l2_normalize
+
+
+# -------------------- VECTOR INDEX --------------------
+class VectorIndex:
+    """
+    Cosine-similarity index over L2-normalised float32 rows, each labelled
+    with the mobile it belongs to. With nlist > 0 rows are bucketed by a
+    spherical k-means (IVF) and a search only scans the nprobe closest
+    buckets; otherwise every row is scanned.
+    """
+
+    def __init__(self, vectors, labels, nlist=0, nprobe=1, seed=0):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.labels = np.asarray(labels, dtype=object)
+        self.alive = np.ones(len(labels), dtype=bool)
+        self.nprobe = nprobe
+        self.centroids = None
+        self.lists = None
+        self._lock = threading.Lock()
+        if nlist and len(labels) > nlist:
+            self._train(nlist, seed)
+
+    @property
+    def is_ivf(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    @property
+    def nbytes(self):
+        """Approximate memory held: rows, labels, liveness mask and IVF lists."""
+        total = self.vectors.nbytes + self.labels.nbytes + self.alive.nbytes
+        if self.is_ivf:
+            total += self.centroids.nbytes + sum(rows.nbytes for rows in self.lists)
+        return total
+
+    def _train(self, nlist, seed, iterations=10):
+        rng = np.random.default_rng(seed)
+        centroids = self.vectors[rng.choice(len(self.vectors), nlist, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(self.vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, self.vectors)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = l2_normalize(sums)
+        self.centroids = centroids
+        assign = np.argmax(self.vectors @ centroids.T, axis=1)
+        self.lists = [np.flatnonzero(assign == c) for c in range(nlist)]
+
+    def add(self, label, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            start = len(self.labels)
+            self.vectors = np.vstack([self.vectors, vectors]) if start else vectors.copy()
+            self.labels = np.concatenate([self.labels, np.array([label] * len(vectors), dtype=object)])
+            self.alive = np.concatenate([self.alive, np.ones(len(vectors), dtype=bool)])
+            if self.is_ivf:
+                assign = np.argmax(vectors @ self.centroids.T, axis=1)
+                for offset, c in enumerate(assign):
+                    self.lists[c] = np.append(self.lists[c], start + offset)
+
+    def remove(self, label):
+        with self._lock:
+            # Copy-on-write: a search already holding the old mask keeps a consistent view
+            alive = self.alive.copy()
+            alive[self.labels == label] = False
+            self.alive = alive
+
+    def search(self, probe, k=5):
+        """Return up to k (label, similarity) pairs, best row per label, most similar first."""
+        probe = l2_normalize(probe)
+        with self._lock:
+            vectors, labels, alive = self.vectors, self.labels, self.alive
+            if self.is_ivf:
+                nearest = np.argsort(self.centroids @ probe)[::-1][:self.nprobe]
+                rows = np.concatenate([self.lists[c] for c in nearest])
+            else:
+                rows = np.arange(len(labels))
+
+        rows = rows[alive[rows]]
+        if len(rows) == 0:
+            return []
+
+        similarities = vectors[rows] @ probe
+        order = np.argsort(similarities)[::-1]
+
+        results = {}
+        for i in order:
+            label = labels[rows[i]]
+            if label not in results:
+                results[label] = float(similarities[i])
+                if len(results) == k:
+                    break
+        return list(results.items())
+
+
+def build_index(store):
+    """Index every person's summary rows (centroid + outliers) from a CompanyStore."""
+    vectors, labels = [], []
+    for mobile in store.mobiles:
+        summary = np.asarray(store.summary(mobile))
+        vectors.append(summary)
+        labels.extend([mobile] * len(summary))
+
+    if not vectors:
+        return VectorIndex(np.zeros((0, 0), dtype=np.float32), [])
+
+    vectors = np.vstack(vectors)
+    nlist = 0
+    if len(vectors) >= settings.IDENTIFY_IVF_MIN_ROWS:
+        nlist = int(np.sqrt(len(vectors)) * settings.IDENTIFY_IVF_LISTS_PER_SQRT)
+    return VectorIndex(vectors, labels, nlist=nlist, nprobe=settings.IDENTIFY_IVF_NPROBE)
+
+
+# -------------------- INDEX CACHE --------------------
+def server_companies(server_name):
+    """Company ids with an embeddings folder on a server."""
+    server_folder = os.path.join(embeddings_root(), str(server_name).strip().lower())
+    if not os.path.isdir(server_folder):
+        return []
+    return sorted(c[len("company_"):] for c in os.listdir(server_folder) if c.startswith("company_"))
+
+
+def server_versions(server_name):
+    """{company: store version} for every company on a server; the server index is valid while this is unchanged."""
+    versions = {}
+    for company in server_companies(server_name):
+        try:
+            versions[company] = store_version(company_folder(server_name, company))
+        except FileNotFoundError:
+            pass
+    return versions
+
+
+def build_server_index(server_name, companies):
+    """
+    One index over every company on a server, labelled "company/mobile".
+    Company folders are opened directly rather than through the gallery, so
+    a server-wide identify does not push the verify working set out of it.
+    """
+    vectors, labels = [], []
+    for company in companies:
+        store = open_company(company_folder(server_name, company))
+        if store is None:
+            continue
+        for mobile in store.mobiles:
+            summary = np.array(store.summary(mobile), dtype=np.float32)
+            vectors.append(summary)
+            labels.extend([f"{company}/{mobile}"] * len(summary))
+
+    if not vectors:
+        return VectorIndex(np.zeros((0, 0), dtype=np.float32), [])
+
+    vectors = np.vstack(vectors)
+    nlist = 0
+    if len(vectors) >= settings.IDENTIFY_IVF_MIN_ROWS:
+        nlist = int(np.sqrt(len(vectors)) * settings.IDENTIFY_IVF_LISTS_PER_SQRT)
+    return VectorIndex(vectors, labels, nlist=nlist, nprobe=settings.IDENTIFY_IVF_NPROBE)
+
+
+class CompanyIndexCache:
+    """
+    LRU of VectorIndexes, evicted by total size (max_bytes): one per
+    (server, company), built on first identify from the gallery, and one per
+    server (key (server, None)) for identify without a uniqueId. Company
+    indexes follow the gallery's store version; a server index is checked
+    against every company's store version at most every revalidate_seconds.
+    Registrations in this process are patched into both in place.
+    """
+
+    def __init__(self, max_bytes, revalidate_seconds):
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        # key -> [version, index, checked_at]
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks = {}
+
+    @staticmethod
+    def _key(server_name, uniqueId):
+        return str(server_name).strip().lower(), None if uniqueId is None else str(uniqueId)
+
+    def _cached(self, key):
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is not None:
+                self._indexes.move_to_end(key)
+            return cached
+
+    def _store(self, key, version, index):
+        with self._lock:
+            self._indexes[key] = [version, index, time.monotonic()]
+            self._indexes.move_to_end(key)
+            total = sum(entry[1].nbytes for entry in self._indexes.values())
+            while total > self.max_bytes and len(self._indexes) > 1:
+                evicted_key, evicted = self._indexes.popitem(last=False)
+                self._build_locks.pop(evicted_key, None)
+                total -= evicted[1].nbytes
+
+    def get(self, server_name, uniqueId):
+        key = self._key(server_name, uniqueId)
+        store = gallery.get(*key)
+        if store is None:
+            return None
+
+        cached = self._cached(key)
+        if cached is not None and cached[0] == store.version:
+            return cached[1]
+
+        index = build_index(store)
+        self._store(key, store.version, index)
+        return index
+
+    def get_server(self, server_name):
+        """The index over every company on a server, or None if it has none."""
+        key = self._key(server_name, None)
+        cached = self._cached(key)
+        if cached is not None and time.monotonic() - cached[2] < self.revalidate_seconds:
+            return cached[1]
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            current = self._cached(key)
+            if current is not None and current is not cached:
+                return current[1]
+
+            versions = server_versions(server_name)
+            if not versions:
+                self.invalidate(server_name, None)
+                return None
+            if cached is not None and cached[0] == versions:
+                cached[2] = time.monotonic()
+                return cached[1]
+
+            index = build_server_index(server_name, versions)
+            self._store(key, versions, index)
+            return index
+
+    def update_person(self, server_name, uniqueId, mobile, summary):
+        key = self._key(server_name, uniqueId)
+        server_key = self._key(server_name, None)
+        with self._lock:
+            cached = self._indexes.get(key)
+            server_cached = self._indexes.get(server_key)
+
+        if cached is not None:
+            index = cached[1]
+            index.remove(str(mobile))
+            index.add(str(mobile), summary)
+            try:
+                version = store_version(company_folder(*key))
+            except FileNotFoundError:
+                version = None
+            if version is not None:
+                self._store(key, version, index)
+
+        if server_cached is not None:
+            label = f"{uniqueId}/{mobile}"
+            server_cached[1].remove(label)
+            server_cached[1].add(label, summary)
+            try:
+                # Keep the other companies' versions so their changes still trigger a rebuild
+                versions = dict(server_cached[0])
+                versions[str(uniqueId)] = store_version(company_folder(*key))
+            except FileNotFoundError:
+                return
+            self._store(server_key, versions, server_cached[1])
+
+    def invalidate(self, server_name, uniqueId):
+        with self._lock:
+            for key in {self._key(server_name, uniqueId), self._key(server_name, None)}:
+                self._indexes.pop(key, None)
+                self._build_locks.pop(key, None)
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(entry[1].nbytes for entry in self._indexes.values())
+
+
+indexes = CompanyIndexCache(
+    max_bytes=settings.IDENTIFY_INDEX_MAX_BYTES,
+    revalidate_seconds=settings.EMBEDDING_GALLERY_REVALIDATE_SECONDS,
+)
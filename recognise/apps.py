@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class RecogniseConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "recognise"
+
+    def ready(self):
+        # Build the models before the first request rather than during it; /ready reports when done
+        from . import warmup
+
+        if warmup.should_warm_up():
+            warmup.start()
@@ -0,0 +1,220 @@
+import atexit
+import csv
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+
+# Fixed column order for every attendance CSV, whatever keys a row has.
+FIELDNAMES = [
+    "timestamp",
+    "maid_name",
+    "maid_mobile",
+    "unique_id",
+    "verified",
+    "weighted_sum",
+    "mask_status",
+    "temperature",
+    "shift_details",
+    "latitude",
+    "longitude",
+    "device_name",
+    "device_brand",
+    "system_name",
+    "ip_address",
+    "server_name",
+]
+
+# Queued by close() to wake the writer thread
+_STOP = object()
+
+
+# -------------------- WRITER --------------------
+class AttendanceLogWriter:
+    """
+    Background writer for attendance rows. Requests only enqueue; a daemon
+    thread flushes every flush_seconds or batch_size rows into
+    {directory}/attendance_logs_{date}.csv, rolling over to .1, .2, ...
+    once a file passes max_file_bytes. When the queue is full (or the
+    writer is closed) the caller writes its own row synchronously instead
+    of dropping it. Optionally each batch is also bulk-inserted into the
+    AttendanceLog table.
+    """
+
+    def __init__(self, directory, flush_seconds, batch_size, queue_size, max_file_bytes, use_db=False):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.max_file_bytes = max_file_bytes
+        self.use_db = use_db
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+        self._thread = threading.Thread(target=self._run, name="attendance-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, row):
+        if self._closed.is_set():
+            self._write_batch([row])
+            return
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._write_batch([row])
+
+    def write_many(self, rows):
+        """Queue several rows at once; any that do not fit are written together right away."""
+        if self._closed.is_set():
+            self._write_batch(rows)
+            return
+        for i, row in enumerate(rows):
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                self._write_batch(rows[i:])
+                return
+
+    def _drain(self, limit):
+        rows = []
+        while len(rows) < limit:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _STOP:
+                rows.append(row)
+        return rows
+
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                rows = [self._queue.get(timeout=self.flush_seconds)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_seconds
+            while len(rows) < self.batch_size and rows[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            rows = [row for row in rows if row is not _STOP]
+            if rows:
+                self._write_batch(rows)
+
+    def flush(self):
+        """Write everything queued so far on the calling thread."""
+        while True:
+            rows = self._drain(self.batch_size)
+            if not rows:
+                return
+            self._write_batch(rows)
+
+    def close(self):
+        """
+        Stop the writer thread once it has written the batch it holds, then
+        write what is still queued (run at exit). Later rows are written
+        synchronously.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass  # the thread is busy with a batch and checks _closed after it
+        self._thread.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def _write_batch(self, rows):
+        try:
+            with metrics.timed_lock(self._write_lock, "attendance_write_lock"), metrics.stage("attendance_flush"):
+                by_day = {}
+                for row in rows:
+                    by_day.setdefault(str(row.get("timestamp", ""))[:10] or "unknown", []).append(row)
+                for day, day_rows in by_day.items():
+                    self._append_csv(day, day_rows)
+            if self.use_db:
+                self._insert_db(rows)
+        except Exception as e:
+            print("❌ Attendance log write failed:", e)
+
+    def _current_path(self, day):
+        base = os.path.join(self.directory, f"attendance_logs_{day}")
+        path, part = f"{base}.csv", 0
+        while os.path.exists(path) and os.path.getsize(path) >= self.max_file_bytes:
+            part += 1
+            path = f"{base}.{part}.csv"
+        return path
+
+    def _append_csv(self, day, rows):
+        path = self._current_path(day)
+        new_file = not os.path.exists(path)
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDNAMES, restval="N/A", extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerows(rows)
+
+    def _insert_db(self, rows):
+        from django.db import InterfaceError, OperationalError, close_old_connections, connection
+
+        from .models import AttendanceLog
+
+        records = [AttendanceLog.from_row(row) for row in rows]
+        # Request signals never run on the writer thread, so drop a connection the server
+        # has timed out (e.g. MySQL wait_timeout overnight) before using it
+        close_old_connections()
+        try:
+            AttendanceLog.objects.bulk_create(records)
+        except (InterfaceError, OperationalError):
+            # Went away without failing the usability check; reconnect and retry once
+            connection.close()
+            AttendanceLog.objects.bulk_create(records)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AttendanceLogWriter(
+                    directory=settings.ATTENDANCE_LOG_DIR,
+                    flush_seconds=settings.ATTENDANCE_LOG_FLUSH_SECONDS,
+                    batch_size=settings.ATTENDANCE_LOG_BATCH_SIZE,
+                    queue_size=settings.ATTENDANCE_LOG_QUEUE_SIZE,
+                    max_file_bytes=settings.ATTENDANCE_LOG_MAX_FILE_BYTES,
+                    use_db=settings.ATTENDANCE_LOG_DB,
+                )
+    return _writer
+
+
+def log_attendance(row):
+    get_writer().write(row)
+
+
+def log_attendance_many(rows):
+    get_writer().write_many(rows)
+
+
+def parse_timestamp(value):
+    try:
+        return timezone.make_aware(datetime.strptime(value, "%Y-%m-%d %H:%M:%S"))
+    except (TypeError, ValueError):
+        return timezone.now()
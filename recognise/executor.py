@@ -0,0 +1,53 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class ExecutorFull(Exception):
+    """Raised instead of queueing when the executor already holds max_pending tasks."""
+
+
+# -------------------- BOUNDED EXECUTOR --------------------
+class BoundedExecutor:
+    """
+    Thread pool for the CPU-bound part of a request (decode, detection,
+    embedding, matching). At most max_pending tasks may be queued or
+    running; past that submit() raises ExecutorFull so the async views can
+    answer 503 straight away instead of piling up work.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recognise-cpu")
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorFull()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = BoundedExecutor(
+                    max_workers=settings.ASYNC_INFERENCE_WORKERS,
+                    max_pending=settings.ASYNC_INFERENCE_MAX_PENDING,
+                )
+    return _executor
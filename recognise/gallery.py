@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from register.embedding_store import company_folder, open_company, store_version
+
+
+# -------------------- PROCESS-WIDE CACHE --------------------
+class EmbeddingGallery:
+    """
+    Lazily loaded, LRU-evicted cache of per-company template stores keyed by
+    (server, company). Each entry is a register.embedding_store.CompanyStore:
+    one contiguous, L2-normalised matrix at the store's precision
+    (memory-mapped for packed folders) with a mobile -> row range index.
+    Eviction is driven by the total matrix size.
+
+    Entries are immutable snapshots that are replaced, never modified, so
+    readers of different (or the same) companies never block each other; the
+    lock only guards the dict itself.
+    """
+
+    def __init__(self, max_bytes, revalidate_seconds):
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self._entries = OrderedDict()
+        self._checked_at = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    @staticmethod
+    def _key(server_name, uniqueId):
+        return str(server_name).strip().lower(), str(uniqueId)
+
+    def get(self, server_name, uniqueId, max_age=None):
+        """
+        Return the CompanyStore for a tenant, or None if it has no embeddings
+        folder. A cached store older than max_age seconds (default
+        revalidate_seconds) is checked against disk first.
+        """
+        key = self._key(server_name, uniqueId)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        if entry is not None and not self._is_stale(key, entry, max_age):
+            return entry
+
+        with load_lock:
+            # Another thread may have finished the load while we waited.
+            with self._lock:
+                current = self._entries.get(key)
+            if current is not None and current is not entry:
+                return current
+
+            entry = open_company(company_folder(*key))
+            if entry is None:
+                self.invalidate(*key)
+                return None
+
+            self._store(key, entry)
+            return entry
+
+    def _is_stale(self, key, entry, max_age=None):
+        if max_age is None:
+            max_age = self.revalidate_seconds
+        now = time.monotonic()
+        with self._lock:
+            checked_at = self._checked_at.get(key, now)
+        if now - checked_at < max_age:
+            return False
+        try:
+            stale = store_version(company_folder(*key)) != entry.version
+        except FileNotFoundError:
+            stale = True
+        with self._lock:
+            self._checked_at[key] = now
+        return stale
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._checked_at[key] = time.monotonic()
+            total = sum(e.nbytes for e in self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._checked_at.pop(evicted_key, None)
+                self._load_locks.pop(evicted_key, None)
+                total -= evicted.nbytes
+
+    def invalidate(self, server_name, uniqueId):
+        key = self._key(server_name, uniqueId)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._checked_at.pop(key, None)
+            # A loader still holding the dropped lock only races a new one into a duplicate load
+            self._load_locks.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._checked_at.clear()
+            self._load_locks.clear()
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(e.nbytes for e in self._entries.values())
+
+
+gallery = EmbeddingGallery(
+    max_bytes=settings.EMBEDDING_GALLERY_MAX_BYTES,
+    revalidate_seconds=settings.EMBEDDING_GALLERY_REVALIDATE_SECONDS,
+)
@@ -0,0 +1,336 @@
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+
+# OpenCV, DeepFace and MediaPipe (and with them TensorFlow) are imported inside
+# the functions that need them, so loading the URLconf or running a management
+# command never pays for the ML stack.
+
+MODEL_NAME = "Facenet"
+INPUT_SIZE = (160, 160)
+
+
+# -------------------- MODEL --------------------
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from deepface import DeepFace
+
+                _model = DeepFace.build_model(MODEL_NAME)
+    return _model
+
+
+class LockedFaceDetection:
+    """A MediaPipe graph is not thread-safe; this serialises process() calls on the shared one."""
+
+    def __init__(self, detector):
+        self._detector = detector
+        self._lock = threading.Lock()
+
+    def process(self, rgb):
+        with metrics.timed_lock(self._lock, "face_detection_lock"):
+            return self._detector.process(rgb)
+
+
+_face_detection = None
+_face_detection_lock = threading.Lock()
+
+
+def get_face_detection():
+    """Shared MediaPipe face detector used by registration and recognise (and warmed at boot)."""
+    global _face_detection
+    if _face_detection is None:
+        with _face_detection_lock:
+            if _face_detection is None:
+                import mediapipe as mp
+
+                _face_detection = LockedFaceDetection(
+                    mp.solutions.face_detection.FaceDetection(min_detection_confidence=0.8)
+                )
+    return _face_detection
+
+
+# -------------------- PREPROCESSING --------------------
+# JPEG start-of-frame markers (baseline, progressive, lossless, arithmetic...) carry the image size
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def image_size(data):
+    """(width, height) read from a JPEG or PNG header without decoding, or None for other/corrupt data."""
+    if data[:8] == _PNG_SIGNATURE and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:2] != b"\xff\xd8":
+        return None
+
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1  # fill byte
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2  # markers without a length
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None
+
+
+def reduction_factor(width, height, max_pixels):
+    """Smallest of 1, 2, 4, 8 that brings width x height within max_pixels (8 if none does)."""
+    for factor in (1, 2, 4):
+        if (width // factor) * (height // factor) <= max_pixels:
+            return factor
+    return 8
+
+
+def decode_image(data):
+    """
+    Decode uploaded image bytes to a BGR array of at most RECOGNISE_MAX_DECODE_PIXELS,
+    or None if they are not an image or exceed RECOGNISE_MAX_INPUT_PIXELS.
+    JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale (chosen from the
+    header) so a 12 MP photo never exists at full size; anything still over
+    the budget is resized down after decoding.
+    """
+    import cv2
+
+    size = image_size(data)
+    if size is not None and size[0] * size[1] > settings.RECOGNISE_MAX_INPUT_PIXELS:
+        metrics.trace(f"❌ Image {size[0]}x{size[1]} is over RECOGNISE_MAX_INPUT_PIXELS")
+        return None
+
+    flags = cv2.IMREAD_COLOR
+    if size is not None:
+        flags = {
+            1: cv2.IMREAD_COLOR,
+            2: cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_COLOR_4,
+            8: cv2.IMREAD_REDUCED_COLOR_8,
+        }[reduction_factor(size[0], size[1], settings.RECOGNISE_MAX_DECODE_PIXELS)]
+
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    if image is None:
+        return None
+
+    h, w = image.shape[:2]
+    if h * w > settings.RECOGNISE_MAX_DECODE_PIXELS:
+        scale = (settings.RECOGNISE_MAX_DECODE_PIXELS / (h * w)) ** 0.5
+        image = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return image
+
+
+def downscale(image, max_side):
+    import cv2
+
+    h, w = image.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def detect_faces(image, max_faces=None):
+    """
+    Find faces in a BGR image with the shared MediaPipe detector, run on a
+    copy no longer than RECOGNISE_DETECT_MAX_SIDE, and return them cropped
+    from the full image and aligned, largest first. Faces smaller than
+    RECOGNISE_MIN_FACE_SIZE are dropped.
+    """
+    import cv2
+
+    small = downscale(image, settings.RECOGNISE_DETECT_MAX_SIDE)
+    result = get_face_detection().process(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+    if not result.detections:
+        return []
+
+    def area(detection):
+        box = detection.location_data.relative_bounding_box
+        return box.width * box.height
+
+    crops = []
+    for detection in sorted(result.detections, key=area, reverse=True):
+        crop = crop_face(image, detection)
+        if crop is None or min(crop.shape[:2]) < settings.RECOGNISE_MIN_FACE_SIZE:
+            continue
+        crops.append(crop)
+        if max_faces is not None and len(crops) == max_faces:
+            break
+    return crops
+
+
+def detect_face(image):
+    """The largest face in a BGR image (see detect_faces), or None when there is none."""
+    faces = detect_faces(image, max_faces=1)
+    return faces[0] if faces else None
+
+
+def crop_face(frame, detection, align=True):
+    """
+    Crop a MediaPipe face detection out of a BGR frame. With align=True the
+    region around the face is first rotated so the eyes are level.
+    Returns None if the box falls outside the frame.
+    """
+    import cv2
+
+    ih, iw = frame.shape[:2]
+    box = detection.location_data.relative_bounding_box
+    x, y = int(box.xmin * iw), int(box.ymin * ih)
+    w, h = int(box.width * iw), int(box.height * ih)
+
+    keypoints = detection.location_data.relative_keypoints
+    if align and len(keypoints) >= 2:
+        right_eye, left_eye = keypoints[0], keypoints[1]
+        angle = np.degrees(np.arctan2((left_eye.y - right_eye.y) * ih, (left_eye.x - right_eye.x) * iw))
+        if 0.5 < abs(angle) < 45:
+            # Rotate only a margin around the box so its corners stay filled
+            margin = max(w, h) // 2
+            x0, y0 = max(0, x - margin), max(0, y - margin)
+            x1, y1 = min(iw, x + w + margin), min(ih, y + h + margin)
+            region = frame[y0:y1, x0:x1]
+            if region.size:
+                center = (x + w / 2 - x0, y + h / 2 - y0)
+                matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+                frame = cv2.warpAffine(region, matrix, (region.shape[1], region.shape[0]), borderMode=cv2.BORDER_REPLICATE)
+                ih, iw = frame.shape[:2]
+                x, y = x - x0, y - y0
+
+    x, y = max(0, x), max(0, y)
+    crop = frame[y:min(y + h, ih), x:min(x + w, iw)]
+    if crop.size == 0:
+        return None
+    return crop
+
+
+def preprocess(face):
+    """Letterbox a BGR face to the Facenet input size as float32 in [0, 1]."""
+    import cv2
+
+    target_h, target_w = INPUT_SIZE
+    h, w = face.shape[:2]
+    factor = min(target_h / h, target_w / w)
+    resized = cv2.resize(face, (max(1, int(w * factor)), max(1, int(h * factor))))
+
+    pad_h = target_h - resized.shape[0]
+    pad_w = target_w - resized.shape[1]
+    padded = np.pad(
+        resized,
+        ((pad_h // 2, pad_h - pad_h // 2), (pad_w // 2, pad_w - pad_w // 2), (0, 0)),
+        "constant",
+    ).astype(np.float32)
+
+    if face.dtype == np.uint8:
+        padded /= 255.0
+    return padded
+
+
+def embed_batch(faces):
+    """Embed a list of BGR faces with one Facenet forward pass. Returns an (n, 128) array."""
+    batch = np.stack([preprocess(face) for face in faces])
+    return np.asarray(get_model().model(batch, training=False))
+
+
+# -------------------- MICRO-BATCHING WORKER --------------------
+class BatchingEmbedder:
+    """
+    Single background thread that owns the model. Requests queue faces and
+    block on a Future; the worker drains up to max_batch_size faces, waiting
+    at most max_wait_ms after the first one, and runs them as one batch.
+    """
+
+    def __init__(self, max_batch_size, max_wait_ms):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="facenet-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, face):
+        future = Future()
+        self._queue.put((face, future, time.perf_counter()))
+        return future
+
+    def embed(self, face, timeout=None):
+        return self.submit(face).result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for _, _, queued_at in batch:
+                # How long each face waited for the model: the batcher's equivalent of model_lock wait
+                metrics.LOCK_WAIT_SECONDS.observe(started - queued_at, lock="facenet_batcher")
+            metrics.BATCH_SIZE.observe(len(batch))
+
+            faces = [face for face, _, _ in batch]
+            try:
+                with metrics.stage("embed_batch"):
+                    embeddings = embed_batch(faces)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = BatchingEmbedder(
+                    max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+                    max_wait_ms=settings.INFERENCE_MAX_WAIT_MS,
+                )
+    return _embedder
+
+
+def embed(face):
+    """Embed one BGR face through the shared micro-batching worker."""
+    return get_embedder().embed(face, timeout=settings.INFERENCE_TIMEOUT_SECONDS)
+
+
+def embed_many(faces):
+    """
+    Embed several BGR faces through the micro-batching worker. They are queued
+    together, so up to INFERENCE_MAX_BATCH_SIZE of them share one forward pass.
+    Returns an (n, 128) array.
+    """
+    embedder = get_embedder()
+    futures = [embedder.submit(face) for face in faces]
+    return np.stack([future.result(timeout=settings.INFERENCE_TIMEOUT_SECONDS) for future in futures])
@@ -0,0 +1,108 @@
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from recognise import matcher
+from recognise.gallery import gallery
+from recognise.management.commands.bench_service import synthetic_tree
+from register import embedding_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Verification throughput with many threads across many tenants, with and without a "
+        "process-wide lock around scoring (the old embedding_lock), while a writer thread "
+        "keeps re-registering people so snapshots are swapped underneath the readers. "
+        "The synthetic tree lives in a temporary MEDIA_ROOT, removed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16, 64])
+        parser.add_argument("--companies", type=int, default=16)
+        parser.add_argument("--people", type=int, default=200)
+        parser.add_argument("--frames", type=int, default=15)
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument("--writes-per-second", type=float, default=5, help="0 disables the writer thread")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix="bench_contention_") as scratch, override_settings(MEDIA_ROOT=scratch):
+            try:
+                self._bench(options)
+            finally:
+                gallery.clear()
+
+    def _bench(self, options):
+        tree = synthetic_tree(1, options["companies"], options["people"], options["frames"], seed=options["seed"])
+        self.stdout.write(f"{len(tree)} companies x {options['people']} people x {options['frames']} frames")
+        self.stdout.write(
+            f"{'threads':>7} {'lock':>7} {'verify/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'writes':>7} {'errors':>7}"
+        )
+        for threads in options["threads"]:
+            for name, lock in (("global", threading.Lock()), ("none", None)):
+                row = self._run(tree, threads, lock, options)
+                self.stdout.write(
+                    f"{threads:>7} {name:>7} {row['rate']:>9.0f} {row['p50']:>8.2f} {row['p99']:>8.2f} "
+                    f"{row['writes']:>7} {row['errors']:>7}"
+                )
+
+    def _run(self, tree, threads, lock, options):
+        gallery.clear()
+        stop = threading.Event()
+        deadline = time.monotonic() + options["seconds"]
+        latencies = [[] for _ in range(threads)]
+        errors = [0] * threads
+        writes = [0]
+
+        def reader(n):
+            rng = np.random.default_rng([options["seed"], n])
+            while time.monotonic() < deadline:
+                server, company, mobiles = tree[rng.integers(len(tree))]
+                mobile = mobiles[rng.integers(len(mobiles))]
+                probe = rng.normal(size=128).astype(np.float32)
+                start = time.perf_counter()
+                try:
+                    store = gallery.get(server, company)
+                    with lock if lock is not None else nullcontext():
+                        matcher.verify_user(probe, store, mobile)
+                except Exception:
+                    errors[n] += 1
+                latencies[n].append(time.perf_counter() - start)
+            stop.set()
+
+        def writer():
+            rng = np.random.default_rng([options["seed"], 1 << 20])
+            interval = 1.0 / options["writes_per_second"]
+            while not stop.wait(interval):
+                server, company, mobiles = tree[rng.integers(len(tree))]
+                mobile = mobiles[rng.integers(len(mobiles))]
+                embedding_store.write_person(
+                    embedding_store.company_folder(server, company), mobile,
+                    rng.normal(size=(options["frames"], 128)),
+                )
+                gallery.invalidate(server, company)
+                writes[0] += 1
+
+        workers = [threading.Thread(target=reader, args=(n,)) for n in range(threads)]
+        if options["writes_per_second"] > 0:
+            workers.append(threading.Thread(target=writer))
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        all_latencies = np.concatenate([np.array(l) for l in latencies]) * 1000
+        return {
+            "rate": len(all_latencies) / elapsed,
+            "p50": float(np.percentile(all_latencies, 50)),
+            "p99": float(np.percentile(all_latencies, 99)),
+            "writes": writes[0],
+            "errors": sum(errors),
+        }
@@ -0,0 +1,166 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def proc_memory_kb(pid):
+    """(rss, pss) of a process in kB from /proc; pss splits shared pages between their users."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key] = int(rest.split()[0])
+    return values.get("Rss", 0), values.get("Pss", 0)
+
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Start gunicorn with gunicorn.conf.py at several worker counts and report "
+        "RSS/PSS per worker and total /recognise/ throughput for each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+        parser.add_argument("--seconds", type=float, default=20)
+        parser.add_argument("--clients-per-worker", type=int, default=2)
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--image", help="JPEG to post (default: a frame from testing/veditha.mp4)")
+        parser.add_argument("--no-preload", action="store_true", help="Load the app separately in every worker")
+        parser.add_argument("--ready-timeout", type=float, default=300)
+
+    def handle(self, *args, **options):
+        image = self._image(options["image"])
+        body, content_type = multipart(
+            {"groundmobiledispreq": "9999999999", "groundtemauniqueId": "bench", "serverName": "bench"},
+            {"PaymaaUpload1": ("probe.jpg", image)},
+        )
+
+        self.stdout.write(
+            f"{'workers':>7} {'master MB':>10} {'worker RSS MB':>14} {'worker PSS MB':>14} "
+            f"{'total PSS MB':>13} {'req/s':>7} {'errors':>7}"
+        )
+        for count in options["workers"]:
+            row = self._run(count, body, content_type, options)
+            self.stdout.write(
+                f"{count:>7} {row['master_rss'] / 1024:>10.0f} {row['worker_rss'] / 1024:>14.0f} "
+                f"{row['worker_pss'] / 1024:>14.0f} {row['total_pss'] / 1024:>13.0f} "
+                f"{row['throughput']:>7.1f} {row['errors']:>7}"
+            )
+
+    def _image(self, path):
+        if path:
+            with open(path, "rb") as f:
+                return f.read()
+        import cv2
+
+        capture = cv2.VideoCapture(os.path.join(settings.BASE_DIR, "testing", "veditha.mp4"))
+        ok, frame = capture.read()
+        capture.release()
+        if not ok:
+            raise CommandError("Could not read a frame from testing/veditha.mp4; pass --image")
+        return cv2.imencode(".jpg", frame)[1].tobytes()
+
+    def _run(self, count, body, content_type, options):
+        base = f"http://127.0.0.1:{options['port']}"
+        env = dict(
+            os.environ,
+            GUNICORN_WORKERS=str(count),
+            GUNICORN_BIND=f"127.0.0.1:{options['port']}",
+            GUNICORN_PRELOAD="0" if options["no_preload"] else "1",
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "facerecog.wsgi:application"],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            self._wait_ready(base, server, count, options["ready_timeout"])
+
+            workers = child_pids(server.pid)
+            master_rss, master_pss = proc_memory_kb(server.pid)
+            memory = [proc_memory_kb(pid) for pid in workers]
+
+            done, errors, elapsed = self._load(base, body, content_type, count * options["clients_per_worker"], options["seconds"])
+            return {
+                "master_rss": master_rss,
+                "worker_rss": sum(r for r, _ in memory) / len(memory),
+                "worker_pss": sum(p for _, p in memory) / len(memory),
+                "total_pss": master_pss + sum(p for _, p in memory),
+                "throughput": done / elapsed,
+                "errors": errors,
+            }
+        finally:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    def _wait_ready(self, base, server, count, timeout):
+        # /ready lands on whichever worker accepts, so require a run of successes
+        deadline, streak = time.monotonic() + timeout, 0
+        while streak < count * 3:
+            if server.poll() is not None:
+                raise CommandError(f"gunicorn exited with code {server.returncode}")
+            if time.monotonic() > deadline:
+                raise CommandError(f"{count} workers not ready after {timeout:.0f}s")
+            try:
+                with urllib.request.urlopen(f"{base}/ready", timeout=5) as response:
+                    streak = streak + 1 if response.status == 200 else 0
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                streak = 0
+                time.sleep(0.5)
+
+    def _load(self, base, body, content_type, clients, seconds):
+        deadline = time.monotonic() + seconds
+
+        def client(_):
+            done = errors = 0
+            while time.monotonic() < deadline:
+                request = urllib.request.Request(
+                    f"{base}/recognise/", data=body, headers={"Content-Type": content_type}
+                )
+                try:
+                    with urllib.request.urlopen(request, timeout=120) as response:
+                        response.read()
+                    done += 1
+                except (urllib.error.URLError, ConnectionError, TimeoutError):
+                    errors += 1
+            return done, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(client, range(clients)))
+        elapsed = time.perf_counter() - start
+        return sum(d for d, _ in results), sum(e for _, e in results), elapsed
@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recognise.ann_index import VectorIndex
+from register.embedding_store import normalize_rows, summarize_templates
+
+
+def synthetic_company(people, templates, dim, noise, rng):
+    identities = rng.normal(size=(people, dim))
+    vectors, labels = [], []
+    for person, identity in enumerate(identities):
+        rows = normalize_rows(identity + noise * rng.normal(size=(templates, dim)))
+        summary = summarize_templates(rows)
+        vectors.append(summary)
+        labels.extend([person] * len(summary))
+    return identities, np.vstack(vectors), labels
+
+
+class Command(BaseCommand):
+    help = "Recall@1 and per-query latency of exact vs IVF identify search against gallery size."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--people", type=int, nargs="+", default=[1000, 10000, 50000])
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--nprobe", type=int, default=settings.IDENTIFY_IVF_NPROBE)
+        parser.add_argument("--noise", type=float, default=0.9, help="Per-dimension noise of templates and probes.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        templates = settings.REGISTRATION_TEMPLATE_COUNT
+
+        self.stdout.write(
+            f"{'people':>8} {'rows':>8} {'index':>6} {'build s':>8} {'recall@1':>9} "
+            f"{'agree w/ exact':>15} {'p50 ms':>8} {'p99 ms':>8}"
+        )
+        for people in options["people"]:
+            identities, vectors, labels = synthetic_company(people, templates, 128, options["noise"], rng)
+            truth = rng.integers(0, people, size=options["queries"])
+            probes = identities[truth] + options["noise"] * rng.normal(size=(options["queries"], 128))
+
+            nlist = int(np.sqrt(len(vectors)) * settings.IDENTIFY_IVF_LISTS_PER_SQRT)
+            exact_top = None
+            for name, nl in (("exact", 0), ("ivf", nlist)):
+                start = time.perf_counter()
+                index = VectorIndex(vectors, labels, nlist=nl, nprobe=options["nprobe"])
+                build = time.perf_counter() - start
+
+                latencies, top = [], []
+                for probe in probes:
+                    start = time.perf_counter()
+                    result = index.search(probe, k=1)
+                    latencies.append(time.perf_counter() - start)
+                    top.append(result[0][0] if result else None)
+
+                top = np.array(top)
+                if exact_top is None:
+                    exact_top = top
+                self.stdout.write(
+                    f"{people:>8} {len(vectors):>8} {name:>6} {build:>8.2f} {np.mean(top == truth):>9.3f} "
+                    f"{np.mean(top == exact_top):>15.3f} {np.percentile(latencies, 50) * 1000:>8.2f} "
+                    f"{np.percentile(latencies, 99) * 1000:>8.2f}"
+                )
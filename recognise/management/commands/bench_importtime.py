@@ -0,0 +1,76 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Importing any of these means some module pulled the ML stack in at import time
+HEAVY_MODULES = ("tensorflow", "keras", "tf_keras", "deepface", "mediapipe", "cv2", "scipy", "torch")
+
+SCENARIOS = {
+    "urls": ["-c", "import django; django.setup(); from django.urls import get_resolver; get_resolver().url_patterns"],
+    "check": ["manage.py", "check"],
+}
+
+
+def parse_importtime(stderr):
+    """Return {module: (self_us, cumulative_us, depth)} from `python -X importtime` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure Django startup with `python -X importtime`: wall time, total import time "
+        "and the slowest top-level imports for loading the URLconf and for manage.py check. "
+        "Fails if the ML stack is imported or the import budget is exceeded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", choices=sorted(SCENARIOS), nargs="+", default=sorted(SCENARIOS))
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--top", type=int, default=10)
+        parser.add_argument("--budget-ms", type=float, default=1000, help="Max median import time per scenario")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, MODEL_WARMUP_ON_START="0")
+        failures = []
+
+        for scenario in options["scenario"]:
+            walls, totals, modules = [], [], {}
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                result = subprocess.run(
+                    [sys.executable, "-X", "importtime", *SCENARIOS[scenario]],
+                    cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+                )
+                walls.append(time.perf_counter() - start)
+                if result.returncode != 0:
+                    raise CommandError(f"{scenario} failed:\n{result.stderr[-2000:]}")
+                modules = parse_importtime(result.stderr)
+                totals.append(sum(c for _, c, depth in modules.values() if depth == 0) / 1000)
+
+            import_ms, wall_ms = statistics.median(totals), statistics.median(walls) * 1000
+            self.stdout.write(f"\n{scenario}: wall {wall_ms:.0f} ms, imports {import_ms:.0f} ms, {len(modules)} modules")
+            top = sorted(((c, name) for name, (_, c, depth) in modules.items() if depth == 0), reverse=True)
+            for cumulative_us, name in top[:options["top"]]:
+                self.stdout.write(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+
+            heavy = sorted({name.split(".")[0] for name in modules} & set(HEAVY_MODULES))
+            if heavy:
+                failures.append(f"{scenario} imports {', '.join(heavy)}")
+            if import_ms > options["budget_ms"]:
+                failures.append(f"{scenario} imports took {import_ms:.0f} ms (budget {options['budget_ms']:.0f} ms)")
+
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("\nStartup within budget, no ML modules imported."))
@@ -0,0 +1,63 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from deepface import DeepFace
+from django.core.management.base import BaseCommand
+
+from recognise import inference
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q)) * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare p50/p99 embedding latency under concurrent load for the old "
+        "lock-serialised DeepFace.represent path and the micro-batching embedder."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=400)
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+        parser.add_argument("--batch-size", type=int, default=16)
+        parser.add_argument("--wait-ms", type=float, default=5)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        faces = [rng.integers(0, 255, size=(160, 160, 3), dtype=np.uint8) for _ in range(32)]
+
+        lock = threading.Lock()
+
+        def locked(face):
+            # Old recognise path; detection skipped so only model cost is compared
+            with lock:
+                return DeepFace.represent(face, model_name=inference.MODEL_NAME, detector_backend="skip")[0]["embedding"]
+
+        embedder = inference.BatchingEmbedder(options["batch_size"], options["wait_ms"])
+
+        # Build the model and trace both call paths before timing
+        locked(faces[0])
+        embedder.embed(faces[0])
+
+        self.stdout.write(f"{'path':>8} {'clients':>8} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+        for concurrency in options["concurrency"]:
+            for name, fn in (("locked", locked), ("batched", embedder.embed)):
+                latencies, elapsed = self._run(fn, faces, options["requests"], concurrency)
+                self.stdout.write(
+                    f"{name:>8} {concurrency:>8} {percentile_ms(latencies, 50):>9.1f} "
+                    f"{percentile_ms(latencies, 99):>9.1f} {len(latencies) / elapsed:>8.1f}"
+                )
+
+    def _run(self, fn, faces, total, concurrency):
+        def one(i):
+            start = time.perf_counter()
+            fn(faces[i % len(faces)])
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(one, range(total)))
+        return latencies, time.perf_counter() - start
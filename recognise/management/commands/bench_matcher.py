@@ -0,0 +1,57 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from scipy.spatial.distance import cosine
+
+from recognise import matcher
+
+
+def legacy_verify(probe, templates):
+    # Per-template loop as verify_employee_identity did before recognise.matcher
+    weighted_sum = 0.0
+    for stored_embedding in templates:
+        distance = cosine(probe, stored_embedding)
+        if distance < settings.MATCH_MAX_DISTANCE:
+            similarity = 1 - distance
+            weighted_sum += similarity ** 2
+    return weighted_sum >= settings.MATCH_VERIFY_THRESHOLD, weighted_sum
+
+
+def time_per_call(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark per-verification latency of the scipy loop vs recognise.matcher."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[15, 150, 1500])
+        parser.add_argument("--dim", type=int, default=128)
+        parser.add_argument("--repeat", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        repeat = options["repeat"]
+
+        self.stdout.write(f"{'templates':>10} {'scipy loop (us)':>16} {'matcher (us)':>14} {'speedup':>8}")
+        for size in options["sizes"]:
+            identity = rng.normal(size=options["dim"])
+            raw = identity + 0.3 * rng.normal(size=(size, options["dim"]))
+            probe = identity + 0.3 * rng.normal(size=options["dim"])
+            templates = matcher.l2_normalize(raw)
+
+            legacy = legacy_verify(probe, raw)
+            vectorised = matcher.verify(probe, templates)
+            if legacy[0] != vectorised[0] or abs(legacy[1] - vectorised[1]) > 1e-3 * max(1.0, legacy[1]):
+                self.stderr.write(f"Mismatch at {size}: legacy={legacy} matcher={vectorised}")
+
+            legacy_us = time_per_call(lambda: legacy_verify(probe, raw), repeat) * 1e6
+            matcher_us = time_per_call(lambda: matcher.verify(probe, templates), repeat) * 1e6
+            self.stdout.write(f"{size:>10} {legacy_us:>16.1f} {matcher_us:>14.1f} {legacy_us / matcher_us:>7.1f}x")
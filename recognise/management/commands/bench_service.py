@@ -0,0 +1,445 @@
+import glob
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+
+from recognise.management.commands.bench_gunicorn import child_pids, multipart, proc_memory_kb
+from recognise import attendance_log
+from register import embedding_store
+
+BENCH_SERVER = "benchsrv"
+FORM_COMPANY = "formbench"
+ENDPOINTS = ("recognise", "check", "form")
+
+# Settings that change what a run measures; recorded with the results
+RECORDED_SETTINGS = (
+    "MATCH_MODE", "INFERENCE_MAX_BATCH_SIZE", "INFERENCE_MAX_WAIT_MS", "RECOGNISE_ASYNC_VIEWS",
+    "REGISTRATION_ASYNC", "RECOGNISE_MAX_DECODE_PIXELS", "PROBE_CACHE_MAX_ENTRIES", "REQUEST_PRINTS",
+)
+
+
+# -------------------- SYNTHETIC TREE --------------------
+def synthetic_tree(servers, companies, people, frames, dim=128, seed=0):
+    """
+    Write servers x companies x people x frames random templates under
+    media/embeddings/benchsrv{s}/company_synthetic{c}/. Each company comes from
+    its own seeded generator, so the same arguments always give the same tree
+    and an existing matching company is reused instead of rewritten.
+    Returns [(server, company, mobiles)].
+    """
+    tree = []
+    for s in range(servers):
+        for c in range(companies):
+            server, company = f"{BENCH_SERVER}{s}", f"synthetic{c}"
+            folder = embedding_store.company_folder(server, company)
+            mobiles = [f"8{s:02d}{c:02d}{p:05d}" for p in range(people)]
+            spec = {"people": people, "frames": frames, "dim": dim, "seed": seed}
+
+            marker = os.path.join(folder, "bench.json")
+            try:
+                with open(marker, encoding="utf-8") as f:
+                    reuse = json.load(f) == spec
+            except (FileNotFoundError, ValueError):
+                reuse = False
+
+            if not reuse:
+                shutil.rmtree(folder, ignore_errors=True)
+                rng = np.random.default_rng([seed, s, c])
+                identities = rng.normal(size=(people, dim))
+                embedding_store.write_people(folder, {
+                    mobile: identity + 0.5 * rng.normal(size=(frames, dim))
+                    for mobile, identity in zip(mobiles, identities)
+                })
+                with open(marker, "w", encoding="utf-8") as f:
+                    json.dump(spec, f)
+            tree.append((server, company, mobiles))
+    return tree
+
+
+def enroll_clips(server, company, clips):
+    """Register each testing clip (mobile = file name) so recognise has someone real to verify."""
+    from register.embeddings_gen import register_from_video
+
+    folder = embedding_store.company_folder(server, company)
+    index = embedding_store.read_index(folder) or {"people": {}}
+    for clip in clips:
+        mobile = os.path.splitext(os.path.basename(clip))[0]
+        if mobile not in index["people"]:
+            register_from_video(clip, server, company, mobile)
+
+
+def probe_frames(clips, per_clip):
+    """(mobile, JPEG bytes) for per_clip frames spread across each clip."""
+    import cv2
+
+    probes = []
+    for clip in clips:
+        mobile = os.path.splitext(os.path.basename(clip))[0]
+        capture = cv2.VideoCapture(clip)
+        total = max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 1)
+        for k in range(per_clip):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, (k + 1) * total // (per_clip + 1))
+            ok, frame = capture.read()
+            if ok:
+                probes.append((mobile, cv2.imencode(".jpg", frame)[1].tobytes()))
+        capture.release()
+    return probes
+
+
+# -------------------- TRANSPORTS --------------------
+# Both transports return (status code, response body bytes)
+class TestClientTransport:
+    """In-process requests through django.test.Client (one client per thread)."""
+
+    name = "test_client"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _client(self):
+        from django.test import Client
+
+        if not hasattr(self._local, "client"):
+            self._local.client = Client()
+        return self._local.client
+
+    def get(self, path, params):
+        response = self._client().get(path, params)
+        return response.status_code, response.content
+
+    def post(self, path, fields, files):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        data = dict(fields)
+        for name, (filename, content) in files.items():
+            data[name] = SimpleUploadedFile(filename, content)
+        response = self._client().post(path, data)
+        return response.status_code, response.content
+
+
+class HttpTransport:
+    """Real HTTP requests against a running server (runserver, gunicorn or uvicorn)."""
+
+    name = "http"
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def _send(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            return 0, b""
+
+    def get(self, path, params):
+        return self._send(f"{self.base_url}{path}?{urllib.parse.urlencode(params)}")
+
+    def post(self, path, fields, files):
+        body, content_type = multipart(fields, files)
+        return self._send(urllib.request.Request(
+            f"{self.base_url}{path}", data=body, headers={"Content-Type": content_type}
+        ))
+
+
+# -------------------- MEASUREMENT --------------------
+def summarize(latencies, codes, seconds):
+    latencies_ms = np.array(latencies) * 1000
+    errors = sum(1 for code in codes if not 200 <= code < 300)
+    by_code = {}
+    for code in codes:
+        by_code[str(code)] = by_code.get(str(code), 0) + 1
+    return {
+        "requests": len(codes),
+        "errors": errors,
+        "codes": by_code,
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(codes) / seconds, 3) if seconds else 0.0,
+        "mean_ms": round(float(latencies_ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+    }
+
+
+def compare(baseline, results, tolerance):
+    """Rows of (endpoint, metric, before, after, change, regressed) for p95 latency and throughput."""
+    rows = []
+    for endpoint, after in results["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        for metric, higher_is_worse in (("p95_ms", True), ("throughput_rps", False)):
+            old, new = before[metric], after[metric]
+            change = (new - old) / old if old else 0.0
+            regressed = change > tolerance if higher_is_worse else change < -tolerance
+            rows.append((endpoint, metric, old, new, change, regressed))
+    return rows
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark /recognise/, /check/ and /form/ against a synthetic embeddings tree "
+        "(servers x companies x people x frames) using the testing/*.mp4 clips, either "
+        "in-process through the Django test client or over HTTP against a running server. "
+        "Reports throughput, p50/p95/p99 and memory, saves JSON, and with --compare fails "
+        "on regressions against an earlier run. In-process runs use a scratch MEDIA_ROOT, "
+        "attendance log directory and test database and register synchronously; over HTTP, "
+        "start the server with MEDIA_ROOT set to --media-root and a scratch DB_NAME, and "
+        "each /form/ request is timed until its registration job finishes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--servers", type=int, default=1)
+        parser.add_argument("--companies", type=int, default=2)
+        parser.add_argument("--people", type=int, default=200)
+        parser.add_argument("--frames", type=int, default=settings.REGISTRATION_TEMPLATE_COUNT)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument("--requests", type=int, default=50, help="Measured requests for recognise and check")
+        parser.add_argument("--form-requests", type=int, default=3, help="Measured requests for form (videos are slow)")
+        parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests per endpoint first")
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--url", help="Drive a running server over HTTP instead of the test client")
+        parser.add_argument("--server-pid", type=int, help="With --url: report memory of this process and its children")
+        parser.add_argument(
+            "--repeat-probes", action="store_true",
+            help="Send identical photo bytes (measures probe cache hits instead of inference)",
+        )
+        parser.add_argument("--output", help="Results JSON (default: media/bench/bench_service_<time>.json)")
+        parser.add_argument("--compare", help="Earlier results JSON; exit non-zero if p95 or throughput regress")
+        parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative change for --compare")
+        parser.add_argument(
+            "--media-root",
+            help="Scratch MEDIA_ROOT for the synthetic tree, kept and reused between runs (default: a "
+                 "temporary directory, removed afterwards). Required with --url: the target server's MEDIA_ROOT.",
+        )
+        parser.add_argument("--cleanup", action="store_true", help="Delete the synthetic tree in --media-root afterwards")
+        parser.add_argument("--job-timeout", type=float, default=600, help="With --url: seconds to wait for a /form/ job")
+
+    def handle(self, *args, **options):
+        clips = sorted(glob.glob(os.path.join(settings.BASE_DIR, "testing", "*.mp4")))
+        if not clips:
+            raise CommandError("No testing/*.mp4 clips to probe and register with")
+        if options["url"] and not options["media_root"]:
+            raise CommandError(
+                "--url needs --media-root: start the target server with MEDIA_ROOT=<that directory> "
+                "and a scratch DB_NAME, since the run writes a synthetic tree and registers people"
+            )
+        output = options["output"] or os.path.join(
+            settings.MEDIA_ROOT, "bench", f"bench_service_{datetime.now():%Y%m%d_%H%M%S}.json"
+        )
+
+        # Never touch the real embeddings, attendance logs or database
+        scratch = options["media_root"] or tempfile.mkdtemp(prefix="bench_service_")
+        overrides = {"MEDIA_ROOT": os.path.abspath(scratch)}
+        if not options["url"]:
+            overrides.update(ATTENDANCE_LOG_DIR=os.path.join(overrides["MEDIA_ROOT"], "logs"), REGISTRATION_ASYNC=False)
+        try:
+            with override_settings(**overrides):
+                if options["url"]:
+                    results = self._run(options, clips)
+                else:
+                    databases = setup_databases(verbosity=0, interactive=False)
+                    try:
+                        results = self._run(options, clips)
+                    finally:
+                        attendance_log.get_writer().flush()
+                        teardown_databases(databases, verbosity=0)
+                if options["cleanup"]:
+                    for s in range(options["servers"]):
+                        shutil.rmtree(os.path.join(embedding_store.embeddings_root(), f"{BENCH_SERVER}{s}"), ignore_errors=True)
+        finally:
+            if not options["media_root"]:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(f"Results: {output}")
+
+        if options["compare"]:
+            self._compare(options["compare"], results, options["tolerance"])
+
+    def _run(self, options, clips):
+        transport = HttpTransport(options["url"]) if options["url"] else TestClientTransport()
+
+        start = time.perf_counter()
+        tree = synthetic_tree(
+            options["servers"], options["companies"], options["people"], options["frames"], seed=options["seed"]
+        )
+        server, company, _ = tree[0]
+        self.stdout.write(
+            f"Synthetic tree: {len(tree)} companies x {options['people']} people x {options['frames']} frames "
+            f"ready in {time.perf_counter() - start:.1f}s"
+        )
+
+        probes = []
+        if "recognise" in options["endpoints"]:
+            start = time.perf_counter()
+            enroll_clips(server, company, clips)
+            probes = probe_frames(clips, per_clip=3)
+            self.stdout.write(f"Enrolled {len(clips)} clips into {server}/{company} in {time.perf_counter() - start:.1f}s")
+
+        memory_before = self._memory(options)
+        requests = {
+            "recognise": (self._recognise_request(transport, probes, server, company, options["repeat_probes"]), options["requests"]),
+            "check": (self._check_request(transport, tree, options["seed"]), options["requests"]),
+            "form": (self._form_request(transport, clips, options["job_timeout"]), options["form_requests"]),
+        }
+
+        results = {
+            "meta": {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "commit": git_commit(),
+                "transport": transport.name,
+                "url": options["url"],
+                "concurrency": options["concurrency"],
+                "cpus": len(os.sched_getaffinity(0)),
+                "repeat_probes": options["repeat_probes"],
+                "database": "target server's" if options["url"] else "test database",
+                "settings": {name: getattr(settings, name, None) for name in RECORDED_SETTINGS},
+            },
+            "tree": {name: options[name] for name in ("servers", "companies", "people", "frames", "seed")},
+            "endpoints": {},
+        }
+
+        self.stdout.write(f"{'endpoint':>10} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for endpoint in options["endpoints"]:
+            make_request, count = requests[endpoint]
+            for i in range(options["warmup"]):
+                make_request(-1 - i)
+            row = self._drive(make_request, count, options["concurrency"])
+            results["endpoints"][endpoint] = row
+            self.stdout.write(
+                f"{endpoint:>10} {row['requests']:>9} {row['errors']:>7} {row['throughput_rps']:>8.2f} "
+                f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}"
+            )
+
+        results["memory"] = {"before_kb": memory_before, "after_kb": self._memory(options)}
+        if results["memory"]["after_kb"]:
+            self.stdout.write(f"Memory after run: {results['memory']['after_kb']}")
+        return results
+
+    # -------------------- REQUEST MAKERS --------------------
+    def _recognise_request(self, transport, probes, server, company, repeat_probes):
+        def make_request(i):
+            mobile, image = probes[i % len(probes)]
+            if not repeat_probes:
+                # Bytes after the JPEG end marker are ignored by the decoder but change the content hash
+                image = image + i.to_bytes(8, "big", signed=True)
+            return transport.post(
+                "/recognise/",
+                {"groundmobiledispreq": mobile, "groundtemauniqueId": company, "serverName": server},
+                {"PaymaaUpload1": ("probe.jpg", image)},
+            )[0]
+        return make_request
+
+    def _check_request(self, transport, tree, seed):
+        rng = np.random.default_rng(seed)
+        picks = rng.integers(0, 1 << 30, size=(4096, 3))
+
+        def make_request(i):
+            a, b, unknown = picks[i % len(picks)]
+            server, company, mobiles = tree[a % len(tree)]
+            # About one lookup in ten is for someone who is not registered
+            mobile = "7000000000" if unknown % 10 == 0 else mobiles[b % len(mobiles)]
+            return transport.get("/check/", {"maidMobile": mobile, "uniqueId": company, "serverName": server})[0]
+        return make_request
+
+    def _form_request(self, transport, clips, job_timeout):
+        videos = {}
+        for clip in clips:
+            with open(clip, "rb") as f:
+                videos[clip] = f.read()
+
+        def make_request(i):
+            clip = clips[i % len(clips)]
+            data = {"data": [{
+                "id": str(abs(i)), "uniqueId": FORM_COMPANY,
+                "maidName": f"Bench {abs(i)}", "maidMobile": f"60000{abs(i):05d}",
+            }]}
+            code, body = transport.post(
+                "/form/",
+                {"data": json.dumps(data), "serverName": f"{BENCH_SERVER}0"},
+                {"maid_video": (os.path.basename(clip), videos[clip])},
+            )
+            if code != 202:
+                return code
+            # Queued (the target server registers asynchronously): time it until the job is done
+            return self._wait_for_job(transport, json.loads(body)["status_url"], job_timeout)
+        return make_request
+
+    def _wait_for_job(self, transport, status_url, timeout):
+        """200 once the registration job succeeded, 500 if it failed, 504 if it is still going after timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            code, body = transport.get(status_url, {})
+            status = json.loads(body).get("status") if code == 200 else None
+            if status == "succeeded":
+                return 200
+            if status == "failed" or code not in (200, 0):
+                return 500
+            time.sleep(0.1)
+        return 504
+
+    # -------------------- HELPERS --------------------
+    def _drive(self, make_request, count, concurrency):
+        latencies, codes = [0.0] * count, [0] * count
+
+        def one(i):
+            start = time.perf_counter()
+            codes[i] = make_request(i)
+            latencies[i] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(count)))
+        return summarize(latencies, codes, time.perf_counter() - start)
+
+    def _memory(self, options):
+        """{"rss": kB, "pss": kB} summed over the server process (and its workers), or this process."""
+        pid = options["server_pid"] if options["url"] else os.getpid()
+        if pid is None:
+            return None
+        pids = [pid] + (child_pids(pid) if options["url"] else [])
+        usage = [proc_memory_kb(p) for p in pids]
+        return {"rss": sum(r for r, _ in usage), "pss": sum(p for _, p in usage)}
+
+    def _compare(self, path, results, tolerance):
+        with open(path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(baseline, results, tolerance)
+        self.stdout.write(f"Compared with {path} (tolerance {tolerance:.0%}):")
+        for endpoint, metric, old, new, change, regressed in rows:
+            flag = "REGRESSION" if regressed else ""
+            self.stdout.write(f"  {endpoint:>10} {metric:>15} {old:>10.2f} -> {new:>10.2f} ({change:+.1%}) {flag}")
+        regressions = [f"{endpoint} {metric}" for endpoint, metric, _, _, _, regressed in rows if regressed]
+        if regressions:
+            raise CommandError(f"Regressed beyond {tolerance:.0%}: {', '.join(regressions)}")
@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recognise import matcher
+from register import embedding_store
+
+
+def leave_one_out_scores(people, impostors, rng):
+    """
+    For every template of every person: score it as a probe against that
+    person's remaining templates (genuine) and against a sample of other
+    people (impostor). Returns {mode: (genuine, impostor)} score arrays.
+    """
+    scores = {mode: ([], []) for mode in matcher.MODES}
+    mobiles = list(people)
+
+    def reference_scores(probe, rows):
+        summary = embedding_store.summarize_templates(rows)
+        weighted_sum, _ = matcher.score(probe, rows)
+        return {
+            # Normalised so one threshold applies whatever the template count
+            matcher.MODE_ALL: weighted_sum * settings.MATCH_REFERENCE_TEMPLATES / len(rows),
+            matcher.MODE_CENTROID: matcher.verify_summary(probe, summary[:1], 0)[1],
+            matcher.MODE_CENTROID_TOPK: matcher.verify_summary(probe, summary, 0)[1],
+        }
+
+    for mobile in mobiles:
+        rows = people[mobile]
+        others = [m for m in mobiles if m != mobile]
+        for i in range(len(rows)):
+            probe = rows[i]
+            for mode, value in reference_scores(probe, np.delete(rows, i, axis=0)).items():
+                scores[mode][0].append(value)
+            for other in rng.choice(others, size=min(impostors, len(others)), replace=False) if others else []:
+                for mode, value in reference_scores(probe, people[other]).items():
+                    scores[mode][1].append(value)
+
+    return {mode: (np.array(g), np.array(i)) for mode, (g, i) in scores.items()}
+
+
+def synthetic_people(count, templates, dim, rng):
+    people = {}
+    for n in range(count):
+        identity = rng.normal(size=dim)
+        people[f"synthetic{n}"] = embedding_store.normalize_rows(identity + 1.1 * rng.normal(size=(templates, dim)))
+    return people
+
+
+class Command(BaseCommand):
+    help = (
+        "Calibrate thresholds for each MATCH_MODE from enrolled templates (leave-one-out "
+        "genuine probes vs other people as impostors) at a target false-accept rate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--server", help="Only use this server's companies.")
+        parser.add_argument("--company", help="Only use this uniqueId (requires --server).")
+        parser.add_argument("--far", type=float, default=0.001, help="Target false-accept rate.")
+        parser.add_argument("--impostors", type=int, default=20, help="Other people sampled per probe.")
+        parser.add_argument("--synthetic", type=int, default=0, help="Use N synthetic people instead of stored ones.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+
+        if options["synthetic"]:
+            people = synthetic_people(options["synthetic"], settings.REGISTRATION_TEMPLATE_COUNT, 128, rng)
+        else:
+            people = self._stored_people(options)
+
+        people = {m: rows for m, rows in people.items() if len(rows) >= 2}
+        if len(people) < 2:
+            self.stderr.write("Need at least two people with two or more templates to calibrate.")
+            return
+
+        results = leave_one_out_scores(people, options["impostors"], rng)
+        mean_templates = np.mean([len(rows) for rows in people.values()])
+        compared = {
+            matcher.MODE_ALL: mean_templates - 1,
+            matcher.MODE_CENTROID: 1,
+            matcher.MODE_CENTROID_TOPK: 1 + settings.MATCH_SUMMARY_TOP_K,
+        }
+
+        self.stdout.write(f"{len(people)} people, target FAR {options['far']}")
+        self.stdout.write(f"{'mode':>14} {'threshold':>10} {'FAR':>8} {'FRR':>8} {'rows/probe':>11}")
+        for mode, (genuine, impostor) in results.items():
+            threshold = float(np.quantile(impostor, 1 - options["far"])) + 1e-6
+            far = float(np.mean(impostor >= threshold))
+            frr = float(np.mean(genuine < threshold))
+            self.stdout.write(f"{mode:>14} {threshold:>10.4f} {far:>8.4f} {frr:>8.4f} {compared[mode]:>11.1f}")
+
+        self.stdout.write(
+            "\nThe \"all\" threshold is per MATCH_REFERENCE_TEMPLATES templates (MATCH_VERIFY_THRESHOLD); "
+            "the others are MATCH_CENTROID_THRESHOLD and MATCH_TOPK_THRESHOLD."
+        )
+
+    def _stored_people(self, options):
+        root = embedding_store.embeddings_root()
+        if options["company"]:
+            folders = [embedding_store.company_folder(options["server"], options["company"])]
+        else:
+            servers = [options["server"].strip().lower()] if options["server"] else sorted(os.listdir(root))
+            folders = [
+                os.path.join(root, server, company)
+                for server in servers if os.path.isdir(os.path.join(root, server))
+                for company in sorted(os.listdir(os.path.join(root, server)))
+            ]
+
+        people = {}
+        for folder in folders:
+            store = embedding_store.open_company(folder)
+            if store is None:
+                continue
+            for mobile in store.mobiles:
+                people[f"{folder}:{mobile}"] = np.asarray(store.templates(mobile))
+        return people
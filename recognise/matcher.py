@@ -0,0 +1,160 @@
+import numpy as np
+from django.conf import settings
+
+from register.embedding_store import stack_rows
+
+
+# -------------------- NORMALISATION --------------------
+def l2_normalize(vectors):
+    """L2-normalise a vector or each row of a matrix (float32, zero rows left as zero)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# -------------------- SCORING --------------------
+def score(probe, templates, max_distance=None):
+    """
+    Score a probe embedding against a user's L2-normalised templates.
+
+    Returns (weighted_sum, distances). Only templates with cosine distance
+    below max_distance contribute, each adding similarity ** 2.
+    """
+    if max_distance is None:
+        max_distance = settings.MATCH_MAX_DISTANCE
+
+    if len(templates) == 0:
+        return 0.0, np.zeros(0, dtype=np.float32)
+
+    similarities = templates @ l2_normalize(probe)
+    distances = 1.0 - similarities
+    close = distances < max_distance
+    weighted_sum = float(np.dot(similarities[close], similarities[close]))
+    return weighted_sum, distances
+
+
+def required_sum(template_count, threshold=None):
+    """
+    Weighted-sum threshold for a user with template_count templates. The
+    configured threshold is for MATCH_REFERENCE_TEMPLATES (the old fixed 15
+    frames) and scales linearly, so registrations that keep fewer templates
+    are held to the same average similarity.
+    """
+    if threshold is None:
+        threshold = settings.MATCH_VERIFY_THRESHOLD
+    return threshold * template_count / settings.MATCH_REFERENCE_TEMPLATES
+
+
+def verify(probe, templates, max_distance=None, threshold=None):
+    """Return (verified, weighted_sum) for a probe against a user's templates."""
+    if len(templates) == 0:
+        # required_sum(0) is 0, which any probe would reach
+        return False, 0.0
+    weighted_sum, _ = score(probe, templates, max_distance)
+    return weighted_sum >= required_sum(len(templates), threshold), weighted_sum
+
+
+# -------------------- AGGREGATION MODES --------------------
+MODE_ALL = "all"
+MODE_CENTROID = "centroid"
+MODE_CENTROID_TOPK = "centroid_topk"
+MODES = (MODE_ALL, MODE_CENTROID, MODE_CENTROID_TOPK)
+
+
+def mode_threshold(mode):
+    return {
+        MODE_ALL: settings.MATCH_VERIFY_THRESHOLD,
+        MODE_CENTROID: settings.MATCH_CENTROID_THRESHOLD,
+        MODE_CENTROID_TOPK: settings.MATCH_TOPK_THRESHOLD,
+    }[mode]
+
+
+def verify_summary(probe, summary, threshold):
+    """Verify against a centroid (+ outlier) summary: best cosine similarity must reach threshold."""
+    if len(summary) == 0:
+        return False, 0.0
+    best = float(np.max(summary @ l2_normalize(probe)))
+    return best >= threshold, best
+
+
+def verify_user(probe, store, mobile, mode=None, threshold=None):
+    """
+    Verify a probe against one person in a CompanyStore using the configured
+    aggregation mode. Returns (verified, score): the weighted sum for "all",
+    the best summary similarity otherwise.
+    """
+    if mode is None:
+        mode = settings.MATCH_MODE
+    if mode not in MODES:
+        raise ValueError(f"Unknown match mode {mode!r}, expected one of {MODES}")
+
+    if mode == MODE_ALL:
+        return verify(probe, store.templates(mobile), threshold=threshold)
+
+    if threshold is None:
+        threshold = mode_threshold(mode)
+    summary = store.summary(mobile)
+    if mode == MODE_CENTROID:
+        summary = summary[:1]
+    return verify_summary(probe, summary, threshold)
+
+
+# -------------------- MANY PROBES x MANY PEOPLE --------------------
+def verify_many(probes, store, mobiles, mode=None, threshold=None):
+    """
+    Verify every probe against every claimed person of a CompanyStore with
+    one matrix product over all their rows, using the same rules as
+    verify_user. Returns (verified, scores), both (len(mobiles), len(probes));
+    people without templates score 0 and are not verified.
+    """
+    if mode is None:
+        mode = settings.MATCH_MODE
+    if mode not in MODES:
+        raise ValueError(f"Unknown match mode {mode!r}, expected one of {MODES}")
+
+    probes = l2_normalize(np.atleast_2d(probes))
+    verified = np.zeros((len(mobiles), len(probes)), dtype=bool)
+    scores = np.zeros((len(mobiles), len(probes)), dtype=np.float32)
+
+    blocks = []
+    for mobile in mobiles:
+        rows = store.templates(mobile) if mode == MODE_ALL else store.summary(mobile)
+        blocks.append(rows[:1] if mode == MODE_CENTROID else rows)
+    counts = np.array([len(rows) for rows in blocks])
+    present = counts > 0
+    if not present.any() or len(probes) == 0:
+        return verified, scores
+
+    similarities = np.asarray(stack_rows([rows for rows in blocks if len(rows)]) @ probes.T)
+    starts = np.concatenate([[0], np.cumsum(counts[present])[:-1]])
+
+    if mode == MODE_ALL:
+        max_distance = settings.MATCH_MAX_DISTANCE
+        close = (1.0 - similarities) < max_distance
+        sums = np.add.reduceat(np.where(close, similarities * similarities, 0.0), starts, axis=0)
+        scores[present] = sums
+        verified[present] = sums >= required_sum(counts[present], threshold)[:, None]
+    else:
+        if threshold is None:
+            threshold = mode_threshold(mode)
+        best = np.maximum.reduceat(similarities, starts, axis=0)
+        scores[present] = best
+        verified[present] = best >= threshold
+    return verified, scores
+
+
+def assign_faces(verified, scores):
+    """
+    Pair claimed people (rows) with probe faces (columns) so each face
+    answers for at most one person: verified pairs first, then by score.
+    Returns {person index: face index} for every person who gets a face.
+    """
+    order = sorted(np.ndindex(scores.shape), key=lambda pair: (verified[pair], scores[pair]), reverse=True)
+    assigned, used_faces = {}, set()
+    for person, face in order:
+        if person in assigned or face in used_faces:
+            continue
+        assigned[person] = face
+        used_faces.add(face)
+    return assigned
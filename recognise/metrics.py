@@ -0,0 +1,199 @@
+"""
+In-process latency histograms and counters, rendered in the Prometheus text
+format on /metrics, plus one structured (JSON) log line per request on the
+"facerecog.requests" logger.
+
+Every process keeps its own numbers: behind gunicorn a scrape of /metrics
+sees whichever worker answered it, so scrape often or sum per worker (the
+pid label tells them apart).
+
+    with metrics.stage("decode", timings):       # histogram + timings["decode_ms"]
+        ...
+    with metrics.timed_lock(self._write_lock, "attendance_write_lock"):
+        ...
+    path("recognise/", metrics.instrumented("recognise", view))
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+request_logger = logging.getLogger("facerecog.requests")
+
+# Seconds; spans a cache hit (~1 ms) to a cold model build
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# -------------------- METRIC TYPES --------------------
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _labels(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, key, value
+
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", key + (("le", repr(bound)),), cumulative
+            yield f"{self.name}_bucket", key + (("le", "+Inf"),), count
+            yield f"{self.name}_sum", key, total
+            yield f"{self.name}_count", key, count
+
+
+REQUESTS = Counter("facerecog_requests_total", "Requests served, by endpoint and HTTP status", ("endpoint", "code"))
+REQUEST_SECONDS = Histogram("facerecog_request_seconds", "Whole-request latency", ("endpoint",))
+STAGE_SECONDS = Histogram("facerecog_stage_seconds", "Time spent in each pipeline stage", ("stage",))
+LOCK_WAIT_SECONDS = Histogram(
+    "facerecog_lock_wait_seconds", "Time spent waiting to acquire a shared lock or queue slot", ("lock",)
+)
+BATCH_SIZE = Histogram(
+    "facerecog_embed_batch_size", "Faces per Facenet forward pass in the micro-batcher", (),
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+METRICS = [REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, LOCK_WAIT_SECONDS, BATCH_SIZE]
+
+
+# -------------------- RECORDING --------------------
+@contextmanager
+def stage(name, timings=None):
+    """Time a block into facerecog_stage_seconds, and into timings[f"{name}_ms"] if a dict is given."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if timings is not None:
+            timings[f"{name}_ms"] = round(elapsed * 1000, 1)
+
+
+@contextmanager
+def timed_lock(lock, name):
+    """Acquire lock, recording how long the acquire blocked."""
+    start = time.perf_counter()
+    with lock:
+        LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, lock=name)
+        yield
+
+
+def trace(*args, **kwargs):
+    """print() for per-request chatter; silenced with REQUEST_PRINTS=0 (errors still use print)."""
+    if settings.REQUEST_PRINTS:
+        print(*args, **kwargs)
+
+
+def log_event(event, **fields):
+    if request_logger.isEnabledFor(logging.INFO):
+        request_logger.info(json.dumps({"event": event, **fields}, default=str, separators=(",", ":")))
+
+
+# -------------------- VIEW WRAPPER --------------------
+def _finish(endpoint, request, response, start):
+    elapsed = time.perf_counter() - start
+    code = response.status_code if response is not None else 500
+    REQUESTS.inc(endpoint=endpoint, code=code)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    log_event(
+        "request", endpoint=endpoint, method=request.method, code=code, ms=round(elapsed * 1000, 1),
+        **getattr(response, "log_fields", {}),
+    )
+
+
+def instrumented(endpoint, view):
+    """
+    Wrap a URLconf view (sync or async) to count it, time it and log one line
+    per request. Views can add fields to that line via response.log_fields.
+    """
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            start, response = time.perf_counter(), None
+            try:
+                response = await view(request, *args, **kwargs)
+                return response
+            finally:
+                _finish(endpoint, request, response, start)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            start, response = time.perf_counter(), None
+            try:
+                response = view(request, *args, **kwargs)
+                return response
+            finally:
+                _finish(endpoint, request, response, start)
+    return wrapper
+
+
+# -------------------- EXPOSITION --------------------
+def _format_labels(names, key):
+    pairs = list(zip(names, key[:len(names)])) + list(key[len(names):])
+    pairs.append(("pid", os.getpid()))
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in pairs) + "}"
+
+
+def render(extra=()):
+    """
+    Prometheus text exposition of every metric, plus (name, help, value) gauges
+    from extra; a fourth item of "counter" exports a running total instead.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(metric.labelnames, key)} {value}")
+    for name, help_text, value, *kind in extra:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind[0] if kind else 'gauge'}")
+        lines.append(f"{name}{_format_labels((), ())} {value}")
+    return "\n".join(lines) + "\n"
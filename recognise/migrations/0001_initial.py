@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="AttendanceLog",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("timestamp", models.DateTimeField(db_index=True)),
+                ("maid_name", models.CharField(blank=True, max_length=255)),
+                ("maid_mobile", models.CharField(db_index=True, max_length=32)),
+                ("unique_id", models.CharField(db_index=True, max_length=64)),
+                ("verified", models.BooleanField()),
+                ("weighted_sum", models.FloatField()),
+                ("mask_status", models.CharField(blank=True, max_length=32)),
+                ("temperature", models.CharField(blank=True, max_length=32)),
+                ("shift_details", models.CharField(blank=True, max_length=255)),
+                ("latitude", models.CharField(blank=True, max_length=32)),
+                ("longitude", models.CharField(blank=True, max_length=32)),
+                ("device_name", models.CharField(blank=True, max_length=255)),
+                ("device_brand", models.CharField(blank=True, max_length=255)),
+                ("system_name", models.CharField(blank=True, max_length=255)),
+                ("ip_address", models.CharField(blank=True, max_length=64)),
+                ("server_name", models.CharField(blank=True, max_length=255)),
+            ],
+        ),
+    ]
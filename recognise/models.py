@@ -1,3 +1,40 @@
 from django.db import models
 
 # Create your models here.
+
+
+class AttendanceLog(models.Model):
+    """Database copy of the attendance CSV rows (written only when ATTENDANCE_LOG_DB is on)."""
+
+    timestamp = models.DateTimeField(db_index=True)
+    maid_name = models.CharField(max_length=255, blank=True)
+    maid_mobile = models.CharField(max_length=32, db_index=True)
+    unique_id = models.CharField(max_length=64, db_index=True)
+    verified = models.BooleanField()
+    weighted_sum = models.FloatField()
+    mask_status = models.CharField(max_length=32, blank=True)
+    temperature = models.CharField(max_length=32, blank=True)
+    shift_details = models.CharField(max_length=255, blank=True)
+    latitude = models.CharField(max_length=32, blank=True)
+    longitude = models.CharField(max_length=32, blank=True)
+    device_name = models.CharField(max_length=255, blank=True)
+    device_brand = models.CharField(max_length=255, blank=True)
+    system_name = models.CharField(max_length=255, blank=True)
+    ip_address = models.CharField(max_length=64, blank=True)
+    server_name = models.CharField(max_length=255, blank=True)
+
+    @classmethod
+    def from_row(cls, row):
+        from .attendance_log import FIELDNAMES, parse_timestamp
+
+        values = {name: row.get(name, "N/A") for name in FIELDNAMES}
+        values["timestamp"] = parse_timestamp(values["timestamp"])
+        values["verified"] = str(values["verified"]).lower() == "true"
+        try:
+            values["weighted_sum"] = float(values["weighted_sum"])
+        except (TypeError, ValueError):
+            values["weighted_sum"] = 0.0
+        for name in FIELDNAMES:
+            if isinstance(values[name], str):
+                values[name] = values[name][:cls._meta.get_field(name).max_length or None]
+        return cls(**values)
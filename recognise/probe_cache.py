@@ -0,0 +1,96 @@
+"""
+Cache for repeated recognise uploads. Mobile clients retry on flaky networks
+with the exact same JPEG, so the probe embedding (or the fact that no face was
+found) is kept per content hash and model, and the verification outcome per
+(probe, server, company, mobile).
+
+Verification entries are also keyed on the company store version and match
+mode, so they stop matching as soon as anyone in that company is re-registered
+(the gallery picks up the new version) or the matching settings change.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .inference import MODEL_NAME
+
+# Returned by TTLCache.get for absent keys, since None is a valid cached embedding
+MISS = object()
+
+
+def probe_key(data):
+    """Fast content hash of the uploaded bytes plus the model that embeds them."""
+    return f"{MODEL_NAME}:{hashlib.blake2b(data, digest_size=16).hexdigest()}"
+
+
+# -------------------- LRU + TTL --------------------
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire ttl_seconds after being stored."""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISS):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, MISS)
+            if entry is not MISS and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not MISS:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# probe_key -> L2 embedding, or None when the photo has no usable face
+embeddings = TTLCache(settings.PROBE_CACHE_MAX_ENTRIES, settings.PROBE_CACHE_TTL_SECONDS)
+
+# (probe_key, server, company, mobile, store version, match mode) -> (verified, score)
+verifications = TTLCache(
+    settings.PROBE_CACHE_MAX_ENTRIES if settings.PROBE_CACHE_VERIFICATIONS else 0,
+    settings.PROBE_CACHE_TTL_SECONDS,
+)
+
+
+def verification_key(key, server_name, uniqueId, mobile, company):
+    return (key, str(server_name).strip().lower(), str(uniqueId), str(mobile), company.version, settings.MATCH_MODE)
+
+
+def stats():
+    return {"embeddings": embeddings.stats(), "verifications": verifications.stats()}
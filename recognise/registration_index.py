@@ -0,0 +1,87 @@
+"""
+Who is registered where, for check/. Keeps (server, company) -> frozenset of
+mobiles read from index.json (or the legacy file names), never the matrices,
+so checking a mobile is a set lookup however large the company is.
+
+A "registered" answer is trusted until the company is revalidated against
+disk (like the gallery); a "not registered" answer (or a missing company) is
+only trusted for REGISTRATION_INDEX_NEGATIVE_TTL_SECONDS, so a person
+registered by another worker shows up within seconds.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from register.embedding_store import company_folder, registered_mobiles, store_version
+
+
+class RegistrationIndex:
+
+    def __init__(self, revalidate_seconds, negative_ttl_seconds):
+        self.revalidate_seconds = revalidate_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        # key -> [version or None, mobiles, checked_at]
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(server_name, uniqueId):
+        return str(server_name).strip().lower(), str(uniqueId)
+
+    def _load(self, key):
+        loaded = registered_mobiles(company_folder(*key))
+        entry = [None, frozenset(), time.monotonic()] if loaded is None else [loaded[0], loaded[1], time.monotonic()]
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def _entry(self, key, max_age):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return self._load(key)
+        if time.monotonic() - entry[2] < max_age:
+            return entry
+
+        try:
+            current = store_version(company_folder(*key))
+        except FileNotFoundError:
+            current = None
+        if current != entry[0]:
+            return self._load(key)
+        entry[2] = time.monotonic()
+        return entry
+
+    def lookup(self, server_name, uniqueId, mobiles):
+        """{mobile: registered} for a list of mobiles in one company."""
+        key = self._key(server_name, uniqueId)
+        entry = self._entry(key, self.revalidate_seconds)
+        result = {str(m): str(m) in entry[1] for m in mobiles}
+        if not all(result.values()):
+            # Negatives may be a registration another process has just written
+            entry = self._entry(key, self.negative_ttl_seconds)
+            result = {m: m in entry[1] for m in result}
+        return result
+
+    def is_registered(self, server_name, uniqueId, mobile):
+        return self.lookup(server_name, uniqueId, [mobile])[str(mobile)]
+
+    def add(self, server_name, uniqueId, mobile):
+        """Record a registration made by this process without waiting for revalidation."""
+        key = self._key(server_name, uniqueId)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # The old version makes the next revalidation re-read the folder anyway
+                self._entries[key] = [entry[0], entry[1] | {str(mobile)}, entry[2]]
+
+    def invalidate(self, server_name, uniqueId):
+        with self._lock:
+            self._entries.pop(self._key(server_name, uniqueId), None)
+
+
+registrations = RegistrationIndex(
+    revalidate_seconds=settings.EMBEDDING_GALLERY_REVALIDATE_SECONDS,
+    negative_ttl_seconds=settings.REGISTRATION_INDEX_NEGATIVE_TTL_SECONDS,
+)
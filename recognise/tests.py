@@ -1,3 +1,441 @@
-from django.test import TestCase
+import csv
+import glob
+import os
+import shutil
+import struct
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from scipy.spatial.distance import cosine
+
+from recognise import ann_index, attendance_log, inference, matcher, probe_cache
+from recognise.gallery import gallery
+from recognise.views import identify_employee, verify_employee_identity
+from register import embedding_store
+from register.embeddings_gen import save_user_embeddings
+
+
+def legacy_verify(probe, templates):
+    """The per-template scipy loop verify_employee_identity ran before recognise.matcher."""
+    weighted_sum = 0.0
+    for stored_embedding in templates:
+        distance = cosine(probe, stored_embedding)
+        if distance < settings.MATCH_MAX_DISTANCE:
+            similarity = 1 - distance
+            weighted_sum += similarity ** 2
+    return weighted_sum >= settings.MATCH_VERIFY_THRESHOLD, weighted_sum
+
+
+# -------------------- MATCHER --------------------
+class MatcherParityTests(SimpleTestCase):
+    """recognise.matcher gives the answers of the scipy loop it replaced."""
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def sample(self, size, noise):
+        identity = self.rng.normal(size=128)
+        raw = identity + noise * self.rng.normal(size=(size, 128))
+        probe = identity + noise * self.rng.normal(size=128)
+        return probe, raw
+
+    def test_score_matches_scipy_cosine(self):
+        probe, raw = self.sample(20, 0.8)
+        _, distances = matcher.score(probe, matcher.l2_normalize(raw))
+        expected = [cosine(probe, row) for row in raw]
+        np.testing.assert_allclose(distances, expected, atol=1e-5)
+
+    def test_verify_matches_legacy_loop(self):
+        for size in (1, 5, settings.MATCH_REFERENCE_TEMPLATES, 150):
+            for noise in (0.2, 0.6, 1.0, 3.0):
+                probe, raw = self.sample(size, noise)
+                legacy_verified, legacy_sum = legacy_verify(probe, raw)
+                verified, weighted_sum = matcher.verify(probe, matcher.l2_normalize(raw))
+                with self.subTest(size=size, noise=noise):
+                    self.assertAlmostEqual(weighted_sum, legacy_sum, delta=1e-4 * max(1.0, legacy_sum))
+                    # The threshold is for MATCH_REFERENCE_TEMPLATES templates and scales with the count
+                    if size == settings.MATCH_REFERENCE_TEMPLATES:
+                        self.assertEqual(verified, legacy_verified)
+                    else:
+                        self.assertEqual(verified, weighted_sum >= matcher.required_sum(size))
+
+    def test_no_templates(self):
+        self.assertEqual(matcher.verify(self.rng.normal(size=128), np.zeros((0, 128), dtype=np.float32)), (False, 0.0))
+
+
+class VerifyManyTests(SimpleTestCase):
+    """verify_many (batch verify) agrees with verify_user for every mode and store precision."""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.rng = np.random.default_rng(1)
+        self.identities = {f"9{n:09d}": self.rng.normal(size=128) for n in range(6)}
+
+    def store(self, precision):
+        folder = embedding_store.company_folder("server", f"verify_many_{precision}")
+        with override_settings(MEDIA_ROOT=self.media, EMBEDDING_STORE_PRECISION=precision):
+            embedding_store.write_people(folder, {
+                mobile: identity + 0.4 * self.rng.normal(size=(settings.MATCH_REFERENCE_TEMPLATES, 128))
+                for mobile, identity in self.identities.items()
+            })
+            return embedding_store.open_company(folder)
+
+    def test_verify_many_matches_verify_user(self):
+        probes = np.vstack(
+            [identity + 0.4 * self.rng.normal(size=128) for identity in self.identities.values()]
+            + [self.rng.normal(size=(3, 128))]
+        )
+        mobiles = list(self.identities)[::-1] + ["not registered"]
+        for precision in embedding_store.PRECISIONS:
+            store = self.store(precision)
+            for mode in matcher.MODES:
+                verified, scores = matcher.verify_many(probes, store, mobiles, mode=mode)
+                self.assertEqual(verified.shape, (len(mobiles), len(probes)))
+                for person, mobile in enumerate(mobiles):
+                    for face, probe in enumerate(probes):
+                        expected_verified, expected_score = matcher.verify_user(probe, store, mobile, mode=mode)
+                        with self.subTest(precision=precision, mode=mode, mobile=mobile, face=face):
+                            self.assertAlmostEqual(float(scores[person, face]), expected_score, delta=1e-4)
+                            self.assertEqual(bool(verified[person, face]), expected_verified)
+                # Each genuine probe is verified against its own person and nobody else
+                self.assertEqual(int(verified.sum()), len(self.identities), (precision, mode))
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            matcher.verify_many(np.zeros((1, 128)), self.store("float32"), ["x"], mode="nearest")
+
+
+# -------------------- IDENTIFY INDEX --------------------
+class SummaryStore:
+    """Just what build_index reads from a CompanyStore."""
+
+    def __init__(self, summaries):
+        self.summaries = summaries
+        self.mobiles = list(summaries)
+
+    def summary(self, mobile):
+        return self.summaries[mobile]
+
+
+class IdentifyIndexTests(SimpleTestCase):
+    """The IVF index finds what an exact scan does; registrations patch cached indexes in place."""
+
+    def setUp(self):
+        self.rng = np.random.default_rng(3)
+
+    def test_ivf_recall_matches_exact_scan(self):
+        # Faces are not spread uniformly: identities come in loose groups of similar people
+        people, rows = settings.IDENTIFY_IVF_MIN_ROWS // 3 + 1000, 3
+        groups = self.rng.normal(size=(200, 128))
+        identities = groups[self.rng.integers(0, len(groups), people)] + 0.8 * self.rng.normal(size=(people, 128))
+        store = SummaryStore({
+            f"9{n:09d}": matcher.l2_normalize(identity + 0.3 * self.rng.normal(size=(rows, 128)))
+            for n, identity in enumerate(identities)
+        })
+
+        ivf = ann_index.build_index(store)
+        self.assertTrue(ivf.is_ivf)
+        self.assertGreater(len(ivf), settings.IDENTIFY_IVF_MIN_ROWS)
+        exact = ann_index.VectorIndex(ivf.vectors, ivf.labels)
+        self.assertFalse(exact.is_ivf)
+
+        top1, recall = 0, 0.0
+        probes = identities[self.rng.choice(people, 200, replace=False)] + 0.3 * self.rng.normal(size=(200, 128))
+        for probe in probes:
+            found = [label for label, _ in ivf.search(probe, 5)]
+            expected = [label for label, _ in exact.search(probe, 5)]
+            top1 += found[0] == expected[0]
+            recall += len(set(found) & set(expected)) / len(expected)
+        self.assertGreaterEqual(top1 / len(probes), 0.98)
+        self.assertGreaterEqual(recall / len(probes), 0.95)
+
+    def test_small_companies_are_scanned_exactly(self):
+        store = SummaryStore({"1": matcher.l2_normalize(self.rng.normal(size=(3, 128)))})
+        self.assertFalse(ann_index.build_index(store).is_ivf)
+
+    def test_remove_and_add_on_ivf(self):
+        vectors = matcher.l2_normalize(self.rng.normal(size=(2000, 128)))
+        index = ann_index.VectorIndex(vectors, [str(n // 4) for n in range(2000)], nlist=40, nprobe=40)
+        self.assertEqual(index.search(vectors[8], 1)[0][0], "2")
+        index.remove("2")
+        self.assertNotIn("2", dict(index.search(vectors[8], 5)))
+        index.add("2", vectors[8])
+        self.assertEqual(index.search(vectors[8], 1), [("2", 1.0)])
+        self.assertEqual(len(index), 1997)
+
+    def test_reregistration_patches_cached_indexes(self):
+        server, company = "identify_tests", "7"
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media, EMBEDDING_STORE_PRECISION="float32")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(gallery.invalidate, server, company)
+        self.addCleanup(ann_index.indexes.invalidate, server, company)
+
+        identities = {f"9{n:09d}": self.rng.normal(size=128) for n in range(6)}
+        embedding_store.write_people(embedding_store.company_folder(server, company), {
+            mobile: identity + 0.3 * self.rng.normal(size=(5, 128)) for mobile, identity in identities.items()
+        })
+        mobile = next(iter(identities))
+        old_probe = identities[mobile] + 0.3 * self.rng.normal(size=128)
+        self.assertEqual(identify_employee(old_probe, server, company)[0]["mobile"], mobile)
+        self.assertEqual(identify_employee(old_probe, server)[0], identify_employee(old_probe, server, company)[0])
+        company_index = ann_index.indexes.get(server, company)
+        server_index = ann_index.indexes.get_server(server)
+
+        # The same person re-registers with a new video
+        new_identity = self.rng.normal(size=128)
+        save_user_embeddings(server, company, mobile, new_identity + 0.3 * self.rng.normal(size=(5, 128)))
+        new_probe = new_identity + 0.3 * self.rng.normal(size=128)
+
+        for results in (identify_employee(new_probe, server, company), identify_employee(new_probe, server)):
+            self.assertEqual((results[0]["uniqueId"], results[0]["mobile"]), (company, mobile))
+            self.assertGreater(results[0]["similarity"], 0.8)
+        for results in (identify_employee(old_probe, server, company), identify_employee(old_probe, server)):
+            stale = [r["similarity"] for r in results if r["mobile"] == mobile]
+            self.assertLess(max(stale, default=0.0), 0.5)
+
+        # Patched in place, and still current for the new store version, so nothing was rebuilt
+        self.assertIs(ann_index.indexes.get(server, company), company_index)
+        self.assertIs(ann_index.indexes.get_server(server), server_index)
+
+
+# -------------------- PROBE CACHE --------------------
+class ProbeCacheTests(SimpleTestCase):
+    """TTL and LRU behaviour of the probe caches, and verdicts that follow re-registration."""
+
+    def test_entries_expire(self):
+        cache = probe_cache.TTLCache(max_entries=10, ttl_seconds=60)
+        with mock.patch("recognise.probe_cache.time.monotonic", return_value=1000.0) as now:
+            cache.put("a", None)  # a photo without a face is cached too
+            now.return_value = 1059.0
+            self.assertIsNone(cache.get("a"))
+            now.return_value = 1060.0
+            self.assertIs(cache.get("a"), probe_cache.MISS)
+        self.assertEqual(cache.get("a", "default"), "default")
+        self.assertEqual(cache.stats(), {"entries": 0, "hits": 1, "misses": 2, "evictions": 0, "hit_rate": 0.3333})
+
+    def test_least_recently_used_is_evicted(self):
+        cache = probe_cache.TTLCache(max_entries=2, ttl_seconds=60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)  # now b is the oldest
+        cache.put("c", 3)
+        self.assertIs(cache.get("b"), probe_cache.MISS)
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        disabled = probe_cache.TTLCache(max_entries=0, ttl_seconds=60)
+        disabled.put("a", 1)
+        self.assertIs(disabled.get("a"), probe_cache.MISS)
+
+    def test_verification_key(self):
+        company = mock.Mock(version=1)
+        key = probe_cache.verification_key("probe", " Server ", 7, "9000000001", company)
+        self.assertEqual(key, probe_cache.verification_key("probe", "server", "7", "9000000001", company))
+        self.assertNotEqual(key, probe_cache.verification_key("probe", "server", "7", "9000000001", mock.Mock(version=2)))
+        for mode in set(matcher.MODES) - {settings.MATCH_MODE}:
+            with override_settings(MATCH_MODE=mode):
+                self.assertNotEqual(key, probe_cache.verification_key("probe", "server", "7", "9000000001", company))
+
+    def test_reregistration_is_not_served_a_cached_verdict(self):
+        server, company, mobile = "probe_cache_tests", "7", "9000000001"
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media, EMBEDDING_STORE_PRECISION="float32", REQUEST_PRINTS=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(gallery.invalidate, server, company)
+        self.addCleanup(ann_index.indexes.invalidate, server, company)
+        self.addCleanup(probe_cache.verifications.clear)
+
+        rng = np.random.default_rng(4)
+        identity = rng.normal(size=128)
+        folder = embedding_store.company_folder(server, company)
+        embedding_store.write_person(folder, mobile, identity + 0.3 * rng.normal(size=(5, 128)))
+        probe = identity + 0.3 * rng.normal(size=128)
+        key = probe_cache.probe_key(b"the same upload")
+
+        verdict = verify_employee_identity(mobile, company, probe, server, probe_key=key)
+        self.assertTrue(verdict[0])
+        hits = probe_cache.verifications.hits
+        self.assertEqual(verify_employee_identity(mobile, company, probe, server, probe_key=key), verdict)
+        self.assertEqual(probe_cache.verifications.hits, hits + 1)
+
+        # Someone else re-registers under this mobile: the store version changes and the old verdict is not reused
+        version = embedding_store.store_version(folder)
+        save_user_embeddings(server, company, mobile, rng.normal(size=(5, 128)))
+        self.assertNotEqual(embedding_store.store_version(folder), version)
+        verified, _ = verify_employee_identity(mobile, company, probe, server, probe_key=key)
+        self.assertFalse(verified)
+        self.assertEqual(probe_cache.verifications.hits, hits + 1)
+
+
+# -------------------- IMAGE HEADERS --------------------
+def segment(marker, payload):
+    return bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+class ImageHeaderTests(SimpleTestCase):
+    """image_size reads dimensions from JPEG/PNG headers; decode_image uses them to decode small."""
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        self.image = rng.integers(0, 255, size=(300, 400, 3), dtype=np.uint8)
+
+    def jpeg(self, *params):
+        return cv2.imencode(".jpg", self.image, list(params))[1].tobytes()
+
+    def test_baseline_jpeg(self):
+        self.assertEqual(inference.image_size(self.jpeg()), (400, 300))
+
+    def test_progressive_jpeg(self):
+        data = self.jpeg(cv2.IMWRITE_JPEG_PROGRESSIVE, 1)
+        self.assertIn(b"\xff\xc2", data)
+        self.assertEqual(inference.image_size(data), (400, 300))
+
+    def test_exif_and_other_segments_before_the_frame_header(self):
+        data = self.jpeg()
+        # An EXIF APP1 whose payload contains SOF-looking bytes, a DHT (0xC4 is not a frame
+        # header) and fill bytes, all before the real SOF
+        exif = segment(0xE1, b"Exif\x00\x00" + b"\xff\xc0\x00\x11\x08\x00\x10\x00\x10" + bytes(2000))
+        dht = segment(0xC4, bytes(20))
+        self.assertEqual(inference.image_size(data[:2] + exif + dht + b"\xff\xff" + data[2:]), (400, 300))
+        # (the empty DHT would not decode; the EXIF one does)
+        self.assertEqual(inference.decode_image(data[:2] + exif + data[2:]).shape, (300, 400, 3))
+
+    def test_png(self):
+        data = cv2.imencode(".png", self.image)[1].tobytes()
+        self.assertEqual(inference.image_size(data), (400, 300))
+
+    def test_truncated(self):
+        data = self.jpeg()
+        sof = data.index(b"\xff\xc0")
+        for cut in (1, 2, 20, sof, sof + 6):
+            with self.subTest(cut=cut):
+                self.assertIsNone(inference.image_size(data[:cut]))
+        self.assertIsNone(inference.image_size(cv2.imencode(".png", self.image)[1].tobytes()[:20]))
+        self.assertIsNone(inference.decode_image(data[:sof]))
+
+    def test_not_an_image(self):
+        for data in (b"", b"hello world", b"GIF89a" + bytes(40), b"\xff\xd8" + b"not markers" * 4):
+            with self.subTest(data=data[:12]):
+                self.assertIsNone(inference.image_size(data))
+        self.assertIsNone(inference.decode_image(b"hello world"))
+
+    def test_reduction_factor(self):
+        self.assertEqual(inference.reduction_factor(1000, 1000, 1_000_000), 1)
+        self.assertEqual(inference.reduction_factor(2000, 2000, 1_000_000), 2)
+        self.assertEqual(inference.reduction_factor(4000, 3000, 1_000_000), 4)
+        self.assertEqual(inference.reduction_factor(20000, 20000, 1_000_000), 8)
+
+    def test_decode_respects_pixel_budgets(self):
+        data = self.jpeg()
+        with override_settings(RECOGNISE_MAX_DECODE_PIXELS=100 * 75):
+            self.assertEqual(inference.decode_image(data).shape, (75, 100, 3))  # decoded at 1/4
+        with override_settings(RECOGNISE_MAX_DECODE_PIXELS=5000):
+            self.assertLessEqual(np.prod(inference.decode_image(data).shape[:2]), 5000)  # then resized
+        with override_settings(RECOGNISE_MAX_INPUT_PIXELS=400 * 300 - 1, REQUEST_PRINTS=False):
+            self.assertIsNone(inference.decode_image(data))
+
+
+# -------------------- ATTENDANCE LOG --------------------
+def attendance_row(n, timestamp="2024-05-01 09:00:00", **fields):
+    return {"timestamp": timestamp, "maid_name": f"maid {n}", "maid_mobile": f"9{n:09d}", "verified": True, **fields}
+
+
+class AttendanceLogWriterTests(SimpleTestCase):
+    """The background CSV writer: fixed columns, daily and size rotation, close and a full queue."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def writer(self, **options):
+        # A long flush interval and batch, so rows only reach disk on close() unless the queue is full
+        options = {"flush_seconds": 60, "batch_size": 1000, "queue_size": 1000, "max_file_bytes": 10**6, **options}
+        writer = attendance_log.AttendanceLogWriter(self.directory, **options)
+        self.addCleanup(writer.close)
+        return writer
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name), newline="", encoding="utf-8") as f:
+            return list(csv.reader(f))
+
+    def files(self):
+        return sorted(os.path.basename(path) for path in glob.glob(os.path.join(self.directory, "*.csv")))
+
+    def test_fixed_columns(self):
+        writer = self.writer()
+        writer.write(attendance_row(1, temperature="36.6", extra_field="dropped", shift_details={"shift": "day"}))
+        writer.write({"maid_mobile": "9000000002", "timestamp": "2024-05-01 10:00:00"})
+        writer.close()
+
+        header, first, second = self.read("attendance_logs_2024-05-01.csv")
+        self.assertEqual(header, attendance_log.FIELDNAMES)
+        first, second = dict(zip(header, first)), dict(zip(header, second))
+        self.assertEqual(first["maid_name"], "maid 1")
+        self.assertEqual(first["temperature"], "36.6")
+        self.assertEqual(first["shift_details"], "{'shift': 'day'}")
+        self.assertEqual(first["ip_address"], "N/A")
+        self.assertEqual(second["maid_mobile"], "9000000002")
+        self.assertEqual({second[name] for name in header if name not in ("maid_mobile", "timestamp")}, {"N/A"})
+
+    def test_one_file_per_day(self):
+        writer = self.writer()
+        writer.write_many([
+            attendance_row(1), attendance_row(2, "2024-05-02 00:00:01"),
+            attendance_row(3), {"maid_mobile": "no timestamp"},
+        ])
+        writer.close()
+        self.assertEqual(self.files(), [
+            "attendance_logs_2024-05-01.csv", "attendance_logs_2024-05-02.csv", "attendance_logs_unknown.csv",
+        ])
+        self.assertEqual([row[2] for row in self.read("attendance_logs_2024-05-01.csv")[1:]], ["9000000001", "9000000003"])
+        self.assertEqual(len(self.read("attendance_logs_2024-05-02.csv")), 2)
+
+    def test_rolls_over_at_max_file_bytes(self):
+        # Every batch here is larger than the limit, so each one starts the next part
+        for batch in range(3):
+            writer = self.writer(max_file_bytes=200)
+            writer.write_many([attendance_row(batch * 10 + n) for n in range(3)])
+            writer.close()
+        self.assertEqual(self.files(), [
+            "attendance_logs_2024-05-01.1.csv", "attendance_logs_2024-05-01.2.csv", "attendance_logs_2024-05-01.csv",
+        ])
+        for name, batch in (("attendance_logs_2024-05-01.csv", 0), ("attendance_logs_2024-05-01.2.csv", 2)):
+            rows = self.read(name)
+            self.assertEqual(rows[0], attendance_log.FIELDNAMES)
+            self.assertEqual([row[2] for row in rows[1:]], [f"9{batch * 10 + n:09d}" for n in range(3)])
+
+    def test_close_writes_everything_then_writes_synchronously(self):
+        writer = self.writer()
+        writer.write_many([attendance_row(n) for n in range(50)])
+        self.assertEqual(self.files(), [])  # still batching
+        writer.close()
+        self.assertFalse(writer._thread.is_alive())
+        self.assertEqual(len(self.read("attendance_logs_2024-05-01.csv")), 51)
+
+        writer.write(attendance_row(50))
+        self.assertEqual(len(self.read("attendance_logs_2024-05-01.csv")), 52)
+
+    def test_full_queue_writes_on_the_caller(self):
+        # No writer thread, so the queue fills up
+        with mock.patch.object(attendance_log.AttendanceLogWriter, "_run", lambda writer: None):
+            writer = self.writer(queue_size=2)
+        writer.write(attendance_row(1))
+        writer.write(attendance_row(2))
+        self.assertEqual(self.files(), [])
+        writer.write(attendance_row(3))
+        self.assertEqual([row[2] for row in self.read("attendance_logs_2024-05-01.csv")[1:]], ["9000000003"])
+        writer.write_many([attendance_row(4), attendance_row(5)])
+
+        writer.close()
+        mobiles = [row[2] for row in self.read("attendance_logs_2024-05-01.csv")[1:]]
+        self.assertEqual(mobiles, ["9000000003", "9000000004", "9000000005", "9000000001", "9000000002"])
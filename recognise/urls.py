@@ -1,7 +1,27 @@
+from django.conf import settings
 from django.urls import path
-from .views import recognize_from_form, check_embedding_status 
+from .metrics import instrumented
+from .views import recognize_from_form, check_embedding_status, identify_from_form, readiness
+from .views import recognize_from_form_async, check_embedding_status_async
+from .views import verify_batch_from_form, verify_batch_from_form_async
+from .views import probe_cache_stats, metrics_view
+
+# Under facerecog.asgi (uvicorn) the recognise and check endpoints are served by the async views
+if settings.RECOGNISE_ASYNC_VIEWS:
+    recognise_view, check_view = recognize_from_form_async, check_embedding_status_async
+    batch_view = verify_batch_from_form_async
+else:
+    recognise_view, check_view = recognize_from_form, check_embedding_status
+    batch_view = verify_batch_from_form
 
 urlpatterns = [
-    path('recognise/', recognize_from_form),
-    path('check/', check_embedding_status)
+    path('recognise/', instrumented("recognise", recognise_view)),
+    path('check/', instrumented("check", check_view)),
+    path('verify-batch/', instrumented("verify_batch", batch_view)),
+    path('identify/', instrumented("identify", identify_from_form)),
+    path('metrics', metrics_view),  # Prometheus scrapes it without the slash
+    path('metrics/', metrics_view),
+    path('cache/', probe_cache_stats),
+    path('ready/', readiness),
+    path('ready', readiness)  # load balancer probes hit it without the slash
 ]
\ No newline at end of file
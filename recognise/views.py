@@ -1,256 +1,623 @@
-import os
-import cv2
-import csv
-import numpy as np
-from deepface import DeepFace
-from scipy.spatial.distance import cosine
+from asgiref.sync import sync_to_async
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.shortcuts import render
 from datetime import datetime
-import threading
-
+from .gallery import gallery
+from .registration_index import registrations
+from . import ann_index, attendance_log, executor, inference, matcher, metrics, probe_cache, warmup
+from .metrics import trace
+
+
+# -------------------- READINESS --------------------
+def readiness(request):
+    """200 once this worker has finished its model warm-up, 503 until then."""
+    state = warmup.status()
+    if state["status"] != warmup.STATUS_READY:
+        # Processes started without warm-up (e.g. MODEL_WARMUP_ON_START=0) warm up on first probe
+        warmup.start()
+        return JsonResponse(state, status=503)
+    return JsonResponse(state)
+
+def metrics_view(request):
+    """Prometheus text exposition of this worker's request, stage and lock-wait metrics."""
+    stats = probe_cache.stats()
+    extra = []
+    for cache, values in stats.items():
+        for counter in ("hits", "misses", "evictions"):
+            extra.append((
+                f"facerecog_probe_cache_{cache}_{counter}_total", f"Probe cache {cache} {counter}",
+                values[counter], "counter",
+            ))
+        extra.append((f"facerecog_probe_cache_{cache}_entries", f"Probe cache {cache} entries", values["entries"]))
+    extra.append(("facerecog_gallery_bytes", "Bytes of template matrices held by the gallery", gallery.nbytes))
+    extra.append(("facerecog_identify_index_bytes", "Bytes held by cached identify indexes", ann_index.indexes.nbytes))
+    return HttpResponse(metrics.render(extra), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+def probe_cache_stats(request):
+    """Hit/miss counters of this worker's probe caches: how much inference retries would have cost."""
+    return JsonResponse(probe_cache.stats())
 
+@csrf_exempt
+def recognize_from_form(request):
 
-model_loaded = False
+    if request.method == "GET":
+        return render(request, "recognise_form.html")
 
-def load_model_once():
-    global model_loaded
-    if not model_loaded:
-        DeepFace.build_model("Facenet")
-        model_loaded = True
+    elif request.method == "POST":
+        try:
+            trace("📦 FORM KEYS:", list(request.POST.keys()))
+            trace("📸 FILE KEYS:", list(request.FILES.keys()))
 
+            fields = recognise_fields(request.POST)
+            image_file = request.FILES.get("PaymaaUpload1")
 
+            # ✅ Step 2: Basic validations
+            error = validate_recognise_request(fields, image_file)
+            if error is not None:
+                return error
 
-# -------------------- THREAD LOCKS --------------------
-csv_lock = threading.Lock()
-embedding_lock = threading.Lock()
-model_lock = threading.Lock()
+            result = recognise_image(image_file, fields)
+            if result is None:
+                return JsonResponse({"status": "error", "message": "Invalid image"}, status=400)
 
-# -------------------- LOAD MODEL ONCE --------------------
-print("⚙️ Loading Facenet model once...")
-# DeepFace.build_model("Facenet")  # ❗this loads and caches model internally
-print("✅ Facenet model ready.")
+            return record_recognition(fields, *result)
 
-# -------------------- LOG FILE --------------------
-LOGS_DIR = os.path.join(settings.BASE_DIR, "logs")
-LOG_FILE = os.path.join(LOGS_DIR, "attendance_logs.csv")
-os.makedirs(LOGS_DIR, exist_ok=True)
+        except Exception as e:
+            print("❌ ERROR:", e)
+            return JsonResponse({"status": "error", "message": str(e)}, status=500)
 
 
 @csrf_exempt
-def recognize_from_form(request):
+async def recognize_from_form_async(request):
+    """
+    ASGI version of recognize_from_form. The upload is read by the server
+    without holding a thread; decode, embedding and matching run on the
+    bounded executor, and a full executor answers 503 with Retry-After.
+    """
 
     if request.method == "GET":
         return render(request, "recognise_form.html")
 
-    elif request.method == "POST":
-        try:
-            form_data = request.POST
-            file_data = request.FILES
-
-            print("📦 FORM KEYS:", list(form_data.keys()))
-            print("📸 FILE KEYS:", list(file_data.keys()))
-
-
-            maid_mobile = form_data.get("groundmobiledispreq", "")
-            maid_name = form_data.get("groundnamedispreq", "")
-            unique_id = form_data.get("groundtemauniqueId", "")
-            maid_location = form_data.get("groundtemalocation", "")
-            shift_details = form_data.get("groundshiftdetials", "")
-            temperature = form_data.get("groundtemp", "")
-            mask_status = form_data.get("groundmask", "")
-            device_name = form_data.get("indevicename", "")
-            device_brand = form_data.get("indevicebrand", "")
-            system_name = form_data.get("insystemname", "")
-            ip_address = form_data.get("inipaddress", "")
-            server_name = form_data.get("serverName") 
-            image_file = file_data.get("PaymaaUpload1")
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "POST required"}, status=405)
 
-            # ✅ Step 2: Basic validations
-            if not image_file:
-                return JsonResponse({"status": "error", "message": "Image missing"}, status=400)
-            if not unique_id:
-                return JsonResponse({"status": "error", "message": "Missing unique ID"}, status=400)
-            if not maid_mobile:
-                return JsonResponse({"status": "error", "message": "Missing maid mobile"}, status=400)
-            if not server_name or str(server_name).strip() == "" or server_name.lower() == "null":
-                return JsonResponse({"status": "error", "message": "Invalid or missing server name"}, status=400)
-            
-            # ✅ Step 3: Parse location
-            latitude, longitude = None, None
-            if "&&" in maid_location:
-                parts = maid_location.split("&&")
-                if len(parts) == 2:
-                    latitude, longitude = parts
-            print(f"🗺 Parsed Location → Lat: {latitude}, Lon: {longitude}")
-
-            # ✅ Step 4: Convert image to OpenCV format
-            file_bytes = np.asarray(bytearray(image_file.read()), dtype=np.uint8)
-            image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+    try:
+        fields = recognise_fields(request.POST)
+        image_file = request.FILES.get("PaymaaUpload1")
+
+        error = validate_recognise_request(fields, image_file)
+        if error is not None:
+            return error
+
+        result = await executor.get_executor().run(recognise_image, image_file, fields)
+        if result is None:
+            return JsonResponse({"status": "error", "message": "Invalid image"}, status=400)
+
+        return record_recognition(fields, *result)
+
+    except executor.ExecutorFull:
+        trace("⏳ Recognise queue full, asking the client to retry")
+        return overloaded_response()
+    except Exception as e:
+        print("❌ ERROR:", e)
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
+
+
+def overloaded_response():
+    response = JsonResponse({"status": "error", "message": "Server busy, please retry"}, status=503)
+    response["Retry-After"] = str(settings.ASYNC_RETRY_AFTER_SECONDS)
+    return response
+
+
+# -------------------- RECOGNISE STEPS --------------------
+def recognise_fields(form_data):
+    """Pull the recognise form fields out of request.POST, splitting "lat&&lon" into two."""
+    maid_location = form_data.get("groundtemalocation", "")
+
+    # ✅ Step 3: Parse location
+    latitude, longitude = None, None
+    if "&&" in maid_location:
+        parts = maid_location.split("&&")
+        if len(parts) == 2:
+            latitude, longitude = parts
+    trace(f"🗺 Parsed Location → Lat: {latitude}, Lon: {longitude}")
+
+    return {
+        "maid_mobile": form_data.get("groundmobiledispreq", ""),
+        "maid_name": form_data.get("groundnamedispreq", ""),
+        "unique_id": form_data.get("groundtemauniqueId", ""),
+        "shift_details": form_data.get("groundshiftdetials", ""),
+        "temperature": form_data.get("groundtemp", ""),
+        "mask_status": form_data.get("groundmask", ""),
+        "device_name": form_data.get("indevicename", ""),
+        "device_brand": form_data.get("indevicebrand", ""),
+        "system_name": form_data.get("insystemname", ""),
+        "ip_address": form_data.get("inipaddress", ""),
+        "server_name": form_data.get("serverName"),
+        "latitude": latitude,
+        "longitude": longitude,
+    }
+
+
+def validate_recognise_request(fields, image_file):
+    """Return a 400 response for an incomplete request, None if it can be processed."""
+    server_name = fields["server_name"]
+    if not image_file:
+        return JsonResponse({"status": "error", "message": "Image missing"}, status=400)
+    if not fields["unique_id"]:
+        return JsonResponse({"status": "error", "message": "Missing unique ID"}, status=400)
+    if not fields["maid_mobile"]:
+        return JsonResponse({"status": "error", "message": "Missing maid mobile"}, status=400)
+    if not server_name or str(server_name).strip() == "" or server_name.lower() == "null":
+        return JsonResponse({"status": "error", "message": "Invalid or missing server name"}, status=400)
+    return None
+
+
+def recognise_image(image_file, fields):
+    """
+    Decode, detect, embed and verify one uploaded photo. Returns
+    (face_found, verified, weighted_sum, timings), or None if it is not an
+    image. When no face is found Facenet is not run at all.
+    """
+    timings = {}
+    with metrics.stage("upload_read", timings):
+        data = image_file.read()
+
+    # A retried upload of the same photo reuses its embedding (or its "no face")
+    key = probe_cache.probe_key(data)
+    embedding = probe_cache.embeddings.get(key)
+    if embedding is not probe_cache.MISS:
+        timings["cached"] = True
+        trace("♻️ Same photo seen recently, reusing its embedding")
+        if embedding is None:
+            return False, False, 0.0, timings
+    else:
+        embedding = embed_probe(data, timings)
+        if embedding is False:
+            return None
+        probe_cache.embeddings.put(key, embedding)
+        if embedding is None:
+            return False, False, 0.0, timings
+
+    # -------------------- Verification --------------------
+    verified, weighted_sum = verify_employee_identity(
+        fields["maid_mobile"],
+        fields["unique_id"],
+        embedding,
+        fields["server_name"],
+        probe_key=key,
+    )
+    return True, verified, weighted_sum, timings
+
+
+def embed_probe(data, timings):
+    """Decode, detect and embed; the embedding, None if there is no face, False if it is not an image."""
+
+    # ✅ Step 4: Convert image to OpenCV format
+    with metrics.stage("decode", timings):
+        image = inference.decode_image(data)
+    if image is None:
+        return False
+
+    trace("✅ Image decoded successfully. Shape:", image.shape)
+
+    # -------------------- Detect + Align --------------------
+    with metrics.stage("detect", timings):
+        face = inference.detect_face(image)
+    if face is None:
+        trace(f"🙈 No face found ({timings})")
+        return None
+
+    # -------------------- Generate Embedding --------------------
+    with metrics.stage("embed", timings):
+        embedding = inference.embed(face)
+    trace(f"✅ Embedding extracted successfully ({timings})")
+    return embedding
+
+
+def record_recognition(fields, face_found, verified, weighted_sum, timings):
+    """Queue the attendance row and build the recognise response."""
+
+    # -------------------- Logging --------------------
+    with metrics.stage("log_write", timings):
+        log_to_csv({
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "maid_name": fields["maid_name"],
+            "maid_mobile": fields["maid_mobile"],
+            "unique_id": fields["unique_id"],
+            "verified": verified,
+            "weighted_sum": round(weighted_sum, 4),
+            "mask_status": fields["mask_status"] or "N/A",
+            "temperature": fields["temperature"] or "N/A",
+            "shift_details": fields["shift_details"] or "N/A",
+            "latitude": fields["latitude"] or "N/A",
+            "longitude": fields["longitude"] or "N/A",
+            "device_name": fields["device_name"] or "N/A",
+            "device_brand": fields["device_brand"] or "N/A",
+            "system_name": fields["system_name"] or "N/A",
+            "ip_address": fields["ip_address"] or "N/A",
+            "server_name": fields["server_name"] or "N/A"
+        })
+
+    trace("🧾 Log queued for the attendance CSV.")
+    trace("===================== PROCESS COMPLETED =====================\n")
+
+    if not face_found:
+        status = "no_face"
+    else:
+        status = "verified" if verified else "not_verified"
+
+    with metrics.stage("response"):
+        response = JsonResponse({
+            "status": status,
+            "maid_name": fields["maid_name"],
+            "mobile": fields["maid_mobile"],
+            "uniqueId": fields["unique_id"],
+            "weighted_sum": weighted_sum,
+            "timings": timings
+        })
+    # Picked up by metrics.instrumented for the structured request log line
+    response.log_fields = {"status": status, "uniqueId": fields["unique_id"], "server": fields["server_name"], **timings}
+    return response
+
+
+# -------------------- BATCH VERIFY (KIOSKS) --------------------
+def batch_claims(form_data):
+    """Claimed (mobile, name) pairs from repeated and/or comma-separated form values, first occurrence kept."""
+    mobiles = [m.strip() for value in form_data.getlist("groundmobiledispreq") for m in value.split(",") if m.strip()]
+    names = [n.strip() for value in form_data.getlist("groundnamedispreq") for n in value.split(",")]
+    if len(names) != len(mobiles):
+        names = [""] * len(mobiles)
+
+    claims = {}
+    for mobile, name in zip(mobiles, names):
+        claims.setdefault(mobile, name)
+    return list(claims.items())
+
+
+def validate_batch_request(fields, images, claims):
+    """Return a 400 response for an incomplete or oversized batch, None if it can be processed."""
+    error = validate_recognise_request(fields, images[0] if images else None)
+    if error is not None:
+        return error
+    if len(images) > settings.BATCH_VERIFY_MAX_IMAGES:
+        return JsonResponse(
+            {"status": "error", "message": f"At most {settings.BATCH_VERIFY_MAX_IMAGES} images per batch"}, status=400
+        )
+    if len(claims) > settings.BATCH_VERIFY_MAX_CLAIMS:
+        return JsonResponse(
+            {"status": "error", "message": f"At most {settings.BATCH_VERIFY_MAX_CLAIMS} mobiles per batch"}, status=400
+        )
+    return None
+
+
+def batch_verify_images(images, fields, claims):
+    """
+    Detect every face in every photo, embed them all through the batcher in
+    one go and score them against all claimed people in one matrix product.
+    Each face answers for at most one person. Returns (results, images, timings).
+    """
+    timings = {}
+    with metrics.stage("upload_read", timings):
+        uploads = [image_file.read() for image_file in images]
+
+    with metrics.stage("decode", timings):
+        decoded = [inference.decode_image(data) for data in uploads]
+
+    faces, face_origin, image_summaries = [], [], []
+    with metrics.stage("detect", timings):
+        for image_no, image in enumerate(decoded):
             if image is None:
-                return JsonResponse({"status": "error", "message": "Invalid image"}, status=400)
+                image_summaries.append({"image": image_no, "status": "invalid", "faces": 0, "unmatched": 0})
+                continue
+            crops = inference.detect_faces(image, max_faces=settings.BATCH_VERIFY_MAX_FACES_PER_IMAGE)
+            image_summaries.append({"image": image_no, "status": "ok", "faces": len(crops), "unmatched": 0})
+            faces.extend(crops)
+            face_origin.extend({"image": image_no, "face": face_no} for face_no in range(len(crops)))
+    trace(f"👥 Batch: {len(faces)} faces in {len(images)} images for {len(claims)} claims")
+
+    with metrics.stage("gallery_load"):
+        company = gallery.get(fields["server_name"], fields["unique_id"])
+        if company is None or any(mobile not in company for mobile, _ in claims):
+            # Unknown claims get the same short recheck as in verify_employee_identity
+            company = gallery.get(
+                fields["server_name"], fields["unique_id"], max_age=settings.REGISTRATION_INDEX_NEGATIVE_TTL_SECONDS
+            )
 
-            print("✅ Image decoded successfully. Shape:", image.shape)
+    # Only registered claims compete for faces; row i of verified/scores is registered[i]
+    registered = [mobile for mobile, _ in claims if company is not None and mobile in company]
+    verified = scores = None
+    assigned = {}
+    if faces and registered:
+        with metrics.stage("embed", timings):
+            embeddings = inference.embed_many(faces)
+        with metrics.stage("match", timings):
+            verified, scores = matcher.verify_many(embeddings, company, registered)
+            assigned = matcher.assign_faces(verified, scores)
+    rows = {mobile: row for row, mobile in enumerate(registered)}
+
+    # Faces nobody claimed, e.g. someone in the queue who is not in this batch
+    for face, origin in enumerate(face_origin):
+        if face not in assigned.values():
+            image_summaries[origin["image"]]["unmatched"] += 1
+
+    results = []
+    for mobile, name in claims:
+        person = rows.get(mobile)
+        result = {"mobile": mobile, "maid_name": name, "verified": False, "weighted_sum": 0.0, "face": None}
+        if person is None:
+            result["status"] = "not_registered"
+        elif person not in assigned:
+            result["status"] = "no_face"
+        else:
+            face = assigned[person]
+            result.update(
+                verified=bool(verified[person, face]),
+                weighted_sum=float(scores[person, face]),
+                face=face_origin[face],
+                status="verified" if verified[person, face] else "not_verified",
+            )
+        results.append(result)
+    return results, image_summaries, timings
+
+
+def record_batch(fields, results, image_summaries, timings):
+    """Queue one attendance row per claim in a single bulk write and build the batch response."""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with metrics.stage("log_write", timings):
+        attendance_log.log_attendance_many([
+            {
+                "timestamp": timestamp,
+                "maid_name": result["maid_name"],
+                "maid_mobile": result["mobile"],
+                "unique_id": fields["unique_id"],
+                "verified": result["verified"],
+                "weighted_sum": round(result["weighted_sum"], 4),
+                "mask_status": fields["mask_status"] or "N/A",
+                "temperature": fields["temperature"] or "N/A",
+                "shift_details": fields["shift_details"] or "N/A",
+                "latitude": fields["latitude"] or "N/A",
+                "longitude": fields["longitude"] or "N/A",
+                "device_name": fields["device_name"] or "N/A",
+                "device_brand": fields["device_brand"] or "N/A",
+                "system_name": fields["system_name"] or "N/A",
+                "ip_address": fields["ip_address"] or "N/A",
+                "server_name": fields["server_name"] or "N/A",
+            }
+            for result in results
+        ])
+
+    faces = sum(summary["faces"] for summary in image_summaries)
+    verified = sum(1 for result in results if result["verified"])
+    with metrics.stage("response"):
+        response = JsonResponse({
+            "status": "ok",
+            "uniqueId": fields["unique_id"],
+            "verified": verified,
+            "claims": len(results),
+            "faces": faces,
+            "images": image_summaries,
+            "results": results,
+            "timings": timings,
+        })
+    response.log_fields = {
+        "uniqueId": fields["unique_id"], "server": fields["server_name"],
+        "claims": len(results), "faces": faces, "verified": verified, **timings,
+    }
+    return response
 
 
-            # -------------------- Generate Embedding --------------------
-            print("🧠 Extracting embedding using DeepFace (Facenet)...")
-            with model_lock:
-                load_model_once()
-                embedding_result = DeepFace.represent(
-                    image,
-                    model_name='Facenet',
-                    enforce_detection=False
-                )
+@csrf_exempt
+def verify_batch_from_form(request):
+    """
+    Kiosk check-in for a queue of people: several PaymaaUpload1 photos and/or
+    several faces per photo, with the claimed mobiles in groundmobiledispreq
+    (repeated or comma-separated). Answers per claimed mobile.
+    """
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "POST required"}, status=405)
 
-            embedding = embedding_result[0]['embedding']
-            print("✅ Embedding extracted successfully")
+    try:
+        fields = recognise_fields(request.POST)
+        images = request.FILES.getlist("PaymaaUpload1")
+        claims = batch_claims(request.POST)
 
+        error = validate_batch_request(fields, images, claims)
+        if error is not None:
+            return error
 
-            # -------------------- Verification --------------------
-            verified, weighted_sum = verify_employee_identity(
-                maid_mobile,
-                unique_id,
-                embedding,
-                server_name
-            )
+        return record_batch(fields, *batch_verify_images(images, fields, claims))
 
-            # -------------------- Logging --------------------
-            log_to_csv({
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "maid_name": maid_name,
-                "maid_mobile": maid_mobile,
-                "unique_id": unique_id,
-                "verified": verified,
-                "weighted_sum": round(weighted_sum, 4),
-                "mask_status": mask_status or "N/A",
-                "temperature": temperature or "N/A",
-                "shift_details": shift_details or "N/A",
-                "latitude": latitude or "N/A",
-                "longitude": longitude or "N/A",
-                "device_name": device_name or "N/A",
-                "device_brand": device_brand or "N/A",
-                "system_name": system_name or "N/A",
-                "ip_address": ip_address or "N/A",
-                "server_name": server_name or "N/A"
-            })
-
-            print("🧾 Log saved to CSV file successfully.")
-            print("===================== PROCESS COMPLETED =====================\n")
-
-
-            return JsonResponse({
-                "status": "verified" if verified else "not_verified",
-                "maid_name": maid_name,
-                "mobile": maid_mobile,
-                "uniqueId": unique_id,
-                "weighted_sum": weighted_sum
-            })
+    except Exception as e:
+        print("❌ ERROR:", e)
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
 
-        except Exception as e:
-            print("❌ ERROR:", e)
-            return JsonResponse({"status": "error", "message": str(e)}, status=500)
+
+@csrf_exempt
+async def verify_batch_from_form_async(request):
+    """ASGI version of verify_batch_from_form; the work runs on the bounded executor."""
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "POST required"}, status=405)
+
+    try:
+        fields = recognise_fields(request.POST)
+        images = request.FILES.getlist("PaymaaUpload1")
+        claims = batch_claims(request.POST)
+
+        error = validate_batch_request(fields, images, claims)
+        if error is not None:
+            return error
+
+        result = await executor.get_executor().run(batch_verify_images, images, fields, claims)
+        return record_batch(fields, *result)
+
+    except executor.ExecutorFull:
+        trace("⏳ Recognise queue full, asking the client to retry")
+        return overloaded_response()
+    except Exception as e:
+        print("❌ ERROR:", e)
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
+
+
+@csrf_exempt
+def identify_from_form(request):
+    """1:N lookup: who in this company (or, without a uniqueId, on this server) is in the photo?"""
+
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "POST required"}, status=405)
+
+    try:
+        unique_id = request.POST.get("groundtemauniqueId", "")
+        server_name = request.POST.get("serverName")
+        image_file = request.FILES.get("PaymaaUpload1")
+
+        if not image_file:
+            return JsonResponse({"status": "error", "message": "Image missing"}, status=400)
+        if not server_name or str(server_name).strip() == "" or server_name.lower() == "null":
+            return JsonResponse({"status": "error", "message": "Invalid or missing server name"}, status=400)
+
+        image = inference.decode_image(image_file.read())
+        if image is None:
+            return JsonResponse({"status": "error", "message": "Invalid image"}, status=400)
+
+        face = inference.detect_face(image)
+        if face is None:
+            return JsonResponse({"status": "no_face", "mobile": None, "uniqueId": None, "similarity": 0.0, "candidates": []})
+        embedding = inference.embed(face)
+
+        candidates = identify_employee(embedding, server_name, unique_id or None)
+        best = candidates[0] if candidates else None
+        identified = best is not None and best["similarity"] >= settings.IDENTIFY_THRESHOLD
+        trace(f"[IDENTIFY] server={server_name} company={unique_id or '*'} best={best} identified={identified}")
+
+        return JsonResponse({
+            "status": "identified" if identified else "not_identified",
+            "mobile": best["mobile"] if identified else None,
+            "uniqueId": best["uniqueId"] if identified else None,
+            "similarity": best["similarity"] if best else 0.0,
+            "candidates": candidates,
+        })
+
+    except Exception as e:
+        print("❌ ERROR:", e)
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
+
+
+# -------------------- IDENTIFY --------------------
+def identify_employee(embedding, server_name, uniqueId=None, k=5):
+    """Top-k candidates across one company, or every company on the server when uniqueId is None."""
+    if uniqueId is None:
+        # One server-wide index labelled "company/mobile"; company ids never contain "/"
+        index = ann_index.indexes.get_server(server_name)
+        if index is None:
+            return []
+        candidates = []
+        for label, similarity in index.search(embedding, k):
+            company, mobile = label.split("/", 1)
+            candidates.append({"uniqueId": company, "mobile": mobile, "similarity": round(similarity, 4)})
+        return candidates
+
+    index = ann_index.indexes.get(server_name, uniqueId)
+    if index is None:
+        return []
+    return [
+        {"uniqueId": uniqueId, "mobile": mobile, "similarity": round(similarity, 4)}
+        for mobile, similarity in index.search(embedding, k)
+    ]
 
 
 # -------------------- VERIFY IDENTITY --------------------
-def verify_employee_identity(user_id, uniqueId, uploaded_embedding, server_name):
+def verify_employee_identity(user_id, uniqueId, uploaded_embedding, server_name, probe_key=None):
 
-    print("\n[VERIFY] Starting identity verification...")
+    trace("\n[VERIFY] Starting identity verification...")
 
     # ✅ Validate server name
     if not server_name or str(server_name).strip().lower() == "null":
         print("❌ Invalid server_name provided")
         return False, 0.0
     
-    # ✅ Build paths
-    server_folder = os.path.join(settings.MEDIA_ROOT, 'embeddings', str(server_name).strip().lower())
-    user_folder = os.path.join(server_folder, f"company_{uniqueId}")
-
-    print(f"[VERIFY] Checking folder: {user_folder}")
+    # ✅ Load company gallery (cached in memory after the first request)
+    with metrics.stage("gallery_load"):
+        company = gallery.get(server_name, uniqueId)
 
-    if not os.path.exists(user_folder):
-        print(f"❌ Folder not found: {user_folder}")
+    if company is None:
+        print(f"❌ No embeddings stored for company_{uniqueId} on {server_name}")
         return False, 0.0
 
-    user_files = [
-        f for f in os.listdir(user_folder)
-        if f.startswith(f"{user_id}_") and f.endswith('.npy')
-    ]
-
-    print(f"[VERIFY] Found {len(user_files)} embeddings for user {user_id}")
-
-
-    if not user_files:
-        return False, 0.0
+    if user_id not in company:
+        # May be a registration another process (the job worker) has just written;
+        # re-check disk as soon as check/ would, instead of after the revalidate interval
+        with metrics.stage("gallery_load"):
+            company = gallery.get(server_name, uniqueId, max_age=settings.REGISTRATION_INDEX_NEGATIVE_TTL_SECONDS)
+        if company is None or user_id not in company:
+            trace(f"[VERIFY] No embeddings for user {user_id}")
+            return False, 0.0
 
-    weighted_sum = 0.0
+    trace(f"[VERIFY] Found {len(company.templates(user_id))} embeddings for user {user_id}, mode={settings.MATCH_MODE}")
 
-    with embedding_lock:
-        for f in user_files:
-            file_path = os.path.join(user_folder, f)
-            stored_embedding = np.load(file_path)
+    cache_key = None
+    if probe_key is not None and settings.PROBE_CACHE_VERIFICATIONS:
+        cache_key = probe_cache.verification_key(probe_key, server_name, uniqueId, user_id, company)
+        cached = probe_cache.verifications.get(cache_key)
+        if cached is not probe_cache.MISS:
+            trace(f"[VERIFY RESULT] Verified={cached[0]}, Score={cached[1]:.4f} (cached)\n")
+            return cached
 
-            distance = cosine(uploaded_embedding, stored_embedding)
-            print(f"→ Compared with {f}: Distance={distance:.4f}")
-            if distance < 0.5:
-                similarity = 1 - distance
-                weighted_sum += similarity ** 2
+    # No lock: the CompanyStore is an immutable snapshot; registrations publish a new one
+    with metrics.stage("match"):
+        verified, weighted_sum = matcher.verify_user(uploaded_embedding, company, user_id)
+    trace(f"[VERIFY RESULT] Verified={verified}, Score={weighted_sum:.4f}\n")
 
-        # ✅ Threshold for verification
-        verified = weighted_sum >= 4.3
-        print(f"[VERIFY RESULT] Verified={verified}, Weighted Sum={weighted_sum:.4f}\n")
+    if cache_key is not None:
+        probe_cache.verifications.put(cache_key, (verified, weighted_sum))
 
 
-    return weighted_sum >= 4.5, weighted_sum
+    return verified, weighted_sum
 
 
 # -------------------- CSV LOGGING --------------------
 def log_to_csv(data):
-    with csv_lock:
-        file_exists = os.path.exists(LOG_FILE)
-        with open(LOG_FILE, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=list(data.keys()))
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(data)
+    # Queued for the background writer; flushed to logs/attendance_logs_{date}.csv in batches
+    attendance_log.log_attendance(data)
 
 
 @csrf_exempt
 def check_embedding_status(request):
+    """
+    Is a mobile registered in a company? maidMobile=... answers {"registered": bool};
+    maidMobiles=a,b,c answers {"registered": {mobile: bool}} for many at once.
+    """
     try:
         maidMobile = request.GET.get("maidMobile")
+        maidMobiles = request.GET.get("maidMobiles")
         uniqueId = request.GET.get("uniqueId")
         serverName = request.GET.get("serverName")
 
-        print(serverName)
+        if maidMobiles is not None:
+            mobiles = [m.strip() for m in maidMobiles.split(",") if m.strip()]
+            if len(mobiles) > settings.REGISTRATION_CHECK_MAX_BATCH:
+                return JsonResponse(
+                    {"status": "error", "message": f"At most {settings.REGISTRATION_CHECK_MAX_BATCH} mobiles per check"},
+                    status=400,
+                )
+            if not mobiles or not uniqueId or not serverName:
+                return JsonResponse({"registered": {m: False for m in mobiles}})
+            return JsonResponse({"registered": registrations.lookup(serverName, uniqueId, mobiles)})
 
         # Basic validations
         if not maidMobile or not uniqueId or not serverName:
             return JsonResponse({"registered": False})
-        
-        # Build new embedding directory path
-        server_folder = os.path.join(
-            settings.MEDIA_ROOT,
-            "embeddings",
-            str(serverName).strip().lower()
-        )
 
-        embed_dir = os.path.join(server_folder, f"company_{uniqueId}")
+        # Set lookup in the in-memory registration index; no matrices are loaded
+        return JsonResponse({"registered": registrations.is_registered(serverName, uniqueId, maidMobile)})
 
-        # Check folder existence
-        if not os.path.exists(embed_dir):
-            return JsonResponse({"registered": False})
-
-        # embed_dir = os.path.join(settings.MEDIA_ROOT, "embeddings", f"company_{uniqueId}")
-
-        files = [f for f in os.listdir(embed_dir) if f.startswith(f"{maidMobile}_") and f.endswith(".npy")]
-
-        if len(files) == 0:
-            return JsonResponse({"registered": False})
+    except Exception:
+        return JsonResponse({"registered": False})
 
-        return JsonResponse({"registered": True})
 
-    except Exception:
-        return JsonResponse({"registered": False})
\ No newline at end of file
+@csrf_exempt
+async def check_embedding_status_async(request):
+    # Usually a set lookup, but it may read the company's index.json; keep it off the event loop
+    return await sync_to_async(check_embedding_status, thread_sensitive=False)(request)
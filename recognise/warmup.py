@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+# cold -> warming -> ready (or failed); read by the /ready endpoint
+STATUS_COLD = "cold"
+STATUS_WARMING = "warming"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+_state = {"status": STATUS_COLD, "seconds": None, "error": None}
+_lock = threading.Lock()
+
+
+# -------------------- WHEN TO WARM UP --------------------
+def should_warm_up(argv=None):
+    """
+    Warm up in serving processes only: gunicorn/uvicorn workers and the
+    runserver child. Other manage.py commands (migrate, shell, benches),
+    scripts and the runserver autoreload parent skip it.
+    """
+    if not settings.MODEL_WARMUP_ON_START:
+        return False
+    if argv is None:
+        argv = sys.argv
+        if any(server in sys.modules for server in ("gunicorn", "uvicorn", "daphne")):
+            return True
+    if not argv or os.path.basename(argv[0]) != "manage.py" or argv[1:2] != ["runserver"]:
+        return False
+    return os.environ.get("RUN_MAIN") == "true" or "--noreload" in argv
+
+
+# -------------------- WARM-UP --------------------
+def run():
+    """Build Facenet and MediaPipe, then push dummy inputs through every path a request takes."""
+    from . import inference
+
+    with _lock:
+        if _state["status"] in (STATUS_WARMING, STATUS_READY):
+            return
+        _state.update(status=STATUS_WARMING, error=None)
+
+    print("⚙️ Warming up Facenet and MediaPipe...")
+    start = time.perf_counter()
+    try:
+        inference.get_model()
+
+        blank = np.zeros((240, 320, 3), dtype=np.uint8)
+        inference.detect_face(blank)
+        inference.embed(blank[:160, :160])
+        inference.embed_batch([blank, blank])
+    except Exception as e:
+        with _lock:
+            _state.update(status=STATUS_FAILED, error=str(e))
+        print("❌ Model warm-up failed:", e)
+        return
+
+    seconds = time.perf_counter() - start
+    with _lock:
+        _state.update(status=STATUS_READY, seconds=round(seconds, 2))
+    print(f"✅ Facenet model ready ({seconds:.1f}s warm-up).")
+
+
+def start():
+    """Run the warm-up on a background thread (no-op if it is running or done)."""
+    with _lock:
+        if _state["status"] in (STATUS_WARMING, STATUS_READY):
+            return
+    threading.Thread(target=run, name="model-warmup", daemon=True).start()
+
+
+def status():
+    with _lock:
+        return dict(_state)
+
+
+def is_ready():
+    return status()["status"] == STATUS_READY
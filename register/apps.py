@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
+
+
+def check_registration_worker(app_configs, **kwargs):
+    # With REGISTRATION_JOBS_IN_WEB=0 nothing in the web process runs queued jobs
+    if settings.REGISTRATION_ASYNC and not settings.REGISTRATION_JOBS_IN_WEB:
+        return [checks.Warning(
+            "Registration jobs are queued but not run by the web processes.",
+            hint="Run one `manage.py registration_worker` next to them, or set REGISTRATION_JOBS_IN_WEB=1.",
+            id="register.W001",
+        )]
+    return []
 
 
 class RegisterConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "register"
+
+    def ready(self):
+        checks.register(check_registration_worker, checks.Tags.compatibility)
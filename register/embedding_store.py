@@ -0,0 +1,504 @@
+"""
+Packed per-company embedding store.
+
+Each media/embeddings/{server}/company_{uniqueId}/ folder holds:
+
+    embeddings.f32   append-only matrix, one L2-normalised row per template
+    index.json       {"matrix": file, "dim": D, "rows": N, "dtype": precision,
+                      "people": {mobile: [offset, count, summary_count]}}
+
+Rows are stored at the precision EMBEDDING_STORE_PRECISION had when the
+folder was created (index "dtype", float32 when absent): float32, float16,
+or int8 with a per-row float32 scale (dim int8 values followed by the scale,
+so a 128-d row is 132 bytes instead of 512). Compaction converts a folder to
+the current setting. The matrix file is embeddings.f32/.f16/.i8 accordingly.
+
+A person's count template rows are followed by summary_count summary rows:
+their normalised centroid, then the templates furthest from it. Entries
+written before summaries existed have no third element.
+
+Readers memory-map the matrix and slice it per mobile without copying.
+Writers append rows under an flock and publish them by atomically
+replacing index.json, so a reader never sees rows the index does not cover.
+Folders still in the old {mobile}_{frame}.npy layout are read as before
+until they are migrated (manage.py migrate_embeddings) or next written to.
+Compaction writes a new embeddings.{generation}.{f32,f16,i8} and points the index at it.
+"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from types import MappingProxyType
+
+import numpy as np
+from django.conf import settings
+
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+DTYPE = np.float32
+
+PRECISIONS = ("float32", "float16", "int8")
+SUFFIXES = {"float32": "f32", "float16": "f16", "int8": "i8"}
+
+
+def embeddings_root():
+    return os.path.join(settings.MEDIA_ROOT, "embeddings")
+
+
+def company_folder(server_name, uniqueId):
+    server_folder = os.path.join(embeddings_root(), str(server_name).strip().lower())
+    return os.path.join(server_folder, f"company_{uniqueId}")
+
+
+def normalize_rows(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=DTYPE))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def summarize_templates(rows, top_k=None):
+    """Normalised centroid of a person's templates plus the top_k templates furthest from it."""
+    if top_k is None:
+        top_k = settings.MATCH_SUMMARY_TOP_K
+
+    centroid = normalize_rows(rows.mean(axis=0))
+    if top_k <= 0 or len(rows) < 2:
+        return centroid
+    outliers = rows[np.argsort(rows @ centroid[0])[:top_k]]
+    return np.vstack([centroid, outliers])
+
+
+def _with_summary(rows):
+    summary = summarize_templates(rows)
+    return np.vstack([rows, summary]), len(summary)
+
+
+# -------------------- PRECISION --------------------
+def int8_record(dim):
+    return np.dtype([("q", np.int8, (dim,)), ("scale", np.float32)])
+
+
+def configured_precision():
+    precision = settings.EMBEDDING_STORE_PRECISION
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown EMBEDDING_STORE_PRECISION {precision!r}, expected one of {PRECISIONS}")
+    return precision
+
+
+def row_bytes(precision, dim):
+    if precision == "int8":
+        return int8_record(dim).itemsize
+    return dim * np.dtype(precision).itemsize
+
+
+def quantize_int8(rows):
+    """Symmetric per-row int8 quantisation: (int8 values, float32 scale) with rows ~= q * scale."""
+    rows = np.atleast_2d(np.asarray(rows, dtype=DTYPE))
+    scale = np.abs(rows).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.clip(np.rint(rows / scale[:, None]), -127, 127).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+
+class Int8Rows:
+    """
+    Rows of int8 records (values + per-row scale) that behave like a float
+    matrix where the matcher needs one: len(), slicing, `rows @ probe` (an
+    int8 x int8 dot product accumulated in int32, then rescaled) and
+    np.asarray() (dequantised float32).
+    """
+
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, item):
+        return Int8Rows(self.records[item])
+
+    @property
+    def shape(self):
+        return (len(self.records), self.records.dtype["q"].shape[0])
+
+    @property
+    def nbytes(self):
+        return self.records.nbytes
+
+    def __matmul__(self, probes):
+        """Similarities to one probe (dim,) or to each column of probes (dim, n)."""
+        probes = np.asarray(probes)
+        q_probes, probe_scales = quantize_int8(probes.T if probes.ndim == 2 else probes)
+        dots = self.records["q"].astype(np.int32) @ q_probes.T.astype(np.int32)
+        similarities = dots.astype(DTYPE) * self.records["scale"][:, None] * probe_scales
+        return similarities if probes.ndim == 2 else similarities[:, 0]
+
+    def dequantize(self):
+        return self.records["q"].astype(DTYPE) * self.records["scale"][:, None]
+
+    def __array__(self, dtype=None, copy=None):
+        rows = self.dequantize()
+        return rows if dtype is None else rows.astype(dtype)
+
+
+def stack_rows(blocks):
+    """Concatenate row blocks read from one store (float arrays or Int8Rows) into one matrix."""
+    if blocks and isinstance(blocks[0], Int8Rows):
+        return Int8Rows(np.concatenate([block.records for block in blocks]))
+    return np.vstack(blocks)
+
+
+def encode_rows(rows, precision):
+    """Rows as the array written to disk for a precision (int8 records are passed through untouched)."""
+    if isinstance(rows, Int8Rows):
+        if precision == "int8":
+            return rows.records
+        rows = rows.dequantize()
+    rows = np.atleast_2d(np.asarray(rows, dtype=DTYPE))
+    if precision == "int8":
+        records = np.empty(len(rows), dtype=int8_record(rows.shape[1]))
+        records["q"], records["scale"] = quantize_int8(rows)
+        return records
+    return np.ascontiguousarray(rows, dtype=precision)
+
+
+def decode_rows(encoded, precision):
+    """What readers score against: the float matrix itself, or Int8Rows around the records."""
+    return Int8Rows(encoded) if precision == "int8" else encoded
+
+
+def open_matrix(path, precision, rows, dim):
+    if precision == "int8":
+        return Int8Rows(np.memmap(path, dtype=int8_record(dim), mode="r", shape=(rows,)))
+    return np.memmap(path, dtype=precision, mode="r", shape=(rows, dim))
+
+
+# -------------------- READER --------------------
+class CompanyStore:
+    """
+    Immutable snapshot of one company's templates. Writers never modify a
+    published snapshot: they append rows and replace index.json, and readers
+    pick that up as a new CompanyStore, so scoring needs no lock.
+    """
+
+    def __init__(self, matrix, people, version, packed):
+        getattr(matrix, "records", matrix).flags.writeable = False
+        self.matrix = matrix
+        self.people = MappingProxyType(dict(people))
+        self.version = version
+        self.packed = packed
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    @property
+    def mobiles(self):
+        return self.people.keys()
+
+    def templates(self, mobile):
+        span = self.people.get(str(mobile))
+        if span is None:
+            return self.matrix[:0]
+        offset, count = span[0], span[1]
+        return self.matrix[offset:offset + count]
+
+    def summary(self, mobile):
+        """Centroid (first row) plus outlier templates; computed on the fly for older entries."""
+        span = self.people.get(str(mobile))
+        if span is None:
+            return self.matrix[:0]
+        offset, count = span[0], span[1]
+        summary_count = span[2] if len(span) > 2 else 0
+        if summary_count:
+            return self.matrix[offset + count:offset + count + summary_count]
+        return summarize_templates(np.asarray(self.matrix[offset:offset + count]))
+
+    def __contains__(self, mobile):
+        return str(mobile) in self.people
+
+    def __len__(self):
+        return len(self.people)
+
+
+def read_index(folder):
+    try:
+        with open(os.path.join(folder, INDEX_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def store_version(folder):
+    """Cheap change marker: index.json is replaced on every write."""
+    try:
+        return os.stat(os.path.join(folder, INDEX_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return _legacy_version(folder)
+
+
+def registered_mobiles(folder):
+    """
+    (version, frozenset of mobiles) for a company folder without touching the
+    matrix, or None if the folder does not exist.
+    """
+    try:
+        version = store_version(folder)
+    except FileNotFoundError:
+        return None
+    index = read_index(folder)
+    if index is not None:
+        return version, frozenset(index["people"])
+    return version, frozenset(mobile for mobile, _, _ in legacy_files(folder))
+
+
+def open_company(folder):
+    """Open a company folder for reading, or return None if it does not exist."""
+    if not os.path.isdir(folder):
+        return None
+
+    index_path = os.path.join(folder, INDEX_FILE)
+    try:
+        version = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return _open_legacy(folder)
+
+    for attempt in range(2):
+        index = read_index(folder)
+        rows, dim = index["rows"], index["dim"]
+        if rows == 0:
+            matrix = np.zeros((0, dim), dtype=DTYPE)
+            break
+        try:
+            matrix = open_matrix(os.path.join(folder, index["matrix"]), index.get("dtype", "float32"), rows, dim)
+            break
+        except FileNotFoundError:
+            # Compacted between reading the index and opening the matrix.
+            if attempt:
+                raise
+
+    people = {mobile: tuple(span) for mobile, span in index["people"].items()}
+    return CompanyStore(matrix, people, version, packed=True)
+
+
+# -------------------- LEGACY .npy LAYOUT --------------------
+def _parse_legacy_name(filename):
+    # {mobile}_{frame}.npy
+    stem = filename[:-len(".npy")]
+    mobile, _, frame = stem.rpartition("_")
+    if not mobile:
+        return None
+    try:
+        return mobile, int(frame)
+    except ValueError:
+        return mobile, 0
+
+
+def legacy_files(folder):
+    """Sorted (mobile, frame, filename) for every {mobile}_{frame}.npy in a folder."""
+    entries = []
+    for f in os.listdir(folder):
+        if not f.endswith(".npy"):
+            continue
+        parsed = _parse_legacy_name(f)
+        if parsed is not None:
+            entries.append((parsed[0], parsed[1], f))
+    entries.sort()
+    return entries
+
+
+def _legacy_version(folder):
+    # Re-registration overwrites {mobile}_{frame}.npy in place, which does not
+    # touch the directory mtime, so the newest file mtime is used instead.
+    latest = os.stat(folder).st_mtime_ns
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".npy"):
+                latest = max(latest, entry.stat().st_mtime_ns)
+    return latest
+
+
+def load_legacy(folder):
+    """Load a legacy folder as (matrix, people) with rows grouped by mobile."""
+    entries = legacy_files(folder)
+    vectors = [np.load(os.path.join(folder, f)).astype(DTYPE).ravel() for _, _, f in entries]
+    if vectors:
+        matrix = np.ascontiguousarray(normalize_rows(np.vstack(vectors)))
+    else:
+        matrix = np.zeros((0, 0), dtype=DTYPE)
+
+    people = {}
+    for row, (mobile, _, _) in enumerate(entries):
+        offset, count = people.get(mobile, (row, 0))
+        people[mobile] = (offset, count + 1)
+    return matrix, people
+
+
+def _open_legacy(folder):
+    version = _legacy_version(folder)
+    matrix, people = load_legacy(folder)
+    if len(matrix):
+        # Held in memory at the configured precision, like packed folders created now
+        precision = configured_precision()
+        matrix = decode_rows(encode_rows(matrix, precision), precision)
+    return CompanyStore(matrix, people, version, packed=False)
+
+
+# -------------------- WRITER --------------------
+@contextmanager
+def company_lock(folder):
+    """Exclusive cross-process lock for writers of one company folder."""
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_index(folder, index):
+    tmp_path = os.path.join(folder, f".{INDEX_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(folder, INDEX_FILE))
+
+
+def _append_rows(folder, index, rows):
+    """Append rows after index["rows"]; anything past it is a torn write and is dropped."""
+    path = os.path.join(folder, index["matrix"])
+    precision = index.get("dtype", "float32")
+    with open(path, "ab") as f:
+        f.truncate(index["rows"] * row_bytes(precision, index["dim"]))
+        f.write(encode_rows(rows, precision).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    offset = index["rows"]
+    index["rows"] += len(rows)
+    return offset
+
+
+def _load_or_import(folder, dim):
+    index = read_index(folder)
+    if index is not None:
+        return index
+
+    precision = configured_precision()
+    index = {"matrix": f"embeddings.{SUFFIXES[precision]}", "dim": dim, "rows": 0, "dtype": precision, "people": {}}
+    entries = legacy_files(folder)
+    if entries:
+        matrix, people = load_legacy(folder)
+        index["dim"] = matrix.shape[1]
+
+        blocks = []
+        offset = 0
+        for mobile, (start, count) in people.items():
+            block, summary_count = _with_summary(matrix[start:start + count])
+            blocks.append(block)
+            index["people"][mobile] = [offset, count, summary_count]
+            offset += len(block)
+        _append_rows(folder, index, np.vstack(blocks))
+    return index
+
+
+def write_person(folder, mobile, embeddings):
+    """
+    Store a person's templates, replacing any earlier registration.
+
+    The new rows are appended; the old ones stay in the file as garbage until
+    the folder is compacted with manage.py migrate_embeddings --compact.
+    """
+    rows = normalize_rows(embeddings)
+    with company_lock(folder):
+        index = _load_or_import(folder, rows.shape[1])
+        if index["rows"] == 0:
+            index["dim"] = rows.shape[1]
+        if index["dim"] != rows.shape[1]:
+            raise ValueError(f"Embedding size {rows.shape[1]} does not match store size {index['dim']}")
+        block, summary_count = _with_summary(rows)
+        offset = _append_rows(folder, index, block)
+        index["people"][str(mobile)] = [offset, len(rows), summary_count]
+        _write_index(folder, index)
+    return len(rows)
+
+
+def write_people(folder, people):
+    """
+    Store many people's templates ({mobile: embeddings}) with one append and
+    one index write; used for bulk loads and synthetic benchmark trees.
+    """
+    blocks, spans = [], {}
+    for mobile, embeddings in people.items():
+        rows = normalize_rows(embeddings)
+        block, summary_count = _with_summary(rows)
+        blocks.append(block)
+        spans[str(mobile)] = (len(rows), summary_count)
+    if not blocks:
+        return 0
+
+    dim = blocks[0].shape[1]
+    with company_lock(folder):
+        index = _load_or_import(folder, dim)
+        if index["rows"] == 0:
+            index["dim"] = dim
+        if index["dim"] != dim:
+            raise ValueError(f"Embedding size {dim} does not match store size {index['dim']}")
+        offset = _append_rows(folder, index, np.vstack(blocks))
+        for (mobile, (count, summary_count)), block in zip(spans.items(), blocks):
+            index["people"][mobile] = [offset, count, summary_count]
+            offset += len(block)
+        _write_index(folder, index)
+    return sum(count for count, _ in spans.values())
+
+
+def import_legacy(folder):
+    """Convert a legacy folder to the packed layout. Returns the number of people imported."""
+    with company_lock(folder):
+        if read_index(folder) is not None:
+            return 0
+        index = _load_or_import(folder, 0)
+        _write_index(folder, index)
+    return len(index["people"])
+
+
+def compact(folder):
+    """
+    Rewrite the matrix without rows that no longer belong to anyone, adding
+    summary rows to entries written before summaries existed, at the
+    current EMBEDDING_STORE_PRECISION.
+    """
+    with company_lock(folder):
+        index = read_index(folder)
+        if index is None:
+            return 0
+        store = open_company(folder)
+        people = sorted(index["people"].items(), key=lambda item: item[1][0])
+        live = [(store.templates(mobile), store.summary(mobile)) for mobile, _ in people]
+        dropped = index["rows"] - sum(len(t) + len(s) for t, s in live)
+
+        old_matrix = index["matrix"]
+        generation = int(old_matrix.split(".")[1]) + 1 if old_matrix.count(".") == 2 else 1
+        precision = configured_precision()
+        index["matrix"] = f"embeddings.{generation}.{SUFFIXES[precision]}"
+        index["dtype"] = precision
+
+        offset = 0
+        with open(os.path.join(folder, index["matrix"]), "wb") as f:
+            for (mobile, _), (templates, summary) in zip(people, live):
+                f.write(encode_rows(templates, precision).tobytes())
+                f.write(encode_rows(summary, precision).tobytes())
+                index["people"][mobile] = [offset, len(templates), len(summary)]
+                offset += len(templates) + len(summary)
+            f.flush()
+            os.fsync(f.fileno())
+        index["rows"] = offset
+        _write_index(folder, index)
+
+        # Readers already holding the old memmap keep the old inode alive.
+        if os.path.exists(os.path.join(folder, old_matrix)):
+            os.remove(os.path.join(folder, old_matrix))
+    return dropped
@@ -11,77 +11,242 @@
 #     embeddings_file = os.path.join(company_folder, f"{person_id}_{frame_index}.npy")
 #     np.save(embeddings_file, np.array(embeddings))
 
-# def validate_and_trim_video(video_path):
-#     cap = cv2.VideoCapture(video_path)
-#     fps = int(cap.get(cv2.CAP_PROP_FPS))
-#     # max_frames = fps * 5
-#     max_frames = 15
-#     frames = []
-#     frame_count = 0
-
-#     while cap.isOpened():
-#         ret, frame = cap.read()
-#         if not ret:
-#             break
-#         if frame_count < max_frames:
-#             frames.append(frame)
-#         else:
-#             break
-#         frame_count += 1
-
-#     cap.release()
-#     return True, frames
-
 
 import os
 import cv2
+import tempfile
 import numpy as np
+from collections import namedtuple
+from contextlib import contextmanager
 from django.conf import settings
+from recognise import ann_index, metrics
+from recognise.gallery import gallery
+from recognise.registration_index import registrations
+from recognise.inference import INPUT_SIZE, crop_face, downscale, embed_batch, get_face_detection
+from . import embedding_store
 
 EMBEDDINGS_DIR = os.path.join(settings.MEDIA_ROOT, 'embeddings')
 os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
 
-def save_user_embeddings(server_name, uniqueId, person_id, embeddings, frame_index):
+def save_user_embeddings(server_name, uniqueId, person_id, embeddings):
 
     """
-    Save embeddings under:
-    media/embeddings/{server_name}/company_{uniqueId}/person_frame.npy
+    Save all of a person's frame embeddings, replacing any earlier ones, in
+    the packed store under:
+    media/embeddings/{server_name}/company_{uniqueId}/
     """
 
     server_name = str(server_name).strip().lower()
 
-    # Create server-level folder
-    server_folder = os.path.join(EMBEDDINGS_DIR, server_name)
-    os.makedirs(server_folder, exist_ok=True)
+    company_folder = embedding_store.company_folder(server_name, uniqueId)
+    saved = embedding_store.write_person(company_folder, person_id, embeddings)
+
+    # Drop the cached matrix so the next verification in this process reloads it
+    gallery.invalidate(server_name, uniqueId)
+    registrations.add(server_name, uniqueId, person_id)
+
+    # Patch the identify index in place rather than rebuilding it
+    summary = embedding_store.summarize_templates(embedding_store.normalize_rows(embeddings))
+    ann_index.indexes.update_person(server_name, uniqueId, person_id, summary)
+    return saved
+
+# -------------------- STREAMING PIPELINE --------------------
+@contextmanager
+def uploaded_video_path(upload):
+    """
+    Yield a path cv2.VideoCapture can open for an uploaded video. Large uploads
+    already live in a temp file and are used in place; small in-memory ones
+    are written to a uniquely named temp file that is removed afterwards.
+    """
+    if hasattr(upload, "temporary_file_path"):
+        yield upload.temporary_file_path()
+        return
 
-    # Create company-level folder
-    company_folder = os.path.join(server_folder, f"company_{uniqueId}")
-    os.makedirs(company_folder, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".mp4")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+        yield path
+    finally:
+        os.remove(path)
 
-    embeddings_file = os.path.join(company_folder, f"{person_id}_{frame_index}.npy")
-    np.save(embeddings_file, np.array(embeddings))
 
-def validate_and_trim_video(video_path):
+def iter_video_frames(video_path, max_frames=None, sample_frames=None):
+    """
+    Decode and yield (frame_index, BGR frame) one at a time. With
+    sample_frames set, only about that many frames spread evenly over the
+    clip are decoded; the ones in between are grabbed and skipped.
+    """
     cap = cv2.VideoCapture(video_path)
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    # max_frames = fps * 5
-    max_frames = 15
-    frames = []
-    frame_count = 0
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        if frame_count < max_frames:
-            frames.append(frame)
-        else:
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        if max_frames is not None:
+            total = min(total, max_frames) if total else max_frames
+        stride = max(1, total // sample_frames) if sample_frames and total else 1
+
+        index = 0
+        while cap.isOpened() and (max_frames is None or index < max_frames):
+            if index % stride:
+                if not cap.grab():
+                    break
+            else:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield index, frame
+            index += 1
+    finally:
+        cap.release()
+
+
+# -------------------- FRAME QUALITY --------------------
+FaceCandidate = namedtuple("FaceCandidate", ["frame_index", "crop", "blur", "size", "confidence"])
+
+
+def blur_score(crop):
+    """Variance of the Laplacian at Facenet input scale; low values mean a blurry face."""
+    gray = cv2.cvtColor(cv2.resize(crop, INPUT_SIZE), cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def quality_scores(candidates):
+    """
+    Combine detector confidence, sharpness and face size into a 0..1 score per
+    candidate. Sharpness is relative to the sharpest face in the same clip,
+    since absolute Laplacian variance depends on camera and compression.
+    """
+    blur = np.array([c.blur for c in candidates], dtype=np.float32)
+    size = np.array([c.size for c in candidates], dtype=np.float32)
+    confidence = np.array([c.confidence for c in candidates], dtype=np.float32)
+    sharpness = blur / max(float(blur.max()), 1e-6)
+    return confidence * sharpness * np.minimum(1.0, size / INPUT_SIZE[0])
+
+
+def iter_face_candidates(frames, face_detection):
+    """
+    Run detection on a downscaled copy of each (frame_index, frame) as it
+    arrives and yield a FaceCandidate for the most confident face, if it is
+    large and sharp enough. Crops are cut from the full-resolution frame
+    (MediaPipe boxes are relative) and copied, so no frame outlives its own
+    iteration.
+    """
+    for index, frame in frames:
+        small = downscale(frame, settings.REGISTRATION_DETECT_MAX_SIDE)
+        result = face_detection.process(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        if not result.detections:
+            continue
+
+        det = max(result.detections, key=lambda d: d.score[0])
+        crop = crop_face(frame, det)
+        if crop is None or min(crop.shape[:2]) < settings.REGISTRATION_MIN_FACE_SIZE:
+            continue
+
+        blur = blur_score(crop)
+        if blur < settings.REGISTRATION_MIN_BLUR_VARIANCE:
+            continue
+
+        size = min(crop.shape[:2])
+        crop = downscale(crop, settings.REGISTRATION_CROP_MAX_SIDE)
+        if crop.base is not None:
+            crop = crop.copy()
+        yield FaceCandidate(index, crop, blur, size, float(det.score[0]))
+
+
+def collect_face_candidates(video_path, face_detection, max_faces=None):
+    """
+    Sample frames across the whole clip and stream them through detection
+    until max_faces usable faces are found. Returns (frames_read, candidates).
+    """
+    if max_faces is None:
+        max_faces = settings.REGISTRATION_MAX_FACES
+
+    frames_read = 0
+
+    def counted(frames):
+        nonlocal frames_read
+        for index, frame in frames:
+            frames_read += 1
+            yield index, frame
+
+    frames = iter_video_frames(
+        video_path,
+        max_frames=settings.REGISTRATION_MAX_SCAN_FRAMES,
+        sample_frames=settings.REGISTRATION_SAMPLE_FRAMES,
+    )
+
+    candidates = []
+    for candidate in iter_face_candidates(counted(frames), face_detection):
+        candidates.append(candidate)
+        if len(candidates) >= max_faces:
             break
-        frame_count += 1
+    return frames_read, candidates
+
+
+# -------------------- KEYFRAME SELECTION --------------------
+def select_diverse(embeddings, qualities, count=None):
+    """
+    Greedily pick up to count templates: start from the best-quality face,
+    then repeatedly add the one whose nearest already-picked template is
+    furthest away, weighted by its quality. Returns the chosen indices.
+    """
+    if count is None:
+        count = settings.REGISTRATION_TEMPLATE_COUNT
+
+    n = len(embeddings)
+    if n <= count:
+        return list(range(n))
+
+    vectors = embedding_store.normalize_rows(embeddings)
+    qualities = np.asarray(qualities, dtype=np.float32)
+
+    chosen = [int(np.argmax(qualities))]
+    nearest = 1.0 - vectors @ vectors[chosen[0]]
+    while len(chosen) < count:
+        gain = nearest * qualities
+        gain[chosen] = -1.0
+        pick = int(np.argmax(gain))
+        chosen.append(pick)
+        nearest = np.minimum(nearest, 1.0 - vectors @ vectors[pick])
+    return sorted(chosen)
+
 
-    cap.release()
+# -------------------- FULL PIPELINE --------------------
+class RegistrationError(Exception):
+    """The video cannot be registered (no frames or no usable faces); the message is shown to the user."""
 
-    if len(frames) == 0:
-        return False, []
-    
-    return True, frames
\ No newline at end of file
+
+def detect_registration_faces(video_path, face_detection=None):
+    """Collect usable face crops from a registration video, raising RegistrationError if there are none."""
+    if face_detection is None:
+        face_detection = get_face_detection()
+
+    frames_read, candidates = collect_face_candidates(video_path, face_detection)
+    metrics.trace(f"🎞 Scanned {frames_read} frames, kept {len(candidates)} face crops")
+
+    if frames_read == 0:
+        raise RegistrationError("No valid frames found in video")
+    if not candidates:
+        raise RegistrationError("No faces detected. Embeddings not generated.")
+    return frames_read, candidates
+
+
+def store_registration(server_name, uniqueId, person_id, candidates, embeddings):
+    """Keep a diverse, good-quality subset of one person's crop embeddings and save it. Returns the count saved."""
+    chosen = select_diverse(embeddings, quality_scores(candidates))
+    return save_user_embeddings(server_name, uniqueId, person_id, embeddings[chosen])
+
+
+def register_from_video(video_path, server_name, uniqueId, person_id, face_detection=None):
+    """
+    Detect faces across a registration video, embed every kept crop in one
+    batched forward pass, keep a diverse subset and store it in one write.
+    Returns (frames_read, faces_found, embeddings_saved).
+    """
+    with metrics.stage("register_detect"):
+        frames_read, candidates = detect_registration_faces(video_path, face_detection)
+    with metrics.stage("register_embed"):
+        embeddings = embed_batch([c.crop for c in candidates])
+    with metrics.stage("register_store"):
+        saved = store_registration(server_name, uniqueId, person_id, candidates, embeddings)
+    return frames_read, len(candidates), saved
@@ -0,0 +1,244 @@
+"""
+Registration job queue. The RegistrationJob table is the queue, so no broker
+is needed: the view saves the video and inserts a row, and a dispatcher thread
+claims queued rows and runs them on a small process pool. Pool processes run
+at a lower CPU priority (os.nice) with their own thread limits, so recognise
+requests in the web workers always win the CPU over onboarding bursts.
+
+By default (REGISTRATION_JOBS_IN_WEB=1) whichever web process takes a /form/
+post starts a dispatcher, so jobs run under runserver or a bare gunicorn too,
+but every gunicorn worker gets its own pool. Production runs exactly one
+dispatcher per deployment instead: `manage.py registration_worker`, which the
+Dockerfile starts next to gunicorn with REGISTRATION_JOBS_IN_WEB=0, so
+REGISTRATION_JOB_WORKERS is the real registration concurrency and the web
+workers never load a second TensorFlow runtime for it.
+"""
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def job_video_dir():
+    return os.path.join(settings.MEDIA_ROOT, "registration_jobs")
+
+
+# -------------------- ENQUEUE --------------------
+def create_job(upload, server_name, uniqueId, maid_id, maid_name, maid_mobile):
+    """Copy the uploaded video out of the request and queue a RegistrationJob for it."""
+    from .models import RegistrationJob
+
+    job_id = uuid.uuid4()
+    os.makedirs(job_video_dir(), exist_ok=True)
+    extension = os.path.splitext(getattr(upload, "name", "") or "")[1] or ".mp4"
+    video_path = os.path.join(job_video_dir(), f"{job_id}{extension}")
+    with open(video_path, "wb") as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+
+    job = RegistrationJob.objects.create(
+        job_id=job_id,
+        server_name=server_name,
+        unique_id=str(uniqueId),
+        maid_id=str(maid_id),
+        maid_name=maid_name or "",
+        maid_mobile=str(maid_mobile),
+        video_path=video_path,
+    )
+    if settings.REGISTRATION_JOBS_IN_WEB:
+        get_dispatcher().notify()
+    else:
+        warn_if_no_worker()
+    return job
+
+
+def warn_if_no_worker():
+    """Jobs only wait long in the queue if no registration_worker is taking them; say so."""
+    from .models import RegistrationJob
+
+    cutoff = timezone.now() - timedelta(seconds=settings.REGISTRATION_JOB_TIMEOUT_SECONDS)
+    waiting = RegistrationJob.objects.filter(status=RegistrationJob.QUEUED, created_at__lt=cutoff).count()
+    if waiting:
+        print(
+            f"❌ {waiting} registration job(s) queued for over {settings.REGISTRATION_JOB_TIMEOUT_SECONDS}s: "
+            "is `manage.py registration_worker` running? (or set REGISTRATION_JOBS_IN_WEB=1)"
+        )
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job to running; safe across processes. Returns its pk or None."""
+    from .models import RegistrationJob
+
+    queued = RegistrationJob.objects.filter(status=RegistrationJob.QUEUED).order_by("created_at")
+    for pk in queued.values_list("pk", flat=True)[:10]:
+        claimed = RegistrationJob.objects.filter(pk=pk, status=RegistrationJob.QUEUED).update(
+            status=RegistrationJob.RUNNING, started_at=timezone.now()
+        )
+        if claimed:
+            return pk
+    return None
+
+
+def fail_stale_jobs(timeout_seconds=None, error="Timed out"):
+    """
+    Jobs still running after timeout_seconds (default REGISTRATION_JOB_TIMEOUT_SECONDS)
+    lost their process; mark them failed. Returns how many were.
+    """
+    from .models import RegistrationJob
+
+    if timeout_seconds is None:
+        timeout_seconds = settings.REGISTRATION_JOB_TIMEOUT_SECONDS
+    cutoff = timezone.now() - timedelta(seconds=timeout_seconds)
+    return RegistrationJob.objects.filter(status=RegistrationJob.RUNNING, started_at__lt=cutoff).update(
+        status=RegistrationJob.FAILED, error=error, finished_at=timezone.now()
+    )
+
+
+# -------------------- POOL PROCESS SIDE --------------------
+def init_pool_process(nice, threads):
+    """Runs once in each pool process: lower its priority, cap its threads, set up Django."""
+    os.nice(nice)
+    for var in ("TF_NUM_INTRAOP_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ["MODEL_WARMUP_ON_START"] = "0"
+
+    import django
+
+    django.setup()
+
+
+def run_job(job_pk):
+    """Process one claimed job inside a pool process and record the outcome on its row."""
+    from .embeddings_gen import RegistrationError, register_from_video
+    from .models import RegistrationJob
+
+    job = RegistrationJob.objects.get(pk=job_pk)
+    print(f"🛠 Registration job {job.job_id} started for {job.maid_mobile} (company_{job.unique_id})")
+    try:
+        frames_read, faces_found, saved = register_from_video(
+            job.video_path, job.server_name, job.unique_id, job.maid_mobile
+        )
+    except RegistrationError as e:
+        finish_job(job_pk, RegistrationJob.FAILED, error=str(e))
+    except Exception as e:
+        print(f"❌ Registration job {job.job_id} failed:", e)
+        finish_job(job_pk, RegistrationJob.FAILED, error=str(e))
+    else:
+        finish_job(
+            job_pk, RegistrationJob.SUCCEEDED,
+            frames_read=frames_read, faces_found=faces_found, embeddings_saved=saved,
+        )
+        print(f"✅ Registration job {job.job_id} saved {saved} embeddings")
+    finally:
+        if os.path.exists(job.video_path):
+            os.remove(job.video_path)
+
+
+def requeue_job(job_pk):
+    from .models import RegistrationJob
+
+    RegistrationJob.objects.filter(pk=job_pk, status=RegistrationJob.RUNNING).update(
+        status=RegistrationJob.QUEUED, started_at=None
+    )
+
+
+def finish_job(job_pk, status, **fields):
+    from .models import RegistrationJob
+
+    RegistrationJob.objects.filter(pk=job_pk, status=RegistrationJob.RUNNING).update(
+        status=status, finished_at=timezone.now(), **fields
+    )
+
+
+# -------------------- DISPATCHER --------------------
+class JobDispatcher:
+    """
+    Background thread that keeps up to `workers` jobs running on a spawned
+    process pool (spawn, not fork: the parent may already hold a running
+    TensorFlow runtime). It wakes on notify() or every poll_seconds.
+    """
+
+    def __init__(self, workers, nice, threads, poll_seconds):
+        self.poll_seconds = poll_seconds
+        self._pool_args = dict(
+            max_workers=workers,
+            mp_context=get_context("spawn"),
+            initializer=init_pool_process,
+            initargs=(nice, threads),
+        )
+        self._pool = ProcessPoolExecutor(**self._pool_args)
+        self._slots = threading.Semaphore(workers)
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="registration-dispatcher", daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            try:
+                job_pk = claim_next_job()
+            except Exception as e:
+                print("❌ Registration dispatcher could not read the queue:", e)
+                job_pk = None
+
+            if job_pk is None:
+                self._slots.release()
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                try:
+                    fail_stale_jobs()
+                except Exception:
+                    pass
+                continue
+
+            try:
+                future = self._pool.submit(run_job, job_pk)
+            except BrokenProcessPool:
+                # A pool process died earlier; start a fresh pool and carry on
+                self._pool = ProcessPoolExecutor(**self._pool_args)
+                future = self._pool.submit(run_job, job_pk)
+            except RuntimeError:
+                # The interpreter is exiting and the pool has shut down; leave the job for the next worker
+                requeue_job(job_pk)
+                return
+            future.add_done_callback(lambda f, pk=job_pk: self._done(pk, f))
+
+    def _done(self, job_pk, future):
+        from .models import RegistrationJob
+
+        self._slots.release()
+        if future.exception() is not None:
+            # The pool process died (e.g. out of memory) before it could record anything
+            finish_job(job_pk, RegistrationJob.FAILED, error=f"Worker crashed: {future.exception()}")
+        self._wake.set()
+
+    def join(self):
+        self._thread.join()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = JobDispatcher(
+                    workers=settings.REGISTRATION_JOB_WORKERS,
+                    nice=settings.REGISTRATION_JOB_NICE,
+                    threads=settings.REGISTRATION_JOB_THREADS,
+                    poll_seconds=settings.REGISTRATION_JOB_POLL_SECONDS,
+                )
+    return _dispatcher
@@ -0,0 +1,83 @@
+import glob
+import os
+import tempfile
+import time
+
+import cv2
+import mediapipe as mp
+import numpy as np
+from deepface import DeepFace
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recognise.inference import MODEL_NAME, crop_face, embed_batch, get_model
+from register import embedding_store
+from register.management.commands.bench_register_memory import validate_and_trim_video
+
+
+def detections(face_detection, frames):
+    for frame in frames:
+        result = face_detection.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        for det in result.detections or []:
+            yield frame, det
+
+
+def register_per_crop(face_detection, frames, folder):
+    # Pre-batching pipeline: one DeepFace.represent and one np.save per crop
+    saved = 0
+    for frame, det in detections(face_detection, frames):
+        crop = crop_face(frame, det, align=False)
+        if crop is None:
+            continue
+        for emb in DeepFace.represent(crop, model_name=MODEL_NAME, enforce_detection=False):
+            saved += 1
+            np.save(os.path.join(folder, f"bench_{saved}.npy"), np.array(emb["embedding"]))
+    return saved
+
+
+def register_batched(face_detection, frames, folder):
+    crops = [crop_face(frame, det) for frame, det in detections(face_detection, frames)]
+    crops = [crop for crop in crops if crop is not None]
+    if not crops:
+        return 0
+    return embedding_store.write_person(folder, "bench", embed_batch(crops))
+
+
+class Command(BaseCommand):
+    help = "Time registration of the testing/*.mp4 clips with per-crop vs batched embedding."
+
+    def add_arguments(self, parser):
+        parser.add_argument("videos", nargs="*")
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        videos = options["videos"] or sorted(glob.glob(os.path.join(settings.BASE_DIR, "testing", "*.mp4")))
+        face_detection = mp.solutions.face_detection.FaceDetection(min_detection_confidence=0.8)
+
+        # Build the model and warm both paths outside the timings
+        get_model()
+        DeepFace.represent(np.zeros((160, 160, 3), np.uint8), model_name=MODEL_NAME, enforce_detection=False)
+        embed_batch([np.zeros((160, 160, 3), np.uint8)])
+
+        self.stdout.write(f"{'video':>16} {'faces':>6} {'per-crop ms':>12} {'batched ms':>11} {'speedup':>8}")
+        for video in videos:
+            valid, frames = validate_and_trim_video(video)
+            if not valid:
+                self.stderr.write(f"{video}: no frames")
+                continue
+
+            timings = {}
+            for name, fn in (("per-crop", register_per_crop), ("batched", register_batched)):
+                best = None
+                for _ in range(options["repeat"]):
+                    with tempfile.TemporaryDirectory() as folder:
+                        start = time.perf_counter()
+                        faces = fn(face_detection, frames, folder)
+                        elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[name] = best
+
+            self.stdout.write(
+                f"{os.path.basename(video):>16} {faces:>6} {timings['per-crop'] * 1000:>12.1f} "
+                f"{timings['batched'] * 1000:>11.1f} {timings['per-crop'] / timings['batched']:>7.1f}x"
+            )
@@ -0,0 +1,81 @@
+import glob
+import os
+import tracemalloc
+
+import cv2
+import mediapipe as mp
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recognise.inference import crop_face
+from register.embeddings_gen import collect_face_candidates
+
+
+def validate_and_trim_video(video_path):
+    # The pre-streaming reader: the first 15 full-resolution frames, all held in a list
+    cap = cv2.VideoCapture(video_path)
+    max_frames = 15
+    frames = []
+
+    while cap.isOpened() and len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+
+    cap.release()
+    return len(frames) > 0, frames
+
+
+def frame_list_pipeline(video_path, face_detection):
+    # Pre-streaming pipeline: keep every full-resolution frame, then detect
+    valid, frames = validate_and_trim_video(video_path)
+    crops = []
+    for frame in frames:
+        result = face_detection.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        for det in result.detections or []:
+            crop = crop_face(frame, det, align=False)
+            if crop is not None:
+                crops.append(crop)
+    return crops
+
+
+def streaming_pipeline(video_path, face_detection):
+    _, candidates = collect_face_candidates(video_path, face_detection)
+    return [c.crop for c in candidates]
+
+
+def peak_bytes(fn, *args):
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+class Command(BaseCommand):
+    help = (
+        "Peak Python-heap memory (numpy frame and crop buffers, via tracemalloc) of "
+        "the decode -> detect -> crop stage of registration, frame list vs streaming."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("videos", nargs="*")
+
+    def handle(self, *args, **options):
+        videos = options["videos"] or sorted(glob.glob(os.path.join(settings.BASE_DIR, "testing", "*.mp4")))
+        face_detection = mp.solutions.face_detection.FaceDetection(min_detection_confidence=0.8)
+
+        self.stdout.write(f"{'video':>16} {'frame list MiB':>15} {'streaming MiB':>14} {'crops':>6}")
+        for video in videos:
+            # Warm decoder and detector so one-off allocations are not counted
+            streaming_pipeline(video, face_detection)
+
+            legacy_peak, _ = peak_bytes(frame_list_pipeline, video, face_detection)
+            streaming_peak, crops = peak_bytes(streaming_pipeline, video, face_detection)
+            self.stdout.write(
+                f"{os.path.basename(video):>16} {legacy_peak / 2**20:>15.2f} "
+                f"{streaming_peak / 2**20:>14.2f} {len(crops):>6}"
+            )
@@ -0,0 +1,187 @@
+import csv
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from register.jobs import init_pool_process
+
+# Accepted manifest column names for each field
+COLUMNS = {
+    "server": ("server", "serverName", "server_name"),
+    "uniqueId": ("uniqueId", "unique_id", "company"),
+    "mobile": ("mobile", "maidMobile", "maid_mobile"),
+    "video": ("video", "video_path", "path"),
+}
+
+
+def read_manifest(path):
+    """Read a CSV (with a header row) or JSONL manifest into entries with server/uniqueId/mobile/video keys."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".json")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    for number, row in enumerate(rows, start=1):
+        entry = {}
+        for field, names in COLUMNS.items():
+            value = next((row[name] for name in names if row.get(name) not in (None, "")), None)
+            if value is None:
+                raise CommandError(f"{path} row {number}: missing {field} (one of {', '.join(names)})")
+            entry[field] = str(value).strip()
+        entry["server"] = entry["server"].lower()
+        entry["video"] = os.path.join(base, entry["video"])
+        entries.append(entry)
+    return entries
+
+
+def sample_manifest():
+    """One entry per testing/*.mp4, registered under server "smoke", company "smoke"."""
+    videos = sorted(glob.glob(os.path.join(settings.BASE_DIR, "testing", "*.mp4")))
+    return [
+        {"server": "smoke", "uniqueId": "smoke", "mobile": os.path.splitext(os.path.basename(v))[0], "video": v}
+        for v in videos
+    ]
+
+
+def entry_key(entry):
+    return "|".join((entry["server"], entry["uniqueId"], entry["mobile"], entry["video"]))
+
+
+# -------------------- POOL PROCESS SIDE --------------------
+def register_chunk(entries):
+    """
+    Register a few videos in one pool process: detect faces in each, embed the
+    crops of all of them in a single batch, then select and save per person.
+    Returns one result dict per entry; failures are reported, not raised.
+    """
+    from recognise.inference import embed_batch
+    from register.embeddings_gen import detect_registration_faces, store_registration
+
+    results, detected = [], []
+    for entry in entries:
+        try:
+            frames_read, candidates = detect_registration_faces(entry["video"])
+        except Exception as e:
+            results.append({"key": entry_key(entry), "ok": False, "error": str(e)})
+            continue
+        detected.append((entry, frames_read, candidates))
+
+    if not detected:
+        return results
+
+    try:
+        embeddings = embed_batch([c.crop for _, _, candidates in detected for c in candidates])
+    except Exception as e:
+        return results + [{"key": entry_key(entry), "ok": False, "error": str(e)} for entry, _, _ in detected]
+
+    offset = 0
+    for entry, frames_read, candidates in detected:
+        own = embeddings[offset:offset + len(candidates)]
+        offset += len(candidates)
+        try:
+            saved = store_registration(entry["server"], entry["uniqueId"], entry["mobile"], candidates, own)
+        except Exception as e:
+            results.append({"key": entry_key(entry), "ok": False, "error": str(e)})
+            continue
+        results.append({
+            "key": entry_key(entry), "ok": True,
+            "frames_read": frames_read, "faces_found": len(candidates), "embeddings_saved": saved,
+        })
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Register many enrollment videos from a CSV/JSONL manifest (server, uniqueId, mobile, video) "
+        "across a process pool, batching inference within each worker. Progress is checkpointed so an "
+        "interrupted run resumes where it stopped; use --samples for a smoke test on testing/*.mp4."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("manifest", nargs="?", help="CSV with a header row, or JSONL")
+        parser.add_argument("--samples", action="store_true", help="Register testing/*.mp4 instead of a manifest")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--chunk-size", type=int, default=4, help="Videos per batched inference call")
+        parser.add_argument("--threads", type=int, default=1, help="TensorFlow/BLAS threads per worker")
+        parser.add_argument("--nice", type=int, default=0)
+        parser.add_argument("--checkpoint", help="Default: <manifest>.checkpoint.jsonl")
+        parser.add_argument("--retry-failed", action="store_true", help="Also redo videos that failed last time")
+
+    def handle(self, *args, **options):
+        if options["samples"]:
+            entries = sample_manifest()
+            checkpoint = options["checkpoint"] or os.path.join(settings.MEDIA_ROOT, "bulk_register_samples.checkpoint.jsonl")
+        elif options["manifest"]:
+            entries = read_manifest(options["manifest"])
+            checkpoint = options["checkpoint"] or f"{options['manifest']}.checkpoint.jsonl"
+        else:
+            raise CommandError("Pass a manifest path or --samples")
+
+        done = self._load_checkpoint(checkpoint, options["retry_failed"])
+        todo = [e for e in entries if entry_key(e) not in done]
+        self.stdout.write(
+            f"{len(entries)} videos in manifest, {len(entries) - len(todo)} already done, {len(todo)} to register "
+            f"with {options['workers']} worker(s)"
+        )
+        if not todo:
+            return
+
+        chunks = [todo[i:i + options["chunk_size"]] for i in range(0, len(todo), options["chunk_size"])]
+        ok = failed = 0
+        start = time.perf_counter()
+        os.makedirs(os.path.dirname(os.path.abspath(checkpoint)), exist_ok=True)
+
+        with open(checkpoint, "a", encoding="utf-8") as log, ProcessPoolExecutor(
+            max_workers=options["workers"],
+            mp_context=get_context("spawn"),
+            initializer=init_pool_process,
+            initargs=(options["nice"], options["threads"]),
+        ) as pool:
+            futures = {pool.submit(register_chunk, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # The worker process died; its whole chunk is failed (redo with --retry-failed)
+                    results = [{"key": entry_key(entry), "ok": False, "error": f"Worker crashed: {e}"} for entry in futures[future]]
+
+                for result in results:
+                    log.write(json.dumps(result) + "\n")
+                    if result["ok"]:
+                        ok += 1
+                    else:
+                        failed += 1
+                        self.stderr.write(f"FAILED {result['key']}: {result['error']}")
+                log.flush()
+                os.fsync(log.fileno())
+                self.stdout.write(f"  {ok + failed}/{len(todo)} done ({failed} failed)")
+
+        minutes = (time.perf_counter() - start) / 60
+        self.stdout.write(
+            f"Registered {ok}, failed {failed} in {minutes * 60:.1f}s: "
+            f"{(ok + failed) / minutes:.1f} videos/min. Checkpoint: {checkpoint}"
+        )
+
+    def _load_checkpoint(self, path, retry_failed):
+        """Keys of videos finished in earlier runs (failures too, unless they are being retried)."""
+        done = set()
+        if not os.path.exists(path):
+            return done
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from an interrupted run
+                if result["ok"] or not retry_failed:
+                    done.add(result["key"])
+        return done
@@ -0,0 +1,76 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from recognise.gallery import gallery
+from register import embedding_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert media/embeddings/{server}/company_{uniqueId}/ folders from one "
+        "{mobile}_{frame}.npy file per frame to the packed embeddings.f32 + index.json store."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--server", help="Only migrate this server's companies.")
+        parser.add_argument("--delete-npy", action="store_true", help="Remove the .npy files once a company is packed.")
+        parser.add_argument(
+            "--compact", action="store_true",
+            help=(
+                "Also drop rows left behind by re-registrations, add missing centroid/outlier summary rows "
+                "and convert the matrix to EMBEDDING_STORE_PRECISION."
+            ),
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        root = embedding_store.embeddings_root()
+        if not os.path.isdir(root):
+            self.stdout.write(f"No embeddings directory at {root}")
+            return
+
+        servers = [options["server"].strip().lower()] if options["server"] else sorted(os.listdir(root))
+        totals = {"companies": 0, "people": 0, "files": 0}
+
+        for server in servers:
+            server_folder = os.path.join(root, server)
+            if not os.path.isdir(server_folder):
+                continue
+            for company in sorted(os.listdir(server_folder)):
+                folder = os.path.join(server_folder, company)
+                if not company.startswith("company_") or not os.path.isdir(folder):
+                    continue
+                self._migrate_company(server, company, folder, options, totals)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Packed {totals['people']} people from {totals['files']} .npy files "
+            f"in {totals['companies']} companies."
+        ))
+
+    def _migrate_company(self, server, company, folder, options, totals):
+        files = embedding_store.legacy_files(folder)
+        packed = embedding_store.read_index(folder) is not None
+
+        if options["dry_run"]:
+            state = "packed" if packed else "legacy"
+            self.stdout.write(f"{server}/{company}: {state}, {len(files)} .npy files")
+            return
+
+        if files and not packed:
+            people = embedding_store.import_legacy(folder)
+            totals["companies"] += 1
+            totals["people"] += people
+            totals["files"] += len(files)
+            self.stdout.write(f"{server}/{company}: packed {people} people from {len(files)} files")
+
+        if options["compact"]:
+            dropped = embedding_store.compact(folder)
+            if dropped > 0:
+                self.stdout.write(f"{server}/{company}: compacted away {dropped} stale rows")
+
+        if options["delete_npy"] and embedding_store.read_index(folder) is not None:
+            for _, _, f in files:
+                os.remove(os.path.join(folder, f))
+
+        gallery.invalidate(server, company[len("company_"):])
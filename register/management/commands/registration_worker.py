@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from register.jobs import JobDispatcher, fail_stale_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Process queued registration jobs outside the web workers. Run exactly one of "
+        "these per deployment (the Dockerfile does) and set REGISTRATION_JOBS_IN_WEB=0 for "
+        "the web processes, so they only enqueue. Jobs queued while it was down are picked up on start."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=settings.REGISTRATION_JOB_WORKERS)
+        parser.add_argument("--nice", type=int, default=settings.REGISTRATION_JOB_NICE)
+        parser.add_argument("--threads", type=int, default=settings.REGISTRATION_JOB_THREADS)
+        parser.add_argument("--poll-seconds", type=float, default=settings.REGISTRATION_JOB_POLL_SECONDS)
+        parser.add_argument(
+            "--keep-running", action="store_true",
+            help="Leave jobs marked running alone on start (another worker may still own them)",
+        )
+
+    def handle(self, *args, **options):
+        if not options["keep_running"]:
+            # As the only dispatcher, anything still marked running died with the previous worker
+            orphaned = fail_stale_jobs(0, error="Worker restarted")
+            if orphaned:
+                self.stdout.write(f"Marked {orphaned} job(s) left running by the previous worker as failed")
+        self.stdout.write(
+            f"Registration worker: {options['concurrency']} process(es), nice +{options['nice']}, "
+            f"{options['threads']} thread(s) each, polling every {options['poll_seconds']}s"
+        )
+        dispatcher = JobDispatcher(
+            workers=options["concurrency"],
+            nice=options["nice"],
+            threads=options["threads"],
+            poll_seconds=options["poll_seconds"],
+        )
+        try:
+            dispatcher.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping; jobs already running finish first.")
@@ -0,0 +1,133 @@
+import glob
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from recognise import matcher
+from register import embedding_store
+
+
+def clip_people(clips, templates):
+    """
+    Enrollment templates and held-out probes from each testing clip: every
+    other face crop is a probe, the rest are enrollment candidates from which
+    `templates` evenly spaced ones are kept.
+    """
+    from recognise.inference import embed_batch
+    from register.embeddings_gen import detect_registration_faces
+
+    enrolled, probes = {}, []
+    for clip in clips:
+        mobile = os.path.splitext(os.path.basename(clip))[0]
+        _, candidates = detect_registration_faces(clip)
+        embeddings = embedding_store.normalize_rows(embed_batch([c.crop for c in candidates]))
+        pool, held_out = embeddings[0::2], embeddings[1::2]
+        keep = np.linspace(0, len(pool) - 1, min(templates, len(pool))).round().astype(int)
+        enrolled[mobile] = pool[keep]
+        probes.extend((mobile, probe) for probe in held_out)
+    return enrolled, probes
+
+
+def synthetic_people(count, templates, probes_per_person, dim, rng):
+    enrolled, probes = {}, []
+    for n in range(count):
+        identity = rng.normal(size=dim)
+        mobile = f"synthetic{n}"
+        enrolled[mobile] = embedding_store.normalize_rows(identity + 1.1 * rng.normal(size=(templates, dim)))
+        for probe in embedding_store.normalize_rows(identity + 1.1 * rng.normal(size=(probes_per_person, dim))):
+            probes.append((mobile, probe))
+    return enrolled, probes
+
+
+def evaluate(store, probes, mobiles, impostors, rng):
+    """{mode: (scores, decisions, genuine mask)} for each probe against its own and `impostors` other people."""
+    pairs = []
+    for true_mobile, probe in probes:
+        others = [m for m in mobiles if m != true_mobile]
+        sampled = rng.choice(others, size=min(impostors, len(others)), replace=False) if others else []
+        pairs.extend([(probe, true_mobile, True)] + [(probe, m, False) for m in sampled])
+
+    results = {}
+    for mode in matcher.MODES:
+        scores, decisions = [], []
+        for probe, mobile, _ in pairs:
+            verified, score = matcher.verify_user(probe, store, mobile, mode=mode)
+            scores.append(score)
+            decisions.append(verified)
+        results[mode] = (np.array(scores), np.array(decisions), np.array([g for _, _, g in pairs]))
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare EMBEDDING_STORE_PRECISION settings (float32, float16, int8): disk and gallery "
+        "bytes per template, and verification accuracy on held-out probes (frames of the "
+        "testing/*.mp4 clips that were not enrolled, plus optional synthetic people) for each "
+        "match mode, including how often each decision differs from float32."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--precisions", nargs="+", choices=embedding_store.PRECISIONS, default=list(embedding_store.PRECISIONS))
+        parser.add_argument("--no-clips", action="store_true", help="Skip the testing clips (no model needed)")
+        parser.add_argument("--synthetic", type=int, default=200, help="Synthetic people added to the held-out set")
+        parser.add_argument("--impostors", type=int, default=20, help="Other people each probe is checked against")
+        parser.add_argument("--project-people", type=int, default=100000, help="Gallery size for the memory projection")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        templates = settings.REGISTRATION_TEMPLATE_COUNT
+        enrolled, probes = {}, []
+        if not options["no_clips"]:
+            clips = sorted(glob.glob(os.path.join(settings.BASE_DIR, "testing", "*.mp4")))
+            enrolled, probes = clip_people(clips, templates)
+            self.stdout.write(f"Clips: {len(enrolled)} people, {len(probes)} held-out probe frames")
+        if options["synthetic"]:
+            rng = np.random.default_rng(options["seed"])
+            people, synthetic_probes = synthetic_people(options["synthetic"], templates, 3, 128, rng)
+            enrolled.update(people)
+            probes.extend(synthetic_probes)
+            self.stdout.write(f"Synthetic: {len(people)} people, {len(synthetic_probes)} probes")
+
+        reports = {}
+        for precision in options["precisions"]:
+            with tempfile.TemporaryDirectory() as folder, override_settings(EMBEDDING_STORE_PRECISION=precision):
+                embedding_store.write_people(folder, enrolled)
+                store = embedding_store.open_company(folder)
+                index = embedding_store.read_index(folder)
+                disk = os.path.getsize(os.path.join(folder, index["matrix"]))
+                results = evaluate(store, probes, list(enrolled), options["impostors"], np.random.default_rng(options["seed"]))
+                reports[precision] = (disk, store.nbytes, index["rows"], results)
+
+        self.stdout.write(
+            f"\n{'precision':>9} {'bytes/row':>10} {'disk KB':>9} {'gallery KB':>11} {'saved':>7} "
+            f"{'GB @ ' + str(options['project_people']) + ' people':>20}"
+        )
+        baseline_disk = reports.get("float32", next(iter(reports.values())))[0]
+        for precision, (disk, nbytes, rows, _) in reports.items():
+            per_row = embedding_store.row_bytes(precision, 128)
+            projected = per_row * rows / max(len(enrolled), 1) * options["project_people"] / 1024 ** 3
+            self.stdout.write(
+                f"{precision:>9} {per_row:>10} {disk / 1024:>9.1f} {nbytes / 1024:>11.1f} "
+                f"{1 - disk / baseline_disk:>7.0%} {projected:>20.3f}"
+            )
+
+        baseline = reports.get("float32")
+        self.stdout.write(
+            f"\n{'mode':>14} {'precision':>9} {'TAR':>7} {'FAR':>7} {'agree w/ f32':>13} {'max |d score|':>14}"
+        )
+        for mode in matcher.MODES:
+            for precision, (_, _, _, results) in reports.items():
+                scores, decisions, genuine = results[mode]
+                tar = float(np.mean(decisions[genuine])) if genuine.any() else 0.0
+                far = float(np.mean(decisions[~genuine])) if (~genuine).any() else 0.0
+                if baseline is not None:
+                    base_scores, base_decisions, _ = baseline[3][mode]
+                    agree = f"{np.mean(decisions == base_decisions):.2%}"
+                    delta = f"{np.max(np.abs(scores - base_scores)):.5f}"
+                else:
+                    agree = delta = "-"
+                self.stdout.write(f"{mode:>14} {precision:>9} {tar:>7.3f} {far:>7.3f} {agree:>13} {delta:>14}")
@@ -0,0 +1,34 @@
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="RegistrationJob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("job_id", models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ("status", models.CharField(choices=[("queued", "Queued"), ("running", "Running"), ("succeeded", "Succeeded"), ("failed", "Failed")], db_index=True, default="queued", max_length=16)),
+                ("server_name", models.CharField(max_length=255)),
+                ("unique_id", models.CharField(max_length=64)),
+                ("maid_id", models.CharField(max_length=64)),
+                ("maid_name", models.CharField(blank=True, max_length=255)),
+                ("maid_mobile", models.CharField(max_length=32)),
+                ("video_path", models.CharField(max_length=1024)),
+                ("frames_read", models.IntegerField(blank=True, null=True)),
+                ("faces_found", models.IntegerField(blank=True, null=True)),
+                ("embeddings_saved", models.IntegerField(blank=True, null=True)),
+                ("error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -1,3 +1,50 @@
+import uuid
+
 from django.db import models
 
 # Create your models here.
+
+
+class RegistrationJob(models.Model):
+    """A registration video waiting for, or processed by, the background job pool (register.jobs)."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (SUCCEEDED, "Succeeded"), (FAILED, "Failed")]
+
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+
+    server_name = models.CharField(max_length=255)
+    unique_id = models.CharField(max_length=64)
+    maid_id = models.CharField(max_length=64)
+    maid_name = models.CharField(max_length=255, blank=True)
+    maid_mobile = models.CharField(max_length=32)
+    video_path = models.CharField(max_length=1024)
+
+    frames_read = models.IntegerField(null=True, blank=True)
+    faces_found = models.IntegerField(null=True, blank=True)
+    embeddings_saved = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def as_dict(self):
+        return {
+            "job_id": str(self.job_id),
+            "status": self.status,
+            "maid_id": self.maid_id,
+            "uniqueId": self.unique_id,
+            "serverName": self.server_name,
+            "frames_read": self.frames_read,
+            "faces_found": self.faces_found,
+            "embeddings_saved": self.embeddings_saved,
+            "error": self.error or None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
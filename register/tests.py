@@ -1,3 +1,352 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import timedelta
+from multiprocessing import get_context
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from register import embedding_store, jobs
+from register.apps import check_registration_worker
+from register.embeddings_gen import RegistrationError
+from register.models import RegistrationJob
+
+
+def people(rng, count, frames=5, dim=128):
+    return {f"9{n:09d}": rng.normal(size=(frames, dim)) for n in range(count)}
+
+
+class EmbeddingStoreTests(SimpleTestCase):
+    """The packed company folder: appends, re-registration, compaction, legacy folders and torn writes."""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media, EMBEDDING_STORE_PRECISION="float32")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.folder = embedding_store.company_folder("Server", "42")
+        self.rng = np.random.default_rng(0)
+
+    def assertTemplates(self, store, mobile, embeddings, atol=1e-6):
+        np.testing.assert_allclose(
+            np.asarray(store.templates(mobile)), embedding_store.normalize_rows(embeddings), atol=atol
+        )
+
+    def matrix_path(self):
+        return os.path.join(self.folder, embedding_store.read_index(self.folder)["matrix"])
+
+    # -------------------- APPEND / RE-REGISTER --------------------
+    def test_append_and_reregister(self):
+        first = people(self.rng, 3)
+        for mobile, embeddings in first.items():
+            embedding_store.write_person(self.folder, mobile, embeddings)
+        mobile = next(iter(first))
+        replacement = self.rng.normal(size=(4, 128))
+        embedding_store.write_person(self.folder, mobile, replacement)
+
+        store = embedding_store.open_company(self.folder)
+        self.assertTrue(store.packed)
+        self.assertEqual(set(store.mobiles), set(first))
+        self.assertTemplates(store, mobile, replacement)
+        for other, embeddings in list(first.items())[1:]:
+            self.assertTemplates(store, other, embeddings)
+
+        summary = np.asarray(store.summary(mobile))
+        centroid = embedding_store.normalize_rows(embedding_store.normalize_rows(replacement).mean(axis=0))[0]
+        np.testing.assert_allclose(summary[0], centroid, atol=1e-6)
+        # The replaced rows stay in the matrix as garbage until compaction
+        live = sum(len(store.templates(m)) + len(store.summary(m)) for m in store.mobiles)
+        self.assertGreater(embedding_store.read_index(self.folder)["rows"], live)
+
+    def test_write_people_matches_write_person(self):
+        group = people(self.rng, 4)
+        embedding_store.write_people(self.folder, group)
+        store = embedding_store.open_company(self.folder)
+        for mobile, embeddings in group.items():
+            self.assertTemplates(store, mobile, embeddings)
+
+    def test_dimension_mismatch_is_rejected(self):
+        embedding_store.write_person(self.folder, "1", self.rng.normal(size=(3, 128)))
+        with self.assertRaises(ValueError):
+            embedding_store.write_person(self.folder, "2", self.rng.normal(size=(3, 64)))
+
+    # -------------------- COMPACTION --------------------
+    def test_compact_drops_garbage_and_changes_precision(self):
+        group = people(self.rng, 3)
+        embedding_store.write_people(self.folder, group)
+        mobile = next(iter(group))
+        _, count, summary_count = embedding_store.read_index(self.folder)["people"][mobile]
+        group[mobile] = self.rng.normal(size=(5, 128))
+        embedding_store.write_person(self.folder, mobile, group[mobile])
+        old_matrix = self.matrix_path()
+
+        with override_settings(EMBEDDING_STORE_PRECISION="int8"):
+            dropped = embedding_store.compact(self.folder)
+
+        self.assertEqual(dropped, count + summary_count)  # the replaced templates and their summary rows
+        index = embedding_store.read_index(self.folder)
+        self.assertEqual(index["dtype"], "int8")
+        self.assertEqual(index["matrix"], "embeddings.1.i8")
+        self.assertFalse(os.path.exists(old_matrix))
+        self.assertEqual(os.path.getsize(self.matrix_path()), index["rows"] * embedding_store.row_bytes("int8", 128))
+
+        store = embedding_store.open_company(self.folder)
+        self.assertIsInstance(store.matrix, embedding_store.Int8Rows)
+        for mobile, embeddings in group.items():
+            self.assertTemplates(store, mobile, embeddings, atol=0.01)
+
+        # A compacted int8 folder keeps its precision for later writes whatever the setting
+        embedding_store.write_person(self.folder, "new", self.rng.normal(size=(3, 128)))
+        self.assertEqual(embedding_store.read_index(self.folder)["dtype"], "int8")
+        with override_settings(EMBEDDING_STORE_PRECISION="float16"):
+            embedding_store.compact(self.folder)
+        self.assertEqual(embedding_store.read_index(self.folder)["matrix"], "embeddings.2.f16")
+        self.assertEqual(embedding_store.open_company(self.folder).matrix.dtype, np.float16)
+
+    # -------------------- LEGACY .npy FOLDERS --------------------
+    def write_legacy(self, group):
+        os.makedirs(self.folder, exist_ok=True)
+        for mobile, embeddings in group.items():
+            for frame, row in enumerate(embeddings):
+                np.save(os.path.join(self.folder, f"{mobile}_{frame}.npy"), row.astype(np.float32))
+
+    def test_reads_legacy_npy_folder(self):
+        group = people(self.rng, 3, frames=4)
+        self.write_legacy(group)
+
+        store = embedding_store.open_company(self.folder)
+        self.assertFalse(store.packed)
+        self.assertEqual(set(store.mobiles), set(group))
+        for mobile, embeddings in group.items():
+            self.assertTemplates(store, mobile, embeddings)
+        self.assertEqual(embedding_store.registered_mobiles(self.folder)[1], frozenset(group))
+
+        # The first write imports the legacy rows into the packed layout
+        embedding_store.write_person(self.folder, "new", self.rng.normal(size=(3, 128)))
+        store = embedding_store.open_company(self.folder)
+        self.assertTrue(store.packed)
+        self.assertEqual(set(store.mobiles), set(group) | {"new"})
+        for mobile, embeddings in group.items():
+            self.assertTemplates(store, mobile, embeddings)
+
+    def test_missing_folder(self):
+        self.assertIsNone(embedding_store.open_company(self.folder))
+        self.assertIsNone(embedding_store.registered_mobiles(self.folder))
+
+    # -------------------- TORN APPENDS --------------------
+    def test_torn_append_is_ignored_then_truncated(self):
+        group = people(self.rng, 2)
+        embedding_store.write_people(self.folder, group)
+        rows = embedding_store.read_index(self.folder)["rows"]
+        # A writer that died after appending rows (and half a row) but before replacing index.json
+        with open(self.matrix_path(), "ab") as f:
+            f.write(np.ones((3, 128), dtype=np.float32).tobytes() + b"\x01" * 100)
+
+        store = embedding_store.open_company(self.folder)
+        self.assertEqual(len(store.matrix), rows)
+        for mobile, embeddings in group.items():
+            self.assertTemplates(store, mobile, embeddings)
+
+        new = self.rng.normal(size=(3, 128))
+        embedding_store.write_person(self.folder, "new", new)
+        index = embedding_store.read_index(self.folder)
+        self.assertEqual(index["people"]["new"][0], rows)
+        self.assertEqual(os.path.getsize(self.matrix_path()), index["rows"] * embedding_store.row_bytes("float32", 128))
+        store = embedding_store.open_company(self.folder)
+        self.assertTemplates(store, "new", new)
+        for mobile, embeddings in group.items():
+            self.assertTemplates(store, mobile, embeddings)
+
+    def test_stale_temp_index_is_not_read(self):
+        embedding_store.write_person(self.folder, "1", self.rng.normal(size=(3, 128)))
+        # A writer that died while writing the new index leaves only its temp file behind
+        with open(os.path.join(self.folder, f".{embedding_store.INDEX_FILE}.1234.tmp"), "w") as f:
+            f.write('{"rows": ')
+        self.assertEqual(set(embedding_store.open_company(self.folder).mobiles), {"1"})
+
+
+# -------------------- REGISTRATION JOBS --------------------
+class JobTestMixin:
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        # No dispatcher in the test process: the tests drive the queue themselves
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media, REGISTRATION_ASYNC=True, REGISTRATION_JOBS_IN_WEB=False, REQUEST_PRINTS=False
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def enqueue(self, mobile="9000000001", content=b"not really a video"):
+        upload = SimpleUploadedFile("clip.mp4", content, content_type="video/mp4")
+        return jobs.create_job(upload, "server", "42", "7", "Asha", mobile)
+
+
+class RegistrationJobTests(JobTestMixin, TestCase):
+    """/form/ queueing, status polling, claiming, requeueing and running registration jobs."""
+
+    def post_form(self, **extra):
+        self.enterContext(self.assertLogs("facerecog.requests", "INFO"))
+        payload = {"data": [{"id": 7, "uniqueId": 42, "maidName": "Asha", "maidMobile": "9000000001"}]}
+        return self.client.post("/form/", {
+            "serverName": "Server",
+            "data": json.dumps(payload),
+            "maid_video": SimpleUploadedFile("clip.mp4", b"video bytes", content_type="video/mp4"),
+            **extra,
+        })
+
+    # -------------------- ENQUEUE / POLL --------------------
+    def test_form_enqueues_a_job(self):
+        response = self.post_form()
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        self.assertEqual(body["status"], RegistrationJob.QUEUED)
+        self.assertEqual(body["status_url"], f"/form/status/{body['job_id']}/")
+        self.assertNotIn("embeddings_saved", body)
+
+        job = RegistrationJob.objects.get(job_id=body["job_id"])
+        self.assertEqual((job.server_name, job.unique_id, job.maid_mobile), ("server", "42", "9000000001"))
+        self.assertTrue(job.video_path.startswith(jobs.job_video_dir()))
+        with open(job.video_path, "rb") as f:
+            self.assertEqual(f.read(), b"video bytes")
+
+    def test_status_polling(self):
+        job = self.enqueue()
+        status_url = f"/form/status/{job.job_id}/"
+        body = self.client.get(status_url).json()
+        self.assertEqual((body["status"], body["embeddings_saved"], body["error"]), ("queued", None, None))
+
+        pk = jobs.claim_next_job()
+        self.assertEqual(self.client.get(status_url).json()["status"], "running")
+        jobs.finish_job(pk, RegistrationJob.SUCCEEDED, frames_read=30, faces_found=12, embeddings_saved=5)
+        body = self.client.get(status_url).json()
+        self.assertEqual((body["status"], body["embeddings_saved"]), ("succeeded", 5))
+        self.assertIsNotNone(body["finished_at"])
+
+        self.assertEqual(self.client.get(f"/form/status/{uuid.uuid4()}/").status_code, 404)
+
+    def test_without_worker_waiting_jobs_are_reported(self):
+        old = self.enqueue()
+        cutoff = timezone.now() - timedelta(seconds=2 * jobs.settings.REGISTRATION_JOB_TIMEOUT_SECONDS)
+        RegistrationJob.objects.filter(pk=old.pk).update(created_at=cutoff)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.enqueue("9000000002")
+        self.assertIn("registration_worker", output.getvalue())
+        self.assertEqual([w.id for w in check_registration_worker(None)], ["register.W001"])
+        with override_settings(REGISTRATION_JOBS_IN_WEB=True):
+            self.assertEqual(check_registration_worker(None), [])
+
+    # -------------------- CLAIM / REQUEUE --------------------
+    def test_claims_oldest_first_and_only_once(self):
+        first, second = self.enqueue("1"), self.enqueue("2")
+        self.assertEqual(jobs.claim_next_job(), first.pk)
+        self.assertEqual(jobs.claim_next_job(), second.pk)
+        self.assertIsNone(jobs.claim_next_job())
+        first.refresh_from_db()
+        self.assertEqual(first.status, RegistrationJob.RUNNING)
+        self.assertIsNotNone(first.started_at)
+
+    def test_requeue_and_stale_jobs(self):
+        job = self.enqueue()
+        jobs.requeue_job(jobs.claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.started_at), (RegistrationJob.QUEUED, None))
+
+        pk = jobs.claim_next_job()
+        self.assertEqual(jobs.fail_stale_jobs(), 0)  # still inside REGISTRATION_JOB_TIMEOUT_SECONDS
+        self.assertEqual(jobs.fail_stale_jobs(0, error="Worker restarted"), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (RegistrationJob.FAILED, "Worker restarted"))
+        # A late result from the lost process does not overwrite the failure
+        jobs.finish_job(pk, RegistrationJob.SUCCEEDED, embeddings_saved=5)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.embeddings_saved), (RegistrationJob.FAILED, None))
+
+    def test_dispatcher_requeues_when_the_pool_has_shut_down(self):
+        job = self.enqueue()
+        pool = ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"))
+        pool.shutdown()
+        # The dispatcher loop, run in this thread, as it is when the interpreter exits
+        dispatcher = jobs.JobDispatcher.__new__(jobs.JobDispatcher)
+        dispatcher.poll_seconds = 0
+        dispatcher._pool = pool
+        dispatcher._slots = threading.Semaphore(1)
+        dispatcher._wake = threading.Event()
+        dispatcher._run()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.started_at), (RegistrationJob.QUEUED, None))
+
+    # -------------------- RUN --------------------
+    def run_claimed(self, **patch):
+        job = self.enqueue()
+        self.assertTrue(os.path.exists(job.video_path))
+        with mock.patch("register.embeddings_gen.register_from_video", **patch) as register, \
+                redirect_stdout(io.StringIO()):
+            jobs.run_job(jobs.claim_next_job())
+        register.assert_called_once_with(job.video_path, "server", "42", "9000000001")
+        self.assertFalse(os.path.exists(job.video_path))
+        job.refresh_from_db()
+        return job
+
+    def test_run_job_success_removes_video(self):
+        job = self.run_claimed(return_value=(30, 12, 5))
+        self.assertEqual(job.status, RegistrationJob.SUCCEEDED)
+        self.assertEqual((job.frames_read, job.faces_found, job.embeddings_saved), (30, 12, 5))
+
+    def test_run_job_failure_removes_video(self):
+        job = self.run_claimed(side_effect=RegistrationError("No face detected in the video"))
+        self.assertEqual((job.status, job.error), (RegistrationJob.FAILED, "No face detected in the video"))
+        job = self.run_claimed(side_effect=MemoryError("out of memory"))
+        self.assertEqual((job.status, job.error), (RegistrationJob.FAILED, "out of memory"))
+
+    def test_worker_command_fails_orphaned_jobs(self):
+        job = self.enqueue()
+        jobs.claim_next_job()
+        with mock.patch("register.management.commands.registration_worker.JobDispatcher") as dispatcher:
+            call_command("registration_worker", concurrency=2, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (RegistrationJob.FAILED, "Worker restarted"))
+        self.assertEqual(dispatcher.call_args.kwargs["workers"], 2)
+        dispatcher.return_value.join.assert_called_once_with()
+
+
+class RegistrationJobClaimRaceTests(JobTestMixin, TransactionTestCase):
+    """Dispatchers polling the same queue at once never claim one job twice."""
+
+    def test_concurrent_claims(self):
+        queued = {self.enqueue(str(n)).pk for n in range(20)}
+        claimed, errors = [], []
+
+        def claim_all():
+            try:
+                while (pk := jobs.claim_next_job()) is not None:
+                    claimed.append(pk)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim_all) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(claimed), sorted(queued))
+        self.assertEqual(RegistrationJob.objects.filter(status=RegistrationJob.RUNNING).count(), len(queued))
@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import GenerateUserEmbeddingsViewForm
+from recognise.metrics import instrumented
+from .views import GenerateUserEmbeddingsViewForm, RegistrationJobStatusView
 
 urlpatterns = [
-    path('form/', GenerateUserEmbeddingsViewForm.as_view()),
+    path('form/', instrumented("register", GenerateUserEmbeddingsViewForm.as_view())),
+    path('form/status/<uuid:job_id>/', RegistrationJobStatusView.as_view()),
 ]
\ No newline at end of file
@@ -136,14 +136,12 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from django.conf import settings
-import os, cv2, tempfile, numpy as np, json, requests
-from deepface import DeepFace
-import mediapipe as mp
+import os, json, requests
 from django.shortcuts import render
-from .embeddings_gen import save_user_embeddings, validate_and_trim_video
-
-# Initialize Mediapipe
-face_detection = mp.solutions.face_detection.FaceDetection(min_detection_confidence=0.8)
+from recognise import metrics
+from recognise.metrics import trace
+from . import jobs
+from .models import RegistrationJob
 
 # Ensure embeddings directory exists
 EMBEDDINGS_DIR = os.path.join(settings.MEDIA_ROOT, 'embeddings')
@@ -158,7 +156,7 @@ class GenerateUserEmbeddingsViewForm(APIView):
 
 
     def post(self, request):
-        print("📩 Incoming request keys:", request.data.keys())
+        trace("📩 Incoming request keys:", request.data.keys())
 
         try:
             # 1️⃣ Extract the maid info JSON
@@ -183,7 +181,7 @@ class GenerateUserEmbeddingsViewForm(APIView):
                 return Response({"error": "Invalid JSON structure"}, status=400)
 
             maid_info = data_json['data'][0]  # first record only
-            print("✅ Maid Info:", maid_info)
+            trace("✅ Maid Info:", maid_info)
 
             maid_id = maid_info.get("id")
             uniqueId = maid_info.get("uniqueId")
@@ -198,48 +196,30 @@ class GenerateUserEmbeddingsViewForm(APIView):
             if not maid_video:
                 return Response({"error": "No maid video uploaded"}, status=400)
 
-            # Save temporary file
-            temp_path = os.path.join(tempfile.gettempdir(), f"maid_{maid_id}.mp4")
-            with open(temp_path, "wb") as f:
-                for chunk in maid_video.chunks():
-                    f.write(chunk)
-
-            print("📁 Video temporarily saved at:", temp_path)
-
-            # 3️⃣ Validate + extract frames
-            valid, frames = validate_and_trim_video(temp_path)
-            os.remove(temp_path)
-
-            if not valid or not frames:
-                return Response({"error": "No valid frames found in video"}, status=400)
-
-            embeddings_saved = 0
-
-            # 4️⃣ Generate embeddings per detected face
-            for i, frame in enumerate(frames):
-                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                result = face_detection.process(rgb)
-                if result.detections:
-                    for det in result.detections:
-                        ih, iw, _ = frame.shape
-                        box = det.location_data.relative_bounding_box
-                        x, y, w, h = (
-                            int(box.xmin * iw),
-                            int(box.ymin * ih),
-                            int(box.width * iw),
-                            int(box.height * ih)
-                        )
-                        x, y = max(0, x), max(0, y)
-                        crop = frame[y:min(y+h, ih), x:min(x+w, iw)]
-
-                        rep = DeepFace.represent(crop, model_name='Facenet', enforce_detection=False)
-                        if rep and isinstance(rep, list):
-                            for emb in rep:
-                                save_user_embeddings(server_name, uniqueId, maid_mobile, emb['embedding'], i+1)
-                                embeddings_saved += 1
-
-            if embeddings_saved == 0:
-                return Response({"error": "No faces detected. Embeddings not generated."}, status=400)
+            # 3️⃣ Queue the video for the background registration pool and hand back a job id
+            if settings.REGISTRATION_ASYNC:
+                with metrics.stage("register_enqueue"):
+                    job = jobs.create_job(maid_video, server_name, uniqueId, maid_id, maid_name, maid_mobile)
+                trace(f"📥 Registration job {job.job_id} queued for {maid_mobile}")
+                return Response({
+                    "message": f"⏳ Registration queued for {maid_name}",
+                    "job_id": str(job.job_id),
+                    "status": job.status,
+                    "status_url": f"/form/status/{job.job_id}/",
+                    "maid_id": maid_id,
+                    "uniqueId": uniqueId,
+                    "serverName": server_name,
+                }, status=202)
+
+            # 4️⃣ Or run the pipeline inline: detect, batch-embed, keep a diverse subset, store it in one write
+            # (the video pipeline needs OpenCV; imported here so loading the URLconf stays light)
+            from .embeddings_gen import RegistrationError, register_from_video, uploaded_video_path
+
+            try:
+                with uploaded_video_path(maid_video) as video_path:
+                    _, _, embeddings_saved = register_from_video(video_path, server_name, uniqueId, maid_mobile)
+            except RegistrationError as e:
+                return Response({"error": str(e)}, status=400)
 
             # 5️⃣ Log to FastAPI (optional)
             # try:
@@ -270,3 +250,13 @@ class GenerateUserEmbeddingsViewForm(APIView):
         except Exception as e:
             print("❌ Exception in GenerateUserEmbeddingsViewForm:", e)
             return Response({"error": str(e)}, status=500)
+
+
+class RegistrationJobStatusView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request, job_id):
+        job = RegistrationJob.objects.filter(job_id=job_id).first()
+        if job is None:
+            return Response({"error": "Unknown job id"}, status=404)
+        return Response(job.as_dict())